@@ -0,0 +1,275 @@
+"""Benchmark reproducible de todas las rutas de main.py.
+
+Recorre cada ruta con el cliente de pruebas de Flask, primero en serie y luego
+con varios hilos en paralelo. Informa latencias p50/p95/p99 y sentencias SQL
+por petición, y compara contra una línea base guardada: si alguna ruta empeora
+más allá de la tolerancia, el proceso termina con código 1.
+
+Se usa la base que genera datos_prueba.py por defecto (la de la aplicación con
+el sufijo `_prueba`), o la indicada con --uri. Las rutas de escritura registran asistencia del día actual.
+
+Uso:
+    python datos_prueba.py --alumnos 1200 --dias 120
+    python benchmark.py --guardar-baseline      # primera vez
+    python benchmark.py                         # compara contra benchmark_baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import datos_prueba
+import main
+
+RUTA_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    k = max(0, min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[k]
+
+
+def muestra_ids():
+    """Elige un profesor, una de sus clases y un alumno inscrito en ella."""
+    with main.app.app_context():
+        fila = main.execute_query('''
+            SELECT c.profesor_id, c.id, i.alumno_id, u.email
+            FROM clases c
+            JOIN inscripciones i ON i.clase_id = c.id
+            JOIN usuarios u ON u.id = i.alumno_id
+            ORDER BY c.id, i.alumno_id
+            LIMIT 1
+        ''', one=True)
+        if not fila:
+            raise SystemExit('La base no tiene datos: ejecuta primero datos_prueba.py')
+        inscritos = [r[0] for r in main.execute_query(
+            'SELECT alumno_id FROM inscripciones WHERE clase_id = :clase_id', {'clase_id': fila[1]})]
+    return {'profesor_id': fila[0], 'clase_id': fila[1], 'alumno_id': fila[2], 'email': fila[3],
+            'inscritos': inscritos}
+
+
+def escenarios(ids):
+    """Cada escenario: (nombre, endpoint, función que recibe el cliente y devuelve (método, url, kwargs))."""
+    p, c, a = ids['profesor_id'], ids['clase_id'], ids['alumno_id']
+
+    def sesion_profesor():
+        # Firmado en el proceso: no cuesta un login (hash de contraseña) por petición
+        return {'Authorization': f"Bearer {main.firmar_token_sesion(p, 'profesor')}"}
+
+    def sesion_alumno():
+        return {'Authorization': f"Bearer {main.firmar_token_sesion(a, 'alumno')}"}
+
+    def codigo_qr(cliente):
+        return cliente.get(f'/profesor/{p}/clase/{c}/qr', headers=sesion_profesor()).get_json()['token']
+
+    def qr(cliente):
+        token = codigo_qr(cliente)
+        return 'POST', '/registrar-asistencia-qr', {'json': {'qrData': token, 'alumnoId': a},
+                                                    'headers': sesion_alumno()}
+
+
+    def sync_offline(cliente):
+        # Un escaneo guardado sin conexión, subido junto con el cursor actual
+        token = codigo_qr(cliente)
+        cursor = cliente.get(f'/alumno/{a}/sync').get_json()['cursor']
+        return 'POST', f'/alumno/{a}/sync', {'headers': sesion_alumno(), 'json': {'cursor': cursor, 'escaneos': [
+            {'id': 'benchmark', 'token': token, 'escaneado': time.time()}]}}
+
+    def renovar(cliente):
+        token = cliente.post('/login', json={'email': ids['email'], 'password': 'clave12345'}).get_json()['token']
+        return 'POST', '/login/renovar', {'headers': {'Authorization': f'Bearer {token}'}}
+
+    fijo = lambda metodo, url, **kwargs: (lambda cliente: (metodo, url, kwargs))
+    return [
+        ('login', 'login', fijo('POST', '/login', json={'email': ids['email'], 'password': 'clave12345'})),
+        ('change_password', 'change_password', fijo('POST', '/change-password', json={
+            'email': ids['email'], 'oldPassword': 'clave12345', 'newPassword': 'clave12345'})),
+        ('renovar_sesion', 'renovar_sesion', renovar),
+        ('clases_profesor', 'get_clases_profesor', fijo('GET', f'/profesor/{p}/clases')),
+        ('resumen_clase', 'get_resumen_clase', fijo('GET', f'/profesor/{p}/clase/{c}/resumen')),
+        ('alumnos_clase', 'get_alumnos_clase', lambda cliente: (
+            'GET', f'/clases/{c}/alumnos', {'headers': sesion_profesor()})),
+        ('clases_alumno', 'get_clases_alumno', fijo('GET', f'/alumno/{a}/clases')),
+        ('dashboard_alumno', 'get_dashboard_alumno', fijo('GET', f'/alumno/{a}/dashboard')),
+        ('dashboard_alumno_horarios', 'get_dashboard_alumno', fijo('GET', f'/alumno/{a}/dashboard?fields=horarios')),
+        ('asistencia_alumno', 'get_asistencia_alumno', fijo('GET', f'/asistencia/{a}/{c}')),
+        ('estadisticas_alumno', 'get_estadisticas_alumno', fijo('GET', f'/alumno/{a}/estadisticas')),
+        ('registrar_qr', 'registrar_asistencia_qr', qr),
+        ('generar_qr', 'generar_qr_clase', lambda cliente: (
+            'GET', f'/profesor/{p}/clase/{c}/qr', {'headers': sesion_profesor()})),
+        ('asistencia_clase', 'get_asistencia_clase', fijo('GET', f'/profesor/{p}/asistencia/{c}')),
+        ('asistencia_clase_matriz', 'get_asistencia_clase', fijo('GET', f'/profesor/{p}/asistencia/{c}?formato=matriz')),
+        ('resumen_dia', 'get_resumen_dia', fijo('GET', f'/profesor/{p}/clase/{c}/resumen-dia')),
+        # Solo la foto inicial: con duración 0 el flujo se cierra tras el resumen
+        ('en_vivo', 'get_asistencia_en_vivo', fijo('GET', f'/profesor/{p}/clase/{c}/en-vivo?duracion=0')),
+        ('registrar_profesor', 'registrar_asistencia_profesor', lambda cliente: (
+            'POST', f'/profesor/{p}/clase/{c}/asistencia',
+            {'headers': sesion_profesor(), 'json': {'alumno_id': a, 'estado': 'Presente'}})),
+        ('registrar_lote', 'registrar_asistencia_lote', lambda cliente: (
+            'POST', f'/profesor/{p}/clase/{c}/asistencia/lote', {'headers': sesion_profesor(), 'json': {
+                'asistencias': [{'alumno_id': i, 'estado': 'Presente'} for i in ids['inscritos']]}})),
+        ('exportar_clase', 'exportar_asistencia_clase', fijo('GET', f'/profesor/{p}/clase/{c}/exportar')),
+        ('exportar_profesor', 'exportar_asistencia_profesor', fijo('GET', f'/profesor/{p}/exportar?formato=ndjson')),
+        ('reporte_riesgo', 'get_reporte_riesgo', lambda cliente: (
+            'GET', '/reportes/riesgo', {'headers': sesion_profesor()})),
+        ('sesion_profesor', 'get_sesion_profesor', fijo('GET', f'/profesor/{p}/sesion')),
+        ('sesion_alumno', 'get_sesion_alumno', fijo('GET', f'/alumno/{a}/sesion')),
+        ('sync_alumno', 'sync_alumno', fijo('GET', f'/alumno/{a}/sync')),
+        ('sync_alumno_offline', 'sync_alumno', sync_offline),
+        ('horarios_clase', 'get_horarios_clase', fijo('GET', f'/clases/{c}/horarios')),
+        ('metricas', 'get_metricas', fijo('GET', '/metrics')),
+        ('debug_cola', 'debug_cola_asistencia', fijo('GET', '/debug/cola-asistencia')),
+        ('debug_horarios', 'debug_horarios', fijo('GET', f'/debug/horarios/{c}')),
+    ]
+
+
+def verificar_cobertura(lista):
+    cubiertos = {endpoint for _, endpoint, _ in lista}
+    # Una regla con la misma URL y métodos que otra registrada antes nunca se
+    # alcanza, así que no necesita escenario
+    vistas, alcanzables = set(), set()
+    for regla in main.app.url_map.iter_rules():
+        clave = (regla.rule, frozenset(regla.methods))
+        if clave not in vistas:
+            alcanzables.add(regla.endpoint)
+        vistas.add(clave)
+    faltantes = sorted(alcanzables - cubiertos - {'static'})
+    if faltantes:
+        raise SystemExit(f"Rutas sin escenario en benchmark.py: {', '.join(faltantes)}")
+
+
+def ejecutar(cliente, escenario):
+    metodo, url, kwargs = escenario[2](cliente)
+    inicio = time.perf_counter()
+    respuesta = cliente.open(url, method=metodo, **kwargs)
+    respuesta.get_data()
+    segundos = time.perf_counter() - inicio
+    if respuesta.status_code >= 400:
+        raise RuntimeError(f'{escenario[0]}: {metodo} {url} -> {respuesta.status_code} {respuesta.get_data(as_text=True)[:200]}')
+    return segundos, int(respuesta.headers.get('X-SQL-Consultas', 0))
+
+
+def serie(lista, repeticiones, calentamiento):
+    cliente = main.app.test_client()
+    resultados = {}
+    for escenario in lista:
+        for _ in range(calentamiento):
+            ejecutar(cliente, escenario)
+        tiempos, consultas = [], []
+        for _ in range(repeticiones):
+            segundos, n = ejecutar(cliente, escenario)
+            tiempos.append(segundos * 1000)
+            consultas.append(n)
+        resultados[escenario[0]] = {
+            'p50': percentil(tiempos, 50),
+            'p95': percentil(tiempos, 95),
+            'p99': percentil(tiempos, 99),
+            'consultas': max(consultas)
+        }
+    return resultados
+
+
+def carga(lista, hilos, duracion):
+    tiempos = {e[0]: [] for e in lista}
+    lock = threading.Lock()
+    fin = time.monotonic() + duracion
+
+    def trabajador(desfase):
+        cliente = main.app.test_client()
+        n = desfase
+        while time.monotonic() < fin:
+            escenario = lista[n % len(lista)]
+            segundos, _ = ejecutar(cliente, escenario)
+            with lock:
+                tiempos[escenario[0]].append(segundos * 1000)
+            n += 1
+
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        for futuro in [pool.submit(trabajador, i) for i in range(hilos)]:
+            futuro.result()
+
+    total = sum(len(t) for t in tiempos.values())
+    return {
+        'peticiones_por_segundo': total / duracion,
+        'rutas': {nombre: {'p50': percentil(t, 50), 'p95': percentil(t, 95), 'p99': percentil(t, 99)}
+                  for nombre, t in tiempos.items() if t}
+    }
+
+
+def comparar(actual, base, tolerancia, margen_ms):
+    regresiones = []
+    for nombre, medida in actual.items():
+        anterior = base.get(nombre)
+        if not anterior:
+            continue
+        if medida['consultas'] > anterior['consultas']:
+            regresiones.append(f"{nombre}: {anterior['consultas']} -> {medida['consultas']} sentencias SQL por petición")
+        limite = anterior['p95'] * (1 + tolerancia) + margen_ms
+        if medida['p95'] > limite:
+            regresiones.append(f"{nombre}: p95 {anterior['p95']:.2f} ms -> {medida['p95']:.2f} ms")
+    return regresiones
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default=datos_prueba.uri_prueba(),
+                        help='base generada con datos_prueba.py (por defecto <base>_prueba)')
+    parser.add_argument('--repeticiones', type=int, default=50)
+    parser.add_argument('--calentamiento', type=int, default=3)
+    parser.add_argument('--hilos', type=int, default=8, help='hilos de la prueba de carga (0 = omitir)')
+    parser.add_argument('--duracion', type=float, default=10.0, help='segundos de la prueba de carga')
+    parser.add_argument('--baseline', default=RUTA_BASELINE)
+    parser.add_argument('--guardar-baseline', action='store_true')
+    parser.add_argument('--tolerancia', type=float, default=0.25, help='empeoramiento relativo permitido en p95')
+    parser.add_argument('--margen-ms', type=float, default=2.0, help='margen absoluto para absorber ruido')
+    args = parser.parse_args(argv)
+
+    # TESTING: las claves de firma pueden faltar (se usan claves del proceso)
+    # SSE_SUSCRIPTORES_MAX: cada hilo de la prueba de carga puede tener un flujo abierto
+    main.create_app({'SQLALCHEMY_DATABASE_URI': args.uri, 'METRICAS_CABECERAS': True,
+                    'LIMITES_ACTIVOS': False, 'TESTING': True, 'SSE_SUSCRIPTORES_MAX': max(args.hilos, 1)})
+    lista = escenarios(muestra_ids())
+    verificar_cobertura(lista)
+
+    resultados = serie(lista, args.repeticiones, args.calentamiento)
+    print(f"{'ruta':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'sql/pet':>9}")
+    for nombre, m in resultados.items():
+        print(f"{nombre:<26}{m['p50']:>10.2f}{m['p95']:>10.2f}{m['p99']:>10.2f}{m['consultas']:>9}")
+
+    if args.hilos:
+        bajo_carga = carga(lista, args.hilos, args.duracion)
+        print(f"\nCarga con {args.hilos} hilos durante {args.duracion:.0f} s: "
+              f"{bajo_carga['peticiones_por_segundo']:.1f} peticiones/s")
+        for nombre, m in bajo_carga['rutas'].items():
+            print(f"{nombre:<26}{m['p50']:>10.2f}{m['p95']:>10.2f}{m['p99']:>10.2f}")
+
+    if args.guardar_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, sort_keys=True)
+        print(f'\nLínea base guardada en {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('\nNo hay línea base; ejecuta con --guardar-baseline para crearla')
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        base = json.load(f)
+    regresiones = comparar(resultados, base, args.tolerancia, args.margen_ms)
+    if regresiones:
+        print('\nREGRESIONES respecto de la línea base:')
+        for r in regresiones:
+            print(f'  - {r}')
+        return 1
+    print('\nSin regresiones respecto de la línea base')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,201 @@
+"""Generador de datos sintéticos de un colegio para pruebas y benchmarks.
+
+Crea el esquema de `schema.sql` en una base local, aplica las migraciones y la
+llena con N profesores, M clases, K alumnos y D días de historial de asistencia. Con la misma semilla
+y los mismos parámetros el resultado es siempre idéntico.
+
+Por defecto escribe en una base aparte, la de la aplicación con el sufijo
+`_prueba` (p. ej. `appbdd_prueba`), y se niega a borrar la base configurada de
+la aplicación salvo con `--forzar`.
+
+Uso:
+    python datos_prueba.py --profesores 20 --clases 60 --alumnos 1200 --dias 120
+"""
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, make_url, text
+from werkzeug.security import generate_password_hash
+
+import main
+import migraciones
+
+DIAS_SEMANA = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+ASIGNATURAS = ('Matemáticas', 'Lenguaje', 'Historia', 'Biología', 'Química', 'Física',
+               'Inglés', 'Música', 'Artes', 'Educación Física', 'Filosofía', 'Tecnología')
+BLOQUES = (('08:00', '09:30'), ('09:45', '11:15'), ('11:30', '13:00'), ('14:00', '15:30'), ('15:45', '17:15'))
+TABLAS = ('cambios', 'archivo_asistencias', 'archivo_periodos', 'contadores_asistencia', 'resumen_asistencia_diaria', 'asistencias', 'horarios', 'inscripciones',
+          'clases', 'alumnos', 'profesores', 'usuarios')
+TAMANO_LOTE = 5000
+
+
+def uri_aplicacion():
+    """URI de la base de la aplicación: ASISTENCIA_SQLALCHEMY_DATABASE_URI o la de main.py."""
+    return os.environ.get('ASISTENCIA_SQLALCHEMY_DATABASE_URI', main.app.config['SQLALCHEMY_DATABASE_URI'])
+
+
+def uri_prueba(uri=None):
+    """La misma URI con la base `<nombre>_prueba`: datos sintéticos fuera de la base real."""
+    url = make_url(uri or uri_aplicacion())
+    return url.set(database=f'{url.database}_prueba').render_as_string(hide_password=False)
+
+
+def es_base_aplicacion(uri):
+    aplicacion = make_url(uri_aplicacion())
+    url = make_url(uri)
+    return (url.drivername, url.host, url.port, url.database) == \
+        (aplicacion.drivername, aplicacion.host, aplicacion.port, aplicacion.database)
+
+
+def ejecutar_schema(conn):
+    ruta = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+    with open(ruta, encoding='utf-8') as f:
+        sentencias = [s.strip() for s in f.read().split(';')]
+    for sentencia in sentencias:
+        lineas = [l for l in sentencia.splitlines() if not l.strip().startswith('--')]
+        if any(l.strip() for l in lineas):
+            conn.execute(text('\n'.join(lineas)))
+
+
+def insertar(conn, tabla, columnas, filas):
+    sql = text(f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({', '.join(':' + c for c in columnas)})")
+    for inicio in range(0, len(filas), TAMANO_LOTE):
+        conn.execute(sql, [dict(zip(columnas, f)) for f in filas[inicio:inicio + TAMANO_LOTE]])
+
+
+def generar(conn, profesores, clases, alumnos, dias, inscripciones_por_alumno, semilla, hasta=None):
+    rng = random.Random(semilla)
+    hasta = hasta or date.today()
+
+    conn.execute(text('SET FOREIGN_KEY_CHECKS = 0'))
+    for tabla in TABLAS:
+        conn.execute(text(f'TRUNCATE TABLE {tabla}'))
+    conn.execute(text('SET FOREIGN_KEY_CHECKS = 1'))
+
+    # Un solo hash para todos: calcular uno por usuario tomaría minutos
+    clave = generate_password_hash('clave12345', method=main.app.config['PASSWORD_METODO'])
+    usuarios = []
+    ids_profesores = list(range(1, profesores + 1))
+    ids_alumnos = list(range(profesores + 1, profesores + alumnos + 1))
+    for i in ids_profesores:
+        usuarios.append((i, f'Profesor {i}', f'profesor{i}@ejemplo.cl', clave, 'profesor'))
+    for n, i in enumerate(ids_alumnos, 1):
+        usuarios.append((i, f'Alumno {n:05d}', f'alumno{n}@ejemplo.cl', clave, 'alumno'))
+    insertar(conn, 'usuarios', ('id', 'nombre', 'email', 'password', 'tipo'), usuarios)
+    insertar(conn, 'profesores', ('id',), [(i,) for i in ids_profesores])
+    insertar(conn, 'alumnos', ('id',), [(i,) for i in ids_alumnos])
+
+    # Clases repartidas entre los profesores, cada una con dos bloques semanales
+    filas_clases, filas_horarios, dias_clase = [], [], {}
+    for clase_id in range(1, clases + 1):
+        profesor_id = ids_profesores[(clase_id - 1) % profesores]
+        nombre = f'{rng.choice(ASIGNATURAS)} {clase_id}'
+        filas_clases.append((clase_id, nombre, profesor_id))
+        dias = rng.sample(range(5), 2)
+        dias_clase[clase_id] = set(dias)
+        for dia in dias:
+            inicio, fin = rng.choice(BLOQUES)
+            filas_horarios.append((clase_id, DIAS_SEMANA[dia], inicio, fin))
+    insertar(conn, 'clases', ('id', 'nombre', 'profesor_id'), filas_clases)
+    insertar(conn, 'horarios', ('clase_id', 'dia_semana', 'hora_inicio', 'hora_fin'), filas_horarios)
+
+    # Inscripciones y propensión de asistencia de cada alumno
+    inscritos = {clase_id: [] for clase_id in dias_clase}
+    filas_inscripciones = []
+    for alumno_id in ids_alumnos:
+        for clase_id in rng.sample(sorted(dias_clase), min(inscripciones_por_alumno, clases)):
+            inscritos[clase_id].append(alumno_id)
+            filas_inscripciones.append((alumno_id, clase_id))
+    insertar(conn, 'inscripciones', ('alumno_id', 'clase_id'), filas_inscripciones)
+    propension = {a: rng.betavariate(9, 1.5) for a in ids_alumnos}
+
+    total = 0
+    filas = []
+    for desfase in range(dias, 0, -1):
+        dia = hasta - timedelta(days=desfase)
+        for clase_id, alumnos_clase in inscritos.items():
+            if dia.weekday() not in dias_clase[clase_id]:
+                continue
+            for alumno_id in alumnos_clase:
+                estado = 'Presente' if rng.random() < propension[alumno_id] else 'Ausente'
+                filas.append((alumno_id, clase_id, dia, estado))
+        if len(filas) >= TAMANO_LOTE:
+            insertar(conn, 'asistencias', ('alumno_id', 'clase_id', 'fecha', 'estado'), filas)
+            total += len(filas)
+            filas = []
+    insertar(conn, 'asistencias', ('alumno_id', 'clase_id', 'fecha', 'estado'), filas)
+    total += len(filas)
+
+    conn.execute(text('''
+        INSERT INTO resumen_asistencia_diaria (clase_id, fecha, presentes, ausentes, total)
+        SELECT
+            clase_id,
+            fecha,
+            COUNT(DISTINCT CASE WHEN estado = 'Presente' THEN alumno_id END),
+            COUNT(DISTINCT CASE WHEN estado = 'Ausente' THEN alumno_id END),
+            COUNT(DISTINCT alumno_id)
+        FROM asistencias
+        GROUP BY clase_id, fecha
+    '''))
+    conn.execute(text('''
+        INSERT INTO contadores_asistencia
+            (alumno_id, clase_id, total, presentes, ausentes, ultima_fecha, ultimo_estado)
+        SELECT
+            alumno_id,
+            clase_id,
+            COUNT(*),
+            SUM(CASE WHEN estado = 'Presente' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN estado = 'Ausente' THEN 1 ELSE 0 END),
+            MAX(fecha),
+            SUBSTRING_INDEX(GROUP_CONCAT(estado ORDER BY fecha DESC), ',', 1)
+        FROM asistencias
+        GROUP BY alumno_id, clase_id
+    '''))
+    # Con los triggers de la migración 0008 la carga llenó el log de cambios:
+    # el historial generado es el punto de partida, no cambios a sincronizar
+    conn.execute(text('TRUNCATE TABLE cambios'))
+    return {
+        'profesores': profesores,
+        'clases': clases,
+        'alumnos': alumnos,
+        'inscripciones': len(filas_inscripciones),
+        'asistencias': total
+    }
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default=uri_prueba(),
+                        help='URI de la base de datos (se borran sus datos; por defecto <base>_prueba)')
+    parser.add_argument('--forzar', action='store_true',
+                        help='permitir borrar la base configurada de la aplicación')
+    parser.add_argument('--profesores', type=int, default=20)
+    parser.add_argument('--clases', type=int, default=60)
+    parser.add_argument('--alumnos', type=int, default=1200)
+    parser.add_argument('--dias', type=int, default=120, help='días de historial hacia atrás')
+    parser.add_argument('--inscripciones-por-alumno', type=int, default=6)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--hasta', type=date.fromisoformat, default=None,
+                        help='último día del historial (YYYY-MM-DD, por defecto hoy)')
+    args = parser.parse_args(argv)
+    if es_base_aplicacion(args.uri) and not args.forzar:
+        parser.error(f'{make_url(args.uri).database} es la base de la aplicación y se borrarían sus datos; '
+                     'usar otra --uri o agregar --forzar')
+
+    engine = create_engine(args.uri)
+    with engine.begin() as conn:
+        ejecutar_schema(conn)
+    # schema.sql no trae las claves únicas que usan los upserts, los índices
+    # ni los triggers que llenan `cambios`: sin ellos las rutas y el benchmark
+    # no se comportan como en producción
+    migraciones.aplicar(engine)
+    with engine.begin() as conn:
+        resumen = generar(conn, args.profesores, args.clases, args.alumnos, args.dias,
+                          args.inscripciones_por_alumno, args.semilla, args.hasta)
+    print(', '.join(f'{k}: {v}' for k, v in resumen.items()))
+
+
+if __name__ == '__main__':
+    main_cli()
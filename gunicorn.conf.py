@@ -0,0 +1,68 @@
+"""Configuración de gunicorn para servir wsgi:app con varios workers pre-fork.
+
+Cada worker tiene su propio pool de conexiones, así que el máximo de conexiones
+abiertas contra MySQL es:
+
+    GUNICORN_WORKERS * (ASISTENCIA_DB_POOL_SIZE + ASISTENCIA_DB_MAX_OVERFLOW)
+
+y debe quedar bajo `max_connections` del servidor. Con hilos (gthread), el
+pool de cada worker debería tener al menos GUNICORN_THREADS conexiones.
+
+Uso:
+    gunicorn -c gunicorn.conf.py wsgi:app
+    GUNICORN_WORKER_CLASS=gevent GUNICORN_BIND=127.0.0.1:5001 gunicorn -c gunicorn.conf.py wsgi:app  # /en-vivo
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))  # solo gevent
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# Los flujos SSE (/en-vivo) los atiende una instancia aparte con workers
+# gevent, donde cada flujo abierto es una greenlet en espera y no un hilo. Con
+# gthread cada flujo retendría un hilo de petición: esos workers los rechazan
+# con 503 y el proxy debe enviar /en-vivo a la instancia gevent
+os.environ.setdefault('ASISTENCIA_SSE_SUSCRIPTORES_MAX', str(
+    worker_connections // 2 if worker_class == 'gevent' else 0))
+# Cada worker tiene sus métricas: las deja en este directorio y /metrics las
+# une con la etiqueta pid, sin importar qué worker atienda el scrape
+metricas_directorio = os.environ.setdefault('ASISTENCIA_METRICAS_DIRECTORIO', os.path.join(
+    tempfile.gettempdir(), f'asistencia-metricas-{os.getpid()}'))
+graceful_timeout = 30  # tiempo para volcar la cola de escritura diferida al apagar
+keepalive = 5
+
+# Cargar la aplicación en el maestro ahorra memoria y tiempo de arranque. Con
+# gevent no se precarga: el parcheo de la biblioteca estándar debe ocurrir
+# antes de importar la aplicación
+preload_app = worker_class != 'gevent'
+
+
+def post_fork(server, worker):
+    # El engine se creó en el maestro: descartar las conexiones heredadas para
+    # que cada worker abra las suyas en un pool propio
+    from main import app, db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def on_starting(server):
+    os.makedirs(metricas_directorio, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Las series del worker terminado dejan de exponerse; su reemplazo tiene otro pid
+    try:
+        os.remove(os.path.join(metricas_directorio, f'{worker.pid}.prom'))
+    except FileNotFoundError:
+        pass
+
+
+def on_exit(server):
+    shutil.rmtree(metricas_directorio, ignore_errors=True)
@@ -1,30 +1,2078 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_request_context, has_app_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from flask_cors import CORS
+import click
 import pymysql
-from sqlalchemy import text
+from sqlalchemy import text, event, exc, engine_from_config
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import generate_password_hash, check_password_hash
+from collections import OrderedDict
+from concurrent import futures
+from functools import wraps
+import atexit
+import base64
+import csv
+import hashlib
+import hmac
+import io
+import itertools
 import json
+import logging
+import math
+import os
+import queue
+import secrets
+import sqlite3
+import threading
 import time
 import re
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # opcional: solo lo usa el reporte de alumnos en riesgo
+    np = None
 
 pymysql.install_as_MySQLdb()
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Siguiente-Cursor', 'ETag', 'Retry-After'])
 
+# Valores por defecto. `create_app()` los reemplaza con las variables de
+# entorno ASISTENCIA_<OPCIÓN> (p. ej. ASISTENCIA_DB_POOL_SIZE=20) y con el
+# diccionario que reciba
 app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:@localhost/appbdd?charset=utf8mb4'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+# Pool de conexiones por proceso: workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# debe quedar bajo max_connections de MySQL
+app.config['DB_POOL_SIZE'] = 10
+app.config['DB_MAX_OVERFLOW'] = 5
+app.config['DB_POOL_TIMEOUT'] = 10             # segundos esperando una conexión libre
+app.config['DB_POOL_RECYCLE'] = 280            # segundos; menor que wait_timeout de MySQL
+app.config['DB_POOL_PRE_PING'] = True          # descarta conexiones cortadas por el servidor
+
+# Réplica de lectura (opcional): las rutas marcadas con @solo_lectura consultan
+# el bind LECTURA_BIND si está definido, p. ej.
+# ASISTENCIA_SQLALCHEMY_BINDS='{"replica": "mysql+pymysql://root:@replica/appbdd?charset=utf8mb4"}'
+app.config['SQLALCHEMY_BINDS'] = {}
+app.config['LECTURA_BIND'] = 'replica'
+app.config['LECTURA_PRIMARIA_SEGUNDOS'] = 5    # tras escribir, leer esos datos de la primaria
+
+# Escritura diferida de asistencias QR (opcional): los escaneos válidos se
+# encolan y un hilo en segundo plano los vuelca en lotes
+app.config['QR_ESCRITURA_DIFERIDA'] = False
+app.config['QR_COLA_MAX'] = 10000          # escaneos pendientes como máximo
+app.config['QR_LOTE_MAX'] = 500            # filas por volcado
+app.config['QR_INTERVALO_VOLCADO'] = 0.5   # segundos máximos de espera
+
+# Firma de los códigos QR (la clave debe ser la misma en todos los procesos).
+# Sin valor por defecto: create_app() no arranca sin ella salvo en DEBUG o TESTING
+app.config['QR_SECRET_KEY'] = os.environ.get('QR_SECRET_KEY')
+app.config['QR_VALIDEZ_SEGUNDOS'] = 300
+
+# Contraseñas: hash con sal (werkzeug) verificado en un pool acotado de hilos.
+# `flask --app wsgi medir-hash` mide el costo de cada método en este servidor
+app.config['PASSWORD_METODO'] = 'pbkdf2:sha256:600000'
+app.config['PASSWORD_HILOS'] = 2               # verificaciones simultáneas por proceso
+app.config['PASSWORD_PENDIENTES_MAX'] = 32     # en espera de turno; el resto recibe 503
+app.config['PASSWORD_ESPERA_MAX'] = 5.0        # segundos máximos esperando el resultado
+
+# Tokens de sesión firmados que entrega /login (se verifican en memoria). Sin
+# valor por defecto, como QR_SECRET_KEY
+app.config['SESION_SECRET_KEY'] = os.environ.get('SESION_SECRET_KEY')
+app.config['SESION_VALIDEZ_SEGUNDOS'] = 900    # vida de cada token; se renueva con /login/renovar
+app.config['SESION_DURACION_MAX'] = 12 * 3600  # desde el login, después hay que volver a ingresar
+app.config['SESION_OBLIGATORIA'] = False       # exigir token en todas las rutas salvo las públicas
+
+# Índice en memoria de profesor -> clases y clase -> alumnos
+app.config['INDICE_ACCESO_TTL'] = 60           # segundos hasta recargar
+app.config['INDICE_ACCESO_REFRESCO_MIN'] = 5   # recarga ante un fallo, como mucho cada N segundos
+app.config['HORARIOS_TTL'] = 300               # segundos hasta recargar el índice de horarios
+
+# Rechazar escaneos QR fuera del horario de la clase (opcional)
+app.config['QR_VALIDAR_HORARIO'] = False
+app.config['QR_MARGEN_HORARIO_MIN'] = 15       # minutos de holgura antes y después del bloque
+
+# Caché de lectura para rutas consultadas constantemente por la app
+app.config['CACHE_MAX_ENTRADAS'] = 5000
+app.config['CACHE_TTL'] = 60                   # segundos
+app.config['CACHE_SQLITE_RUTA'] = os.environ.get('CACHE_SQLITE_RUTA')  # almacén compartido entre procesos (opcional)
+
+# Flujo en vivo (Server-Sent Events) de la asistencia del día
+app.config['SSE_LATIDO_SEGUNDOS'] = 15         # comentario de latido si no hay eventos
+app.config['SSE_DURACION_MAX'] = 3600          # el cliente se reconecta solo al cerrarse
+app.config['SSE_COLA_MAX'] = 100               # eventos pendientes por suscriptor
+app.config['SSE_SUSCRIPTORES_MAX'] = 2         # flujos abiertos por proceso; el resto recibe 503
+app.config['SSE_INTERVALO_REPARTO'] = 0.5      # con CACHE_SQLITE_RUTA: cada cuánto se leen los eventos de otros procesos
+
+# Reporte de alumnos en riesgo (requiere numpy)
+app.config['RIESGO_UMBRAL'] = 85.0             # porcentaje de asistencia mínimo
+app.config['RIESGO_RACHA'] = 3                 # ausencias consecutivas que alertan
+app.config['RIESGO_VENTANA_DIAS'] = 120        # historial considerado por defecto
+app.config['RIESGO_CACHE_TTL'] = 900           # segundos; una escritura lo invalida antes
+
+# Archivo de períodos cerrados (flask --app wsgi archivar-periodo)
+app.config['ARCHIVO_TTL'] = 300                # segundos hasta releer el corte del archivo
+app.config['ARCHIVO_LOTE'] = 1000              # filas de archivo_asistencias por INSERT
+
+# Sincronización incremental de la app (GET/POST /alumno/<id>/sync)
+app.config['SYNC_CAMBIOS_MAX'] = 500           # cambios por respuesta; el resto en la siguiente
+app.config['SYNC_MARGEN_SEGUNDOS'] = 2         # el cursor no avanza sobre cambios más recientes
+app.config['SYNC_HISTORIAL_DIAS'] = 30         # asistencias incluidas en una sincronización completa
+app.config['SYNC_ESCANEOS_MAX'] = 200          # escaneos offline por subida
+app.config['SYNC_OFFLINE_MAX_HORAS'] = 72      # antigüedad máxima de un escaneo offline
+app.config['SYNC_CIERRE_HORAS'] = 12           # tras el fin de la clase, el día se cierra a escaneos offline
+app.config['SYNC_RETENCION_DIAS'] = 30         # `flask podar-cambios` borra el log más antiguo
+
+# Proxies inversos delante de la aplicación (nginx, balanceador). Con 0 se
+# ignora X-Forwarded-For y la IP es la de la conexión
+app.config['PROXY_SALTOS'] = 0
+
+# Límites de tasa en memoria: (ráfaga máxima, tokens por segundo)
+app.config['LIMITES_ACTIVOS'] = True
+app.config['LIMITE_LOGIN_USUARIO'] = (5, 0.1)      # por email: 5 intentos, luego 1 cada 10 s
+app.config['LIMITE_LOGIN_IP'] = (20, 1.0)
+app.config['LIMITE_LOGIN_GLOBAL'] = (200, 100.0)
+app.config['LIMITE_QR_ALUMNO'] = (5, 0.5)
+app.config['LIMITE_QR_CLASE'] = (120, 20.0)        # un curso completo escaneando a la vez
+app.config['LIMITE_QR_GLOBAL'] = (2000, 500.0)
+app.config['LIMITE_QR_INVALIDO'] = (20, 1.0)        # por IP: códigos con firma o vigencia inválida
+app.config['ESCRITURA_CONCURRENCIA_MAX'] = 8       # escrituras QR simultáneas (menor que el pool)
+app.config['ESCRITURA_ESPERA_MAX'] = 0.05          # segundos esperando turno antes de responder 503
+
+# Instrumentación
+app.config['SQL_LENTO_UMBRAL_MS'] = 200        # sentencias más lentas van al log de consultas lentas
+app.config['METRICAS_CABECERAS'] = False       # añade X-SQL-Consultas / -Tiempo-Ms / -Filas a las respuestas
+app.config['METRICAS_DIRECTORIO'] = None        # con varios workers: directorio compartido donde cada uno deja sus métricas
+app.config['METRICAS_VOLCADO_SEGUNDOS'] = 5     # cada cuánto escribe un worker sus métricas en ese directorio
+
+db = SQLAlchemy()
+
+log_sql_lento = logging.getLogger('asistencia.sql_lento')
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.conteos = [0] * len(buckets)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for n, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.conteos[n] += 1
+        self.suma += valor
+        self.total += 1
+
+    def lineas(self, nombre, base):
+        lineas = [f'{nombre}_bucket{{{base},le="{limite}"}} {conteo}'
+                  for limite, conteo in zip(self.buckets, self.conteos)]
+        lineas.append(f'{nombre}_bucket{{{base},le="+Inf"}} {self.total}')
+        lineas.append(f'{nombre}_sum{{{base}}} {self.suma}')
+        lineas.append(f'{nombre}_count{{{base}}} {self.total}')
+        return lineas
+
+class Metricas:
+    """Métricas en memoria del proceso, expuestas en formato de texto de Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencia = {}        # (endpoint, método) -> Histograma de segundos
+        self.consultas = {}       # endpoint -> Histograma de sentencias SQL por petición
+        self.peticiones = {}      # (endpoint, método, status) -> total
+        self.sql = {}             # endpoint -> [sentencias, segundos, filas]
+        self.sql_lentas = 0
+        self.colectores = []      # funciones que devuelven líneas adicionales
+        self._volcando = threading.Lock()
+        self._ultimo_volcado = 0.0
+
+    def registrar_peticion(self, endpoint, metodo, status, segundos, consultas):
+        with self._lock:
+            self.latencia.setdefault((endpoint, metodo), Histograma(BUCKETS_LATENCIA)).observar(segundos)
+            self.consultas.setdefault(endpoint, Histograma(BUCKETS_CONSULTAS)).observar(consultas)
+            clave = (endpoint, metodo, status)
+            self.peticiones[clave] = self.peticiones.get(clave, 0) + 1
+
+    def registrar_sql(self, endpoint, segundos, filas, lenta):
+        with self._lock:
+            acumulado = self.sql.setdefault(endpoint, [0, 0.0, 0])
+            acumulado[0] += 1
+            acumulado[1] += segundos
+            acumulado[2] += filas
+            if lenta:
+                self.sql_lentas += 1
+
+    def exportar(self):
+        lineas = []
+
+        def histograma(nombre, ayuda, datos, etiquetas):
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} histogram')
+            for valores, h in sorted(datos.items()):
+                valores = valores if isinstance(valores, tuple) else (valores,)
+                base = ','.join(f'{e}="{v}"' for e, v in zip(etiquetas, valores))
+                lineas.extend(h.lineas(nombre, base))
+
+        with self._lock:
+            histograma('asistencia_http_request_duration_seconds', 'Latencia de las peticiones por ruta.',
+                       self.latencia, ('endpoint', 'method'))
+            histograma('asistencia_sql_statements_per_request', 'Sentencias SQL ejecutadas por petición.',
+                       self.consultas, ('endpoint',))
+            lineas.append('# HELP asistencia_http_requests_total Peticiones atendidas.')
+            lineas.append('# TYPE asistencia_http_requests_total counter')
+            for (endpoint, metodo, status), total in sorted(self.peticiones.items()):
+                lineas.append(f'asistencia_http_requests_total{{endpoint="{endpoint}",method="{metodo}",status="{status}"}} {total}')
+            for indice, (nombre, ayuda) in enumerate((
+                    ('asistencia_sql_statements_total', 'Sentencias SQL ejecutadas.'),
+                    ('asistencia_sql_duration_seconds_total', 'Tiempo total en la base de datos.'),
+                    ('asistencia_sql_rows_total', 'Filas devueltas o afectadas.'))):
+                lineas.append(f'# HELP {nombre} {ayuda}')
+                lineas.append(f'# TYPE {nombre} counter')
+                for endpoint, acumulado in sorted(self.sql.items()):
+                    lineas.append(f'{nombre}{{endpoint="{endpoint}"}} {acumulado[indice]}')
+            lineas.append('# HELP asistencia_sql_slow_statements_total Sentencias sobre el umbral de consulta lenta.')
+            lineas.append('# TYPE asistencia_sql_slow_statements_total counter')
+            lineas.append(f'asistencia_sql_slow_statements_total {self.sql_lentas}')
+
+        for colector in self.colectores:
+            lineas.extend(colector())
+        return '\n'.join(lineas) + '\n'
+
+    def volcar(self, directorio, cada=0):
+        """Escribe la exposición del proceso en <directorio>/<pid>.prom, como
+        mucho una vez cada `cada` segundos; si otro hilo ya la escribe, no espera."""
+        if time.monotonic() - self._ultimo_volcado < cada or not self._volcando.acquire(blocking=False):
+            return
+        try:
+            ruta = os.path.join(directorio, f'{os.getpid()}.prom')
+            with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(self.exportar())
+            os.replace(ruta + '.tmp', ruta)
+            self._ultimo_volcado = time.monotonic()
+        finally:
+            self._volcando.release()
+
+def exportar_procesos(directorio):
+    """Une las métricas que dejó cada worker en `directorio`, con la etiqueta
+    pid en cada muestra. Agrupa las muestras por familia: el formato de
+    Prometheus no admite la misma familia repartida en varios bloques."""
+    familias = {}    # nombre -> (cabeceras, muestras)
+    for archivo in sorted(os.listdir(directorio)):
+        if not archivo.endswith('.prom'):
+            continue
+        pid = archivo[:-len('.prom')]
+        try:
+            with open(os.path.join(directorio, archivo), encoding='utf-8') as f:
+                lineas = f.read().splitlines()
+        except OSError:
+            continue  # el worker terminó entre el listado y la lectura
+        familia = familias.setdefault('', ([], []))
+        for linea in lineas:
+            if linea.startswith('# '):
+                familia = familias.setdefault(linea.split(' ', 3)[2], ([], []))
+                if linea not in familia[0]:
+                    familia[0].append(linea)
+            elif linea:
+                nombre, etiquetas, valor = re.match(r'([^{ ]+)(?:\{(.*)\})? (.*)', linea).groups()
+                etiquetas = f'pid="{pid}",{etiquetas}' if etiquetas else f'pid="{pid}"'
+                familia[1].append(f'{nombre}{{{etiquetas}}} {valor}')
+    return '\n'.join(l for cabeceras, muestras in familias.values() for l in cabeceras + muestras) + '\n'
+
+metricas = Metricas()
+
+BUCKETS_ESPERA_POOL = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+class PoolMedido(QueuePool):
+    """QueuePool que mide cuánto espera cada petición por una conexión libre."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.espera = Histograma(BUCKETS_ESPERA_POOL)
+        self.agotados = 0
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexion = super()._do_get()
+        except exc.TimeoutError:
+            self.agotados += 1
+            raise
+        self.espera.observar(time.perf_counter() - inicio)
+        return conexion
+
+def normalizar_sql(sql):
+    """Quita literales y espacios para agrupar sentencias equivalentes en el log."""
+    sql = re.sub(r"'(?:[^'\\]|\\.|'')*'", '?', sql)
+    sql = re.sub(r'%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b', '?', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+def _endpoint_actual():
+    if has_request_context():
+        return request.endpoint or 'no_encontrado'
+    return 'segundo_plano'
+
+# Un solo valor por conexión: las sentencias de una conexión no se anidan, y
+# si una falla (no hay after_cursor_execute) la siguiente lo reemplaza
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info['inicio_consulta'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    segundos = time.perf_counter() - conn.info.pop('inicio_consulta')
+    filas = max(cursor.rowcount or 0, 0)
+    lenta = segundos * 1000 >= app.config['SQL_LENTO_UMBRAL_MS']
+    endpoint = _endpoint_actual()
+    if lenta:
+        log_sql_lento.warning('%.1f ms [%s] %s', segundos * 1000, endpoint, normalizar_sql(statement))
+    metricas.registrar_sql(endpoint, segundos, filas, lenta)
+    if has_request_context() and 'sql_consultas' in g:
+        g.sql_consultas += 1
+        g.sql_tiempo += segundos
+        g.sql_filas += filas
+
+@app.before_request
+def _iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+    g.sql_consultas = 0
+    g.sql_tiempo = 0.0
+    g.sql_filas = 0
+
+@app.after_request
+def _registrar_medicion(response):
+    if 'inicio_peticion' in g:
+        metricas.registrar_peticion(
+            _endpoint_actual(), request.method, response.status_code,
+            time.perf_counter() - g.inicio_peticion, g.sql_consultas
+        )
+        if app.config['METRICAS_CABECERAS']:
+            response.headers['X-SQL-Consultas'] = str(g.sql_consultas)
+            response.headers['X-SQL-Tiempo-Ms'] = f'{g.sql_tiempo * 1000:.2f}'
+            response.headers['X-SQL-Filas'] = str(g.sql_filas)
+            response.headers['X-SQL-Bind'] = g.get('bind_lectura') or 'principal'
+    if app.config['METRICAS_DIRECTORIO']:
+        try:
+            metricas.volcar(app.config['METRICAS_DIRECTORIO'], app.config['METRICAS_VOLCADO_SEGUNDOS'])
+        except OSError as e:
+            print(f"Error al volcar métricas: {str(e)}")
+    return response
+
+ESTADOS_ASISTENCIA = ('Presente', 'Ausente')
+
+# Códigos de una letra para el formato matriz (una celda por alumno y fecha)
+CODIGOS_ESTADO = {'Presente': 'P', 'Ausente': 'A'}
+SIN_REGISTRO = '-'
+
+def _engine_lectura():
+    """Engine de la réplica si la ruta actual se marcó para leer de ella."""
+    bind = g.get('bind_lectura') if has_app_context() else None
+    return db.engines[bind] if bind else None
 
 def execute_query(query, args=(), one=False):
-    result = db.session.execute(text(query), args)
+    engine = _engine_lectura()
+    result = db.session.execute(text(query), args, bind_arguments={'bind': engine} if engine else None)
     if one:
         return result.fetchone()
     return result.fetchall()
 
+def parametros_paginacion(limite_defecto, limite_max):
+    """Lee `limit`, `before` (cursor exclusivo), `desde` y `hasta` de la query string.
+
+    Devuelve (limit, before, desde, hasta) o lanza ValueError si algún valor es inválido.
+    """
+    try:
+        limite = int(request.args.get('limit', limite_defecto))
+    except ValueError:
+        raise ValueError('limit debe ser un número entero')
+    if limite < 1:
+        raise ValueError('limit debe ser mayor que cero')
+    fechas = []
+    for nombre in ('before', 'desde', 'hasta'):
+        valor = request.args.get(nombre)
+        try:
+            fechas.append(date.fromisoformat(valor) if valor else None)
+        except ValueError:
+            raise ValueError(f'{nombre} debe tener el formato YYYY-MM-DD')
+    return (min(limite, limite_max), *fechas)
+
+def filtro_fechas(columna, before, desde, hasta):
+    """Condiciones SQL (sargables) y parámetros para el rango y cursor de fechas."""
+    condiciones, params = [], {}
+    if before:
+        condiciones.append(f'AND {columna} < :before')
+        params['before'] = before
+    if desde:
+        condiciones.append(f'AND {columna} >= :desde')
+        params['desde'] = desde
+    if hasta:
+        condiciones.append(f'AND {columna} <= :hasta')
+        params['hasta'] = hasta
+    return '\n'.join(condiciones), params
+
+def respuesta_paginada(datos, siguiente):
+    respuesta = jsonify(datos)
+    if siguiente:
+        respuesta.headers['X-Siguiente-Cursor'] = siguiente.strftime('%Y-%m-%d')
+    return respuesta
+
+def stream_query(query, args=()):
+    """Itera las filas con un cursor de servidor sin buffer (SSCursor de PyMySQL).
+
+    Usa una conexión propia para no retener la sesión mientras se transmite la
+    respuesta; la memoria se mantiene constante sin importar cuántas filas haya.
+    """
+    with (_engine_lectura() or db.engine).connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=500).execute(text(query), args)
+        for row in result:
+            yield row
+
+def upsert_asistencias(clase_id, filas, fecha=None):
+    """Inserta o actualiza varias asistencias de un día con un único INSERT multi-fila.
+
+    `filas` es una lista de tuplas (alumno_id, estado). Sin `fecha` se usa
+    CURRENT_DATE. No hace commit: el llamador decide cuándo cerrar la
+    transacción.
+    """
+    if not filas:
+        return
+    valores = []
+    params = {'clase_id': clase_id, 'fecha': fecha}
+    columna_fecha = ':fecha' if fecha else 'CURRENT_DATE'
+    for n, (alumno_id, estado) in enumerate(filas):
+        valores.append(f'(:alumno_id_{n}, :clase_id, {columna_fecha}, :estado_{n})')
+        params[f'alumno_id_{n}'] = alumno_id
+        params[f'estado_{n}'] = estado
+    db.session.execute(text(f'''
+        INSERT INTO asistencias (alumno_id, clase_id, fecha, estado)
+        VALUES {', '.join(valores)}
+        ON DUPLICATE KEY UPDATE estado = VALUES(estado)
+    '''), params)
+
+def bloquear_resumen_diario(clase_id, fecha=None):
+    """Crea si falta y bloquea la fila de resumen_asistencia_diaria de la clase y el día.
+
+    Es el primer bloqueo de toda escritura de asistencias: los escritores de
+    una misma clase y día esperan en esta fila en vez de cruzar bloqueos
+    sobre los rangos de `asistencias`.
+    """
+    db.session.execute(text('''
+        INSERT INTO resumen_asistencia_diaria (clase_id, fecha, presentes, ausentes, total)
+        VALUES (:clase_id, COALESCE(:fecha, CURRENT_DATE), 0, 0, 0)
+        ON DUPLICATE KEY UPDATE total = total
+    '''), {'clase_id': clase_id, 'fecha': fecha})
+
+def estados_previos(clase_id, alumno_ids, fecha=None):
+    """Estado ya registrado de cada alumno en la clase y el día, {alumno_id: estado}.
+
+    Lectura con bloqueo por la clave única: se hace con la fila de resumen ya
+    bloqueada, así que ningún otro escritor de la clase y el día compite por
+    las mismas filas.
+    """
+    marcadores, params = lista_sql('alumno_id', sorted(alumno_ids))
+    return dict(db.session.execute(text(f'''
+        SELECT alumno_id, estado
+        FROM asistencias
+        WHERE clase_id = :clase_id
+        AND fecha = COALESCE(:fecha, CURRENT_DATE)
+        AND alumno_id IN {marcadores}
+        FOR UPDATE
+    '''), {'clase_id': clase_id, 'fecha': fecha, **params}).fetchall())
+
+def actualizar_resumen_diario(clase_id, fecha, presentes, ausentes, total):
+    """Suma los deltas a la fila de resumen de la clase y el día, que
+    `bloquear_resumen_diario` ya creó y bloqueó en esta transacción."""
+    if not (presentes or ausentes or total):
+        return
+    db.session.execute(text('''
+        UPDATE resumen_asistencia_diaria
+        SET presentes = presentes + :presentes,
+            ausentes = ausentes + :ausentes,
+            total = total + :total
+        WHERE clase_id = :clase_id
+        AND fecha = COALESCE(:fecha, CURRENT_DATE)
+    '''), {'clase_id': clase_id, 'fecha': fecha, 'presentes': presentes,
+          'ausentes': ausentes, 'total': total})
+
+def _sql_contadores(filtro=''):
+    """SELECT de las filas de contadores_asistencia: el historial vivo de
+    `asistencias` más los agregados de los períodos archivados.
+
+    `filtro` son condiciones adicionales sobre alumno_id/clase_id.
+    """
+    return f'''
+        SELECT
+            alumno_id,
+            clase_id,
+            SUM(total),
+            SUM(presentes),
+            SUM(ausentes),
+            MAX(ultima_fecha),
+            SUBSTRING_INDEX(GROUP_CONCAT(ultimo_estado ORDER BY ultima_fecha DESC), ',', 1)
+        FROM (
+            SELECT
+                alumno_id,
+                clase_id,
+                COUNT(*) as total,
+                SUM(CASE WHEN estado = 'Presente' THEN 1 ELSE 0 END) as presentes,
+                SUM(CASE WHEN estado = 'Ausente' THEN 1 ELSE 0 END) as ausentes,
+                MAX(fecha) as ultima_fecha,
+                SUBSTRING_INDEX(GROUP_CONCAT(estado ORDER BY fecha DESC), ',', 1) as ultimo_estado
+            FROM asistencias
+            WHERE 1 = 1 {filtro}
+            GROUP BY alumno_id, clase_id
+            UNION ALL
+            SELECT alumno_id, clase_id, total, presentes, ausentes, ultima_fecha, ultimo_estado
+            FROM archivo_asistencias
+            WHERE 1 = 1 {filtro}
+        ) t
+        GROUP BY alumno_id, clase_id
+    '''
+
+def actualizar_contadores(clase_id, estados, previos, fecha=None):
+    """Aplica a contadores_asistencia el cambio de estado de unos alumnos en
+    una clase y un día, sin releer su historial.
+
+    `estados` y `previos` son {alumno_id: estado} después y antes de escribir
+    (ver estados_previos). Solo se tocan los alumnos cuyo estado cambió: un
+    alumno nuevo en el día suma 1 al total, y un cambio de estado mueve 1
+    entre presentes y ausentes. Debe llamarse en la misma transacción que
+    modificó las asistencias; `flask reconstruir-contadores` recalcula todo si
+    la tabla se desajusta.
+    """
+    cambios = [(a, e, previos.get(a)) for a, e in sorted(estados.items()) if previos.get(a) != e]
+    if not cambios:
+        return
+    valores = []
+    params = {'clase_id': clase_id, 'fecha': fecha}
+    columna_fecha = ':fecha' if fecha else 'CURRENT_DATE'
+    for n, (alumno_id, estado, previo) in enumerate(cambios):
+        valores.append(f'(:alumno_id_{n}, :clase_id, :total_{n}, :presentes_{n}, :ausentes_{n}, '
+                       f'{columna_fecha}, :estado_{n})')
+        params.update({
+            f'alumno_id_{n}': alumno_id,
+            f'total_{n}': 0 if previo else 1,
+            f'presentes_{n}': (estado == 'Presente') - (previo == 'Presente'),
+            f'ausentes_{n}': (estado == 'Ausente') - (previo == 'Ausente'),
+            f'estado_{n}': estado
+        })
+    # MySQL asigna de izquierda a derecha: ultimo_estado se compara con la
+    # ultima_fecha anterior, antes de actualizarla
+    db.session.execute(text(f'''
+        INSERT INTO contadores_asistencia
+            (alumno_id, clase_id, total, presentes, ausentes, ultima_fecha, ultimo_estado)
+        VALUES {', '.join(valores)}
+        ON DUPLICATE KEY UPDATE
+            total = total + VALUES(total),
+            presentes = presentes + VALUES(presentes),
+            ausentes = ausentes + VALUES(ausentes),
+            ultimo_estado = IF(ultima_fecha IS NULL OR VALUES(ultima_fecha) >= ultima_fecha,
+                               VALUES(ultimo_estado), ultimo_estado),
+            ultima_fecha = GREATEST(COALESCE(ultima_fecha, VALUES(ultima_fecha)), VALUES(ultima_fecha))
+    '''), params)
+
+def escribir_asistencias(clase_id, filas, fecha=None):
+    """Registra asistencias (alumno_id, estado) de una clase en un día y
+    mantiene el resumen diario y los contadores. No hace commit.
+
+    Orden de bloqueos: la fila de resumen de la clase y el día, luego las
+    asistencias de los alumnos y por último sus contadores, en orden de
+    alumno_id. Las transacciones que escriben varias clases o días deben
+    llamarla en orden de (clase_id, fecha).
+
+    Devuelve las diferencias de presentes y ausentes del día, que publica
+    `despues_de_escribir_asistencias`.
+    """
+    estados = dict(filas)  # si un alumno se repite, vale el último estado
+    if not estados:
+        return {'presentes': 0, 'ausentes': 0}
+    bloquear_resumen_diario(clase_id, fecha)
+    previos = estados_previos(clase_id, estados, fecha)
+    upsert_asistencias(clase_id, sorted(estados.items()), fecha)
+
+    def cuenta(estado, mapa):
+        return sum(1 for e in mapa.values() if e == estado)
+    diferencias = {
+        'presentes': cuenta('Presente', estados) - cuenta('Presente', previos),
+        'ausentes': cuenta('Ausente', estados) - cuenta('Ausente', previos)
+    }
+    actualizar_resumen_diario(clase_id, fecha, total=len(estados) - len(previos), **diferencias)
+    actualizar_contadores(clase_id, estados, previos, fecha)
+    return diferencias
+
+@app.cli.command('reconstruir-contadores')
+def reconstruir_contadores():
+    """Recalcula desde cero la tabla contadores_asistencia."""
+    db.session.execute(text('''
+        CREATE TABLE IF NOT EXISTS contadores_asistencia (
+            alumno_id INT NOT NULL,
+            clase_id INT NOT NULL,
+            total INT NOT NULL DEFAULT 0,
+            presentes INT NOT NULL DEFAULT 0,
+            ausentes INT NOT NULL DEFAULT 0,
+            ultima_fecha DATE NULL,
+            ultimo_estado VARCHAR(20) NULL,
+            PRIMARY KEY (alumno_id, clase_id),
+            KEY idx_contadores_clase_alumno (clase_id, alumno_id)
+        )
+    '''))
+    try:
+        db.session.execute(text('DELETE FROM contadores_asistencia'))
+        db.session.execute(text(f'''
+            INSERT INTO contadores_asistencia
+                (alumno_id, clase_id, total, presentes, ausentes, ultima_fecha, ultimo_estado)
+            {_sql_contadores()}
+        '''))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    total = execute_query('SELECT COUNT(*) FROM contadores_asistencia', one=True)[0]
+    print(f"Contadores de asistencia reconstruidos: {total} filas")
+
+@app.cli.command('reconstruir-resumen')
+def reconstruir_resumen():
+    """Recalcula la tabla resumen_asistencia_diaria desde `asistencias`.
+
+    Los días de períodos archivados ya no están en `asistencias`: sus filas de
+    resumen se conservan tal como quedaron al archivar.
+    """
+    db.session.execute(text('''
+        CREATE TABLE IF NOT EXISTS resumen_asistencia_diaria (
+            clase_id INT NOT NULL,
+            fecha DATE NOT NULL,
+            presentes INT NOT NULL DEFAULT 0,
+            ausentes INT NOT NULL DEFAULT 0,
+            total INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (clase_id, fecha)
+        )
+    '''))
+    corte = execute_query('SELECT MAX(hasta) FROM archivo_periodos', one=True)[0]
+    condicion = 'WHERE fecha > :corte' if corte else ''
+    try:
+        db.session.execute(text(f'DELETE FROM resumen_asistencia_diaria {condicion}'), {'corte': corte})
+        db.session.execute(text(f'''
+            INSERT INTO resumen_asistencia_diaria (clase_id, fecha, presentes, ausentes, total)
+            SELECT 
+                clase_id,
+                fecha,
+                COUNT(DISTINCT CASE WHEN estado = 'Presente' THEN alumno_id END),
+                COUNT(DISTINCT CASE WHEN estado = 'Ausente' THEN alumno_id END),
+                COUNT(DISTINCT alumno_id)
+            FROM asistencias
+            {condicion}
+            GROUP BY clase_id, fecha
+        '''), {'corte': corte})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    total = execute_query('SELECT COUNT(*) FROM resumen_asistencia_diaria', one=True)[0]
+    print(f"Resumen diario reconstruido: {total} filas")
+
+@app.cli.command('medir-hash')
+@click.option('--objetivo-ms', type=float, default=250.0, help='tiempo máximo aceptable por verificación')
+@click.option('--repeticiones', type=int, default=5)
+def medir_hash(objetivo_ms, repeticiones):
+    """Mide cuánto tarda verificar una contraseña con distintos costos."""
+    candidatos = [f'pbkdf2:sha256:{n}' for n in (100000, 200000, 400000, 600000, 1000000)]
+    candidatos += [f'scrypt:{n}:8:1' for n in (16384, 32768, 65536)]
+    hilos = min(app.config['PASSWORD_HILOS'], os.cpu_count() or 1)
+    recomendado = None
+    print(f"{'método':<24} {'ms/verificación':>16} {'logins/s':>10}")
+    for metodo in candidatos:
+        guardada = generate_password_hash('clave-de-prueba', method=metodo)
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            check_password_hash(guardada, 'clave-de-prueba')
+        ms = (time.perf_counter() - inicio) * 1000 / repeticiones
+        print(f'{metodo:<24} {ms:>16.1f} {hilos * 1000 / ms:>10.1f}')
+        if metodo.startswith('pbkdf2') and ms <= objetivo_ms:
+            recomendado = metodo
+    print(f"Actual: {app.config['PASSWORD_METODO']} ({hilos} hilos por proceso)")
+    if recomendado:
+        print(f'Mayor costo PBKDF2 bajo {objetivo_ms:.0f} ms: {recomendado}')
+
+def _firma(clave, payload):
+    digest = hmac.new(clave.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).rstrip(b'=').decode()
+
+def _firma_qr(payload):
+    return _firma(app.config['QR_SECRET_KEY'], payload)
+
+def _firma_sesion(payload):
+    return _firma(app.config['SESION_SECRET_KEY'], 'sesion:' + payload)
+
+def firmar_token_sesion(usuario_id, tipo, inicio=None, ahora=None):
+    """Token de sesión: usuario_id.tipo.inicio.expira.firma (HMAC-SHA256).
+
+    `inicio` es el instante del login y se conserva al renovar.
+    """
+    ahora = int(ahora if ahora is not None else time.time())
+    inicio = int(inicio if inicio is not None else ahora)
+    payload = f"{usuario_id}.{tipo}.{inicio}.{ahora + app.config['SESION_VALIDEZ_SEGUNDOS']}"
+    return f'{payload}.{_firma_sesion(payload)}'
+
+def verificar_token_sesion(token, ahora=None):
+    """Valida firma y vigencia sin consultar `usuarios`.
+
+    Devuelve (usuario_id, tipo, inicio) o lanza ValueError con el motivo.
+    """
+    if not isinstance(token, str) or token.count('.') != 4:
+        raise ValueError('Formato de token inválido')
+    payload, firma = token.rsplit('.', 1)
+    # Bytes: compare_digest lanza TypeError con str que no son ASCII
+    if not hmac.compare_digest(firma.encode(), _firma_sesion(payload).encode()):
+        raise ValueError('Token no válido')
+    usuario_id, tipo, inicio, expira = payload.split('.')
+    try:
+        usuario_id, inicio, expira = int(usuario_id), int(inicio), int(expira)
+    except ValueError:
+        raise ValueError('Formato de token inválido')
+    if (ahora if ahora is not None else time.time()) > expira:
+        raise ValueError('Sesión expirada')
+    return usuario_id, tipo, inicio
+
+def firmar_token_qr(clase_id, emitido=None):
+    """Genera un token QR compacto: clase_id.emitido.nonce.firma (HMAC-SHA256)."""
+    emitido = int(emitido if emitido is not None else time.time())
+    payload = f'{clase_id}.{emitido}.{secrets.token_urlsafe(6)}'
+    return f'{payload}.{_firma_qr(payload)}'
+
+def verificar_token_qr(token, ahora=None):
+    """Valida firma y vigencia del token sin tocar la base de datos.
+
+    Devuelve (clase_id, nonce, emitido) o lanza ValueError con el motivo.
+    """
+    if not isinstance(token, str) or token.count('.') != 3:
+        raise ValueError('Formato de QR inválido')
+    payload, firma = token.rsplit('.', 1)
+    if not hmac.compare_digest(firma.encode(), _firma_qr(payload).encode()):
+        raise ValueError('Código QR no válido')
+    clase_id, emitido, nonce = payload.split('.')
+    try:
+        clase_id, emitido = int(clase_id), int(emitido)
+    except ValueError:
+        raise ValueError('Formato de QR inválido')
+    edad = (ahora if ahora is not None else time.time()) - emitido
+    if edad < -30 or edad > app.config['QR_VALIDEZ_SEGUNDOS']:
+        raise ValueError('Código QR expirado')
+    return clase_id, nonce, emitido
+
+class IndiceEnMemoria:
+    """Base de los índices cargados completos en memoria.
+
+    Se recargan al vencer el TTL, al llamar a `invalidar()` o, como mucho cada
+    `refresco_min` segundos, cuando una búsqueda falla (un dato recién creado
+    no espera al TTL). Las subclases implementan `_cargar()`.
+    """
+
+    def __init__(self, ttl, refresco_min):
+        self.ttl = ttl
+        self.refresco_min = refresco_min
+        self._lock = threading.Lock()
+        self._cargado = None
+
+    def _asegurar(self, forzar=False):
+        """Recarga si el índice venció; con `forzar`, si tiene más de `refresco_min` segundos."""
+        limite = self.refresco_min if forzar else self.ttl
+        cargado = self._cargado
+        if cargado is not None and time.monotonic() - cargado < limite:
+            return False
+        with self._lock:
+            if self._cargado is not cargado and self._cargado is not None:
+                return True  # otro hilo acaba de recargar
+            self._cargar()
+            self._cargado = time.monotonic()
+            return True
+
+    def invalidar(self):
+        with self._lock:
+            self._cargado = None
+
+    def _buscar(self, consulta):
+        self._asegurar()
+        if consulta():
+            return True
+        return self._asegurar(forzar=True) and consulta()
+
+class IndiceAcceso(IndiceEnMemoria):
+    """Índice en memoria de propiedad de clases e inscripciones.
+
+    Carga `clases` e `inscripciones` completas en dos consultas y responde las
+    comprobaciones de autorización con búsquedas en conjuntos.
+    """
+
+    def __init__(self, ttl, refresco_min):
+        super().__init__(ttl, refresco_min)
+        self._clases_profesor = {}
+        self._profesor_clase = {}
+        self._alumnos_clase = {}
+        self._clases_alumno = {}
+
+    def _cargar(self):
+        clases_profesor = {}
+        profesor_clase = {}
+        for clase_id, profesor_id in execute_query('SELECT id, profesor_id FROM clases'):
+            clases_profesor.setdefault(profesor_id, set()).add(clase_id)
+            profesor_clase[clase_id] = profesor_id
+        alumnos_clase = {}
+        clases_alumno = {}
+        for clase_id, alumno_id in execute_query('SELECT clase_id, alumno_id FROM inscripciones'):
+            alumnos_clase.setdefault(clase_id, set()).add(alumno_id)
+            clases_alumno.setdefault(alumno_id, set()).add(clase_id)
+        self._clases_profesor = {k: frozenset(v) for k, v in clases_profesor.items()}
+        self._alumnos_clase = {k: frozenset(v) for k, v in alumnos_clase.items()}
+        self._clases_alumno = {k: frozenset(v) for k, v in clases_alumno.items()}
+        self._profesor_clase = profesor_clase
+
+    def profesor_dicta(self, profesor_id, clase_id):
+        return self._buscar(lambda: clase_id in self._clases_profesor.get(profesor_id, ()))
+
+    def alumno_inscrito(self, alumno_id, clase_id):
+        return self._buscar(lambda: alumno_id in self._alumnos_clase.get(clase_id, ()))
+
+    def alumnos_de(self, clase_id):
+        self._asegurar()
+        return self._alumnos_clase.get(clase_id, frozenset())
+
+    def inscripciones(self):
+        """Todas las inscripciones como {clase_id: frozenset(alumno_ids)}."""
+        self._asegurar()
+        return self._alumnos_clase
+
+    def profesor_de(self, clase_id):
+        self._asegurar()
+        return self._profesor_clase.get(clase_id)
+
+    def clases_de_profesor(self, profesor_id):
+        self._asegurar()
+        return self._clases_profesor.get(profesor_id, frozenset())
+
+    def clases_de_alumno(self, alumno_id):
+        self._asegurar()
+        return self._clases_alumno.get(alumno_id, frozenset())
+
+DIAS_SEMANA = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+_NUMERO_DIA = {d.lower(): n for n, d in enumerate(DIAS_SEMANA)}
+_NUMERO_DIA.update({'miercoles': 2, 'sabado': 5})
+MINUTOS_SEMANA = 7 * 24 * 60
+
+class IndiceHorarios(IndiceEnMemoria):
+    """Índice en memoria de los bloques de `horarios`.
+
+    Cada bloque se guarda como intervalo [inicio, fin) en minutos desde el
+    lunes a las 00:00 (día de la semana * 1440 + minuto del día), ordenado por
+    clase. Saber qué sesión está en curso o cuál sigue es una comparación de
+    enteros sobre los pocos bloques de las clases del usuario.
+    """
+
+    def __init__(self, ttl, refresco_min):
+        super().__init__(ttl, refresco_min)
+        self._bloques = {}
+        self._nombres = {}
+
+    def _cargar(self):
+        nombres = dict(execute_query('SELECT id, nombre FROM clases'))
+        bloques = {clase_id: [] for clase_id in nombres}
+        for clase_id, dia_semana, hora_inicio, hora_fin in execute_query(
+                'SELECT clase_id, dia_semana, hora_inicio, hora_fin FROM horarios'):
+            dia = _NUMERO_DIA.get(dia_semana.strip().lower())
+            if dia is None:
+                print(f"Día de la semana desconocido en horarios de la clase {clase_id}: {dia_semana}")
+                continue
+            inicio = dia * 1440 + int(hora_inicio.total_seconds()) // 60
+            fin = dia * 1440 + int(hora_fin.total_seconds()) // 60
+            bloques.setdefault(clase_id, []).append((inicio, fin))
+        self._bloques = {k: tuple(sorted(v)) for k, v in bloques.items()}
+        self._nombres = nombres
+
+    def existe(self, clase_id):
+        return self._buscar(lambda: clase_id in self._bloques)
+
+    def bloques_de(self, clase_id):
+        self._asegurar()
+        return self._bloques.get(clase_id, ())
+
+    def nombre_de(self, clase_id):
+        self._asegurar()
+        return self._nombres.get(clase_id)
+
+    def fin_del_dia(self, clase_id, fecha):
+        """Fin del último bloque de la clase en `fecha`; sin bloques ese día, la medianoche siguiente."""
+        dia = fecha.weekday() * 1440
+        fines = [fin for inicio, fin in self.bloques_de(clase_id) if dia <= inicio < dia + 1440]
+        return datetime.combine(fecha, datetime.min.time()) + timedelta(minutes=max(fines) - dia if fines else 1440)
+
+    @staticmethod
+    def minuto_semana(momento):
+        return momento.weekday() * 1440 + momento.hour * 60 + momento.minute
+
+    def en_horario(self, clase_id, momento, margen=0):
+        """True si `momento` cae en un bloque de la clase, con `margen` minutos
+        de holgura a cada lado. Una clase sin horarios no se restringe."""
+        bloques = self.bloques_de(clase_id)
+        if not bloques:
+            return True
+        ahora = self.minuto_semana(momento)
+        for inicio, fin in bloques:
+            if (ahora - (inicio - margen)) % MINUTOS_SEMANA < fin - inicio + 2 * margen:
+                return True
+        return False
+
+    def sesiones(self, clase_ids, momento):
+        """Sesión en curso y próxima sesión entre las clases dadas.
+
+        Devuelve (actual, siguiente), cada una None o (clase_id, inicio, fin,
+        minutos hasta el inicio).
+        """
+        self._asegurar()
+        ahora = self.minuto_semana(momento)
+        actual = siguiente = None
+        for clase_id in clase_ids:
+            for inicio, fin in self._bloques.get(clase_id, ()):
+                if inicio <= ahora < fin:
+                    if actual is None or inicio > actual[1]:
+                        actual = (clase_id, inicio, fin, 0)
+                    continue
+                faltan = (inicio - ahora) % MINUTOS_SEMANA
+                if siguiente is None or faltan < siguiente[3]:
+                    siguiente = (clase_id, inicio, fin, faltan)
+        return actual, siguiente
+
+def _hora(minutos):
+    return f'{minutos % 1440 // 60:02d}:{minutos % 60:02d}'
+
+def formato_bloques(bloques):
+    """Bloques (inicio, fin) en minutos de la semana -> formato de /clases/<id>/horarios."""
+    return [{
+        'dia_semana': DIAS_SEMANA[inicio // 1440],
+        'hora_inicio': _hora(inicio),
+        'hora_fin': _hora(fin)
+    } for inicio, fin in bloques]
+
+# Archivo de períodos cerrados: las asistencias hasta el corte viven en
+# archivo_asistencias, una fila por (alumno, clase, período) con los agregados
+# y el historial comprimido, en vez de una fila por día en `asistencias`
+ESTADO_POR_CODIGO = {codigo: estado for estado, codigo in CODIGOS_ESTADO.items()}
+_REGISTRO_ARCHIVADO = re.compile(r'(\d+)([A-Z])')
+
+def codificar_historial(desde, registros):
+    """(fecha, estado) ordenados por fecha -> bytes comprimidos.
+
+    Cada registro se guarda como los días transcurridos desde el anterior (el
+    primero, desde `desde`) seguidos del código del estado: '0P2A5P...'.
+    """
+    partes = []
+    anterior = desde
+    for fecha, estado in registros:
+        partes.append(f'{(fecha - anterior).days}{CODIGOS_ESTADO[estado]}')
+        anterior = fecha
+    return zlib.compress(''.join(partes).encode('ascii'), 9)
+
+def decodificar_historial(desde, datos):
+    fecha = desde
+    for m in _REGISTRO_ARCHIVADO.finditer(zlib.decompress(datos).decode('ascii')):
+        fecha += timedelta(days=int(m.group(1)))
+        yield fecha, ESTADO_POR_CODIGO[m.group(2)]
+
+class IndicePeriodos(IndiceEnMemoria):
+    """Último día archivado. Todas las asistencias hasta `corte()` inclusive
+    están en archivo_asistencias y ninguna en `asistencias`.
+
+    `archivar-periodo` sube la generación de la etiqueta 'archivo'; con la
+    caché compartida, los demás procesos releen el corte en la siguiente
+    consulta en vez de esperar el TTL.
+    """
+
+    def __init__(self, ttl, refresco_min):
+        super().__init__(ttl, refresco_min)
+        self._corte = None
+        self._generacion = None
+
+    def _cargar(self):
+        self._generacion = cache_lectura.generaciones(('archivo',))
+        self._corte = execute_query('SELECT MAX(hasta) FROM archivo_periodos', one=True)[0]
+
+    def corte(self):
+        if self._generacion is not None and cache_lectura.generaciones(('archivo',)) != self._generacion:
+            self.invalidar()
+        self._asegurar()
+        return self._corte
+
+def asistencias_archivadas(clase_id=None, alumno_id=None, desde=None, hasta=None):
+    """Itera (alumno_id, clase_id, fecha, estado) de los períodos archivados,
+    con `desde` y `hasta` inclusivos. Cada fila del archivo es un período de
+    un alumno en una clase, así que se leen pocas filas por alumno."""
+    condiciones, params = [], {}
+    for columna, valor, condicion in (('clase_id', clase_id, 'x.clase_id = :clase_id'),
+                                      ('alumno_id', alumno_id, 'x.alumno_id = :alumno_id'),
+                                      ('desde', desde, 'x.ultima_fecha >= :desde'),
+                                      ('hasta', hasta, 'x.desde <= :hasta')):
+        if valor is not None:
+            condiciones.append(f'AND {condicion}')
+            params[columna] = valor
+    for fila in execute_query(f'''
+        SELECT x.alumno_id, x.clase_id, x.desde, x.datos
+        FROM archivo_asistencias x
+        WHERE 1 = 1 {' '.join(condiciones)}
+    ''', params):
+        for fecha, estado in decodificar_historial(fila[2], fila[3]):
+            if (desde is None or fecha >= desde) and (hasta is None or fecha <= hasta):
+                yield fila[0], fila[1], fecha, estado
+
+@app.cli.command('archivar-periodo')
+@click.argument('periodo')
+@click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), required=True,
+              help='último día del período (inclusive)')
+def archivar_periodo(periodo, hasta):
+    """Mueve a archivo_asistencias las asistencias hasta --hasta no archivadas aún.
+
+    Los agregados por alumno y clase y el historial comprimido se insertan y
+    las filas se borran de `asistencias` en una sola transacción: las lecturas
+    ven cada día o en la tabla viva o en el archivo, nunca en ambos.
+
+    Se borran solo las claves (alumno, clase, fecha) leídas. Si mientras tanto
+    se escribió alguna asistencia del rango (según el log `cambios`), la
+    transacción se deshace y hay que volver a ejecutar el comando.
+    """
+    hasta = hasta.date()
+    if hasta >= date.today():
+        raise click.BadParameter('solo se archivan períodos cerrados (anteriores a hoy)', param_hint='--hasta')
+    corte = execute_query('SELECT MAX(hasta) FROM archivo_periodos', one=True)[0]
+    if corte and hasta <= corte:
+        raise click.BadParameter(f'ya está archivado hasta {corte}', param_hint='--hasta')
+    desde = corte + timedelta(days=1) if corte else \
+        execute_query('SELECT MIN(fecha) FROM asistencias', one=True)[0]
+    if desde is None or desde > hasta:
+        raise click.ClickException('No hay asistencias que archivar')
+    ultimo_cambio = execute_query('SELECT COALESCE(MAX(seq), 0) FROM cambios', one=True)[0]
+
+    # Recorrido ordenado por la clave única (alumno, clase, fecha), en streaming
+    filas = stream_query('''
+        SELECT alumno_id, clase_id, fecha, estado
+        FROM asistencias
+        WHERE fecha BETWEEN :desde AND :hasta
+        ORDER BY alumno_id, clase_id, fecha
+    ''', {'desde': desde, 'hasta': hasta})
+
+    lote = []
+    total_filas = total_bytes = borradas = 0
+    sql = text('''
+        INSERT INTO archivo_asistencias
+            (alumno_id, clase_id, periodo, desde, total, presentes, ausentes,
+             ultima_fecha, ultimo_estado, datos)
+        VALUES (:alumno_id, :clase_id, :periodo, :desde, :total, :presentes, :ausentes,
+                :ultima_fecha, :ultimo_estado, :datos)
+    ''')
+    try:
+        for (alumno_id, clase_id), grupo in itertools.groupby(filas, key=lambda f: (f[0], f[1])):
+            registros = [(f[2], f[3]) for f in grupo]
+            desconocido = next((e for _, e in registros if e not in CODIGOS_ESTADO), None)
+            if desconocido:
+                raise click.ClickException(f'Estado sin código de archivo: {desconocido}')
+            datos = codificar_historial(desde, registros)
+            marcadores, params = lista_sql('fecha', [f for f, _ in registros])
+            borradas += db.session.execute(text(f'''
+                DELETE FROM asistencias
+                WHERE alumno_id = :alumno_id AND clase_id = :clase_id AND fecha IN {marcadores}
+            '''), {'alumno_id': alumno_id, 'clase_id': clase_id, **params}).rowcount
+            total_filas += len(registros)
+            total_bytes += len(datos)
+            lote.append({
+                'alumno_id': alumno_id,
+                'clase_id': clase_id,
+                'periodo': periodo,
+                'desde': desde,
+                'total': len(registros),
+                'presentes': sum(1 for _, e in registros if e == 'Presente'),
+                'ausentes': sum(1 for _, e in registros if e == 'Ausente'),
+                'ultima_fecha': registros[-1][0],
+                'ultimo_estado': registros[-1][1],
+                'datos': datos
+            })
+            if len(lote) >= app.config['ARCHIVO_LOTE']:
+                db.session.execute(sql, lote)
+                lote = []
+        if lote:
+            db.session.execute(sql, lote)
+        db.session.execute(text('''
+            INSERT INTO archivo_periodos (periodo, desde, hasta, filas, bytes, archivado)
+            VALUES (:periodo, :desde, :hasta, :filas, :bytes, NOW())
+        '''), {'periodo': periodo, 'desde': desde, 'hasta': hasta, 'filas': total_filas, 'bytes': total_bytes})
+        # Lectura con bloqueo: ve lo confirmado por otros después de empezar y
+        # detiene nuevos cambios hasta el commit
+        escritas = execute_query('''
+            SELECT COUNT(*) FROM cambios
+            WHERE seq > :seq AND entidad = 'asistencia' AND fecha BETWEEN :desde AND :hasta
+            FOR UPDATE
+        ''', {'seq': ultimo_cambio, 'desde': desde, 'hasta': hasta}, one=True)[0]
+        if escritas or borradas != total_filas:
+            raise click.ClickException('Se registraron asistencias del período mientras se archivaba; '
+                                       'no se archivó nada, vuelva a ejecutar el comando')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    indice_periodos.invalidar()
+    # Con la caché compartida, los workers releen el corte en su próxima consulta
+    cache_lectura.invalidar('archivo')
+    print(f"Período {periodo} ({desde} a {hasta}) archivado: {total_filas} asistencias "
+          f"en {total_bytes} bytes comprimidos")
+
+class AlmacenCompartido:
+    """Almacén SQLite local para compartir la caché entre los workers de una máquina.
+
+    También guarda el registro de eventos en vivo que el repartidor de cada
+    proceso lee para entregarlos a sus flujos SSE.
+
+    Cada hilo de cada proceso abre su propia conexión al primer uso: las de un
+    maestro pre-fork no se heredan. Cada `PODA_CADA` escrituras se borran las
+    entradas vencidas y, si quedan más de `max_entradas`, las más próximas a
+    vencer; los eventos se guardan `EVENTOS_RETENCION` segundos.
+    """
+
+    PODA_CADA = 200
+    EVENTOS_RETENCION = 60  # segundos; los repartidores leen cada fracción de segundo
+
+    def __init__(self, ruta, max_entradas):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self._local = threading.local()
+        self._escrituras = itertools.count(1)
+        conn = self._abrir()
+        try:
+            conn.execute('CREATE TABLE IF NOT EXISTS generaciones (etiqueta TEXT PRIMARY KEY, gen INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS escrituras (etiqueta TEXT PRIMARY KEY, instante REAL NOT NULL)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS entradas (
+                clave TEXT PRIMARY KEY, gens TEXT NOT NULL, expira REAL NOT NULL,
+                status INTEGER NOT NULL, mimetype TEXT NOT NULL, cuerpo BLOB NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_entradas_expira ON entradas (expira)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS eventos (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, clase_id INTEGER NOT NULL,
+                datos TEXT NOT NULL, creado REAL NOT NULL)''')
+            # Identifica el almacén: si el archivo se recrea, las generaciones
+            # vuelven a cero y las versiones anteriores no deben coincidir
+            conn.execute('INSERT OR IGNORE INTO generaciones (etiqueta, gen) VALUES (?, ?)',
+                         ('__epoca__', secrets.randbits(31)))
+            self.epoca = conn.execute("SELECT gen FROM generaciones WHERE etiqueta = '__epoca__'").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _abrir(self):
+        conn = sqlite3.connect(self.ruta, timeout=1, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _conexion(self):
+        # Tras un fork el hijo hereda el threading.local del hilo principal
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.conn = self._abrir()
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def generaciones(self, etiquetas):
+        marcas = ','.join('?' * len(etiquetas))
+        filas = dict(self._conexion().execute(
+            f'SELECT etiqueta, gen FROM generaciones WHERE etiqueta IN ({marcas})', etiquetas))
+        return tuple(filas.get(e, 0) for e in etiquetas)
+
+    def incrementar(self, etiquetas):
+        self._conexion().executemany(
+            'INSERT INTO generaciones (etiqueta, gen) VALUES (?, 1) '
+            'ON CONFLICT(etiqueta) DO UPDATE SET gen = gen + 1', [(e,) for e in etiquetas])
+
+    def marcar_escritura(self, etiquetas, instante):
+        self._conexion().executemany(
+            'INSERT OR REPLACE INTO escrituras (etiqueta, instante) VALUES (?, ?)',
+            [(e, instante) for e in etiquetas])
+
+    def ultima_escritura(self, etiquetas):
+        marcas = ','.join('?' * len(etiquetas))
+        fila = self._conexion().execute(
+            f'SELECT MAX(instante) FROM escrituras WHERE etiqueta IN ({marcas})', etiquetas).fetchone()
+        return fila[0] or 0
+
+    def leer(self, clave):
+        fila = self._conexion().execute(
+            'SELECT gens, expira, status, mimetype, cuerpo FROM entradas WHERE clave = ?', (clave,)).fetchone()
+        if fila:
+            return (tuple(json.loads(fila[0])), fila[1], (fila[2], fila[3], fila[4]))
+        return None
+
+    def escribir(self, clave, gens, expira, valor):
+        conn = self._conexion()
+        conn.execute(
+            'INSERT OR REPLACE INTO entradas (clave, gens, expira, status, mimetype, cuerpo) VALUES (?, ?, ?, ?, ?, ?)',
+            (clave, json.dumps(gens), expira, *valor))
+        if next(self._escrituras) % self.PODA_CADA == 0:
+            self.podar(conn)
+
+    def publicar_evento(self, clase_id, evento):
+        conn = self._conexion()
+        conn.execute('INSERT INTO eventos (clase_id, datos, creado) VALUES (?, ?, ?)',
+                     (clase_id, json.dumps(evento), time.time()))
+        if next(self._escrituras) % self.PODA_CADA == 0:
+            conn.execute('DELETE FROM eventos WHERE creado < ?', (time.time() - self.EVENTOS_RETENCION,))
+
+    def ultimo_evento(self):
+        return self._conexion().execute('SELECT COALESCE(MAX(seq), 0) FROM eventos').fetchone()[0]
+
+    def eventos_desde(self, seq):
+        """Eventos posteriores a `seq`, en orden: [(seq, clase_id, evento)]."""
+        filas = self._conexion().execute(
+            'SELECT seq, clase_id, datos FROM eventos WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+        return [(s, c, json.loads(d)) for s, c, d in filas]
+
+    def podar(self, conn=None):
+        conn = conn or self._conexion()
+        conn.execute('DELETE FROM entradas WHERE expira <= ?', (time.time(),))
+        sobran = conn.execute('SELECT COUNT(*) FROM entradas').fetchone()[0] - self.max_entradas
+        if sobran > 0:
+            conn.execute('DELETE FROM entradas WHERE clave IN '
+                         '(SELECT clave FROM entradas ORDER BY expira LIMIT ?)', (sobran,))
+
+class CacheLectura:
+    """Caché LRU con TTL e invalidación por etiquetas ('clase:5', 'alumno:7'...).
+
+    Cada etiqueta tiene una generación que las escrituras incrementan. Una
+    entrada guarda las generaciones vigentes al crearla y deja de servirse en
+    cuanto alguna cambia, así que invalidar no recorre la caché. Con
+    `CACHE_SQLITE_RUTA` las generaciones y las entradas se comparten entre los
+    procesos de la máquina; sin él, cada proceso invalida solo su propia caché
+    y el TTL acota lo que pueda quedar desactualizado en los demás.
+    """
+
+    def __init__(self, max_entradas, ttl, ruta_compartida=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.compartido = AlmacenCompartido(ruta_compartida, max_entradas) if ruta_compartida else None
+        self._entradas = OrderedDict()
+        self._generaciones = {}
+        self._lock = threading.Lock()
+        self.aciertos = {}
+        self.fallos = {}
+        # Las generaciones en memoria empiezan en cero en cada proceso
+        self.epoca = self.compartido.epoca if self.compartido else secrets.randbits(31)
+
+    def generaciones(self, etiquetas):
+        if self.compartido:
+            return self.compartido.generaciones(etiquetas)
+        return tuple(self._generaciones.get(e, 0) for e in etiquetas)
+
+    def obtener(self, clave, gens, grupo):
+        ahora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada and entrada[0] == gens and entrada[1] > ahora:
+                self._entradas.move_to_end(clave)
+                self.aciertos[grupo] = self.aciertos.get(grupo, 0) + 1
+                return entrada[2]
+        if self.compartido:
+            entrada = self.compartido.leer(clave)
+            if entrada and entrada[0] == gens and entrada[1] > ahora:
+                self._guardar_local(clave, entrada)
+                with self._lock:
+                    self.aciertos[grupo] = self.aciertos.get(grupo, 0) + 1
+                return entrada[2]
+        with self._lock:
+            self.fallos[grupo] = self.fallos.get(grupo, 0) + 1
+        return None
+
+    def guardar(self, clave, gens, valor, ttl=None):
+        """Guarda `valor` con las generaciones leídas *antes* de calcularlo: si una
+        escritura llegó mientras tanto, la entrada nace ya invalidada."""
+        entrada = (gens, time.time() + (ttl or self.ttl), valor)
+        self._guardar_local(clave, entrada)
+        if self.compartido:
+            self.compartido.escribir(clave, gens, entrada[1], valor)
+
+    def _guardar_local(self, clave, entrada):
+        with self._lock:
+            self._entradas[clave] = entrada
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, *etiquetas):
+        if self.compartido:
+            self.compartido.incrementar(etiquetas)
+            return
+        with self._lock:
+            for e in etiquetas:
+                self._generaciones[e] = self._generaciones.get(e, 0) + 1
+
+    def tamano(self):
+        return len(self._entradas)
+
+class EscriturasRecientes:
+    """Instante de la última escritura por etiqueta ('clase:5', 'alumno:7'...).
+
+    Mientras la réplica puede no tener una escritura, las lecturas de esos
+    datos van a la primaria. Con el almacén compartido de la caché las marcas
+    se ven desde todos los procesos de la máquina.
+    """
+
+    def __init__(self, ventana, compartido=None):
+        self.ventana = ventana
+        self.compartido = compartido
+        self._marcas = {}
+        self._lock = threading.Lock()
+
+    def marcar(self, etiquetas):
+        ahora = time.time()
+        if self.compartido:
+            self.compartido.marcar_escritura(etiquetas, ahora)
+            return
+        with self._lock:
+            if len(self._marcas) > 10000:
+                self._marcas = {e: t for e, t in self._marcas.items() if ahora - t < self.ventana}
+            for e in etiquetas:
+                self._marcas[e] = ahora
+
+    def recientes(self, etiquetas):
+        if not etiquetas:
+            return False
+        if self.compartido:
+            ultima = self.compartido.ultima_escritura(etiquetas)
+        else:
+            ultima = max(self._marcas.get(e, 0) for e in etiquetas)
+        return time.time() - ultima < self.ventana
+
+def solo_lectura(etiquetas=None):
+    """Marca una ruta de solo lectura para que consulte la réplica.
+
+    Si no hay réplica configurada, o si alguna de las etiquetas (que recibe
+    los argumentos de la ruta) se escribió hace menos de
+    `LECTURA_PRIMARIA_SEGUNDOS`, la ruta sigue leyendo de la primaria.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(**kwargs):
+            bind = app.config['LECTURA_BIND']
+            if bind in (app.config.get('SQLALCHEMY_BINDS') or {}) and \
+                    not escrituras_recientes.recientes(tuple(etiquetas(**kwargs)) if etiquetas else ()):
+                g.bind_lectura = bind
+            return vista(**kwargs)
+        return envoltura
+    return decorador
+
+def clave_peticion(kwargs, parametros=()):
+    """Clave de una petición: endpoint, argumentos de la ruta y solo los
+    parámetros `parametros` de la query string, en orden fijo. Parámetros
+    ajenos o reordenados no generan otra clave."""
+    partes = [request.endpoint] + [f'{k}={kwargs[k]}' for k in sorted(kwargs)]
+    partes += [f'{p}={",".join(request.args.getlist(p))}' for p in parametros if p in request.args]
+    return '|'.join(partes)
+
+def cacheado(etiquetas, ttl=None, parametros=()):
+    """Cachea la respuesta 200 de una ruta GET.
+
+    `etiquetas` recibe los argumentos de la ruta y devuelve las etiquetas cuya
+    invalidación debe descartar la respuesta. `ttl` es el nombre de la opción
+    de configuración que reemplaza a `CACHE_TTL` para esta ruta. `parametros`
+    son los de la query string que la vista lee; los demás no forman parte
+    de la clave.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(**kwargs):
+            clave = clave_peticion(kwargs, parametros)
+            gens = cache_lectura.generaciones(tuple(etiquetas(**kwargs)))
+            valor = cache_lectura.obtener(clave, gens, vista.__name__)
+            if valor is not None:
+                status, mimetype, cuerpo = valor
+                return Response(cuerpo, status=status, mimetype=mimetype)
+            respuesta = app.make_response(vista(**kwargs))
+            if respuesta.status_code == 200 and not respuesta.is_streamed:
+                cache_lectura.guardar(clave, gens, (200, respuesta.mimetype, respuesta.get_data()),
+                                      app.config[ttl] if ttl else None)
+            return respuesta
+        return envoltura
+    return decorador
+
+def con_etag(etiquetas, parametros=(), autorizar=None):
+    """Responde GET condicionales a partir de la versión de los datos.
+
+    La versión de una clase o alumno es la generación de su etiqueta en la
+    caché, que sube con cada escritura de asistencia. Si `If-None-Match`
+    coincide se responde 304 sin ejecutar la vista. Sin almacén compartido
+    otro proceso puede no ver la escritura, así que el ETag incluye además una
+    ventana de `CACHE_TTL` segundos para acotar ese desfase.
+
+    El ETag incluye los `parametros` de la query string que la vista lee (una
+    página no revalida a otra). `autorizar` recibe los argumentos de la ruta;
+    si devuelve False no hay 304 y la vista responde su propio error.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(**kwargs):
+            if autorizar and not autorizar(**kwargs):
+                return vista(**kwargs)
+            gens = cache_lectura.generaciones(tuple(etiquetas(**kwargs)))
+            partes = [format(cache_lectura.epoca, 'x'), date.today().strftime('%Y%m%d')]
+            partes += [str(gen) for gen in gens]
+            if parametros and any(p in request.args for p in parametros):
+                partes.append(hashlib.sha1(clave_peticion(kwargs, parametros).encode()).hexdigest()[:10])
+            if not cache_lectura.compartido:
+                partes.append(str(int(time.time() // cache_lectura.ttl)))
+            etag = '-'.join(partes)
+
+            if request.if_none_match.contains_weak(etag):
+                respuesta = Response(status=304)
+                respuesta.set_etag(etag, weak=True)
+                return respuesta
+
+            respuesta = app.make_response(vista(**kwargs))
+            if respuesta.status_code == 200:
+                respuesta.set_etag(etag, weak=True)
+                respuesta.headers['Cache-Control'] = 'no-cache'
+            return respuesta
+        return envoltura
+    return decorador
+
+class Suscripcion:
+    def __init__(self, maxsize, desde=0):
+        self.cola = queue.Queue(maxsize=maxsize)
+        self.desbordada = False
+        self.desde = desde  # último evento del registro compartido anterior a la suscripción
+
+class CanalesAsistencia:
+    """Publicación/suscripción de eventos de asistencia por clase.
+
+    Cada evento lleva las filas escritas y la diferencia de presentes y
+    ausentes que produjeron; el flujo SSE suma esas diferencias a los totales
+    que leyó al conectarse, sin volver a consultar la base. Cada suscriptor
+    tiene su propia cola acotada y publicar nunca bloquea: si un suscriptor
+    lento la llena, se marca como desbordado y su flujo se cierra para que el
+    cliente se reconecte con totales nuevos.
+
+    Con el almacén compartido los eventos se publican en su registro, y un
+    único hilo repartidor por proceso lo lee cada `intervalo` segundos y los
+    entrega a los suscriptores del proceso, incluidos los de las escrituras
+    propias. Sin él se entregan en memoria al publicar. `suscribir` devuelve
+    None al llegar a `maximo` suscriptores en el proceso.
+    """
+
+    def __init__(self, maxsize, maximo, compartido=None, intervalo=0.5):
+        self.maxsize = maxsize
+        self.maximo = maximo
+        self.compartido = compartido
+        self.intervalo = intervalo
+        self._suscriptores = {}
+        self._lock = threading.Lock()
+        self._repartidor = None
+        self._detener = threading.Event()
+        self.publicados = 0
+        self.rechazados = 0
+
+    def suscribir(self, clase_id):
+        # Los eventos ya registrados están en los totales que leerá el flujo
+        suscripcion = Suscripcion(self.maxsize, self.compartido.ultimo_evento() if self.compartido else 0)
+        with self._lock:
+            if sum(len(s) for s in self._suscriptores.values()) >= self.maximo:
+                self.rechazados += 1
+                return None
+            self._suscriptores.setdefault(clase_id, set()).add(suscripcion)
+            if self.compartido and self._repartidor is None:
+                self._repartidor = threading.Thread(target=self._repartir_registro, args=(suscripcion.desde,),
+                                                    name='repartidor-en-vivo', daemon=True)
+                self._repartidor.start()
+        return suscripcion
+
+    def cancelar(self, clase_id, suscripcion):
+        with self._lock:
+            suscriptores = self._suscriptores.get(clase_id)
+            if suscriptores:
+                suscriptores.discard(suscripcion)
+                if not suscriptores:
+                    del self._suscriptores[clase_id]
+
+    def tiene_suscriptores(self, clase_id):
+        return bool(self._suscriptores.get(clase_id))
+
+    def total_suscriptores(self):
+        with self._lock:
+            return sum(len(s) for s in self._suscriptores.values())
+
+    def publicar(self, clase_id, evento):
+        if self.compartido:
+            # Los suscriptores pueden estar en cualquier proceso de la máquina
+            self.compartido.publicar_evento(clase_id, evento)
+        elif self.tiene_suscriptores(clase_id):
+            self._entregar(clase_id, evento)
+        self.publicados += 1
+
+    def _entregar(self, clase_id, evento, seq=None):
+        with self._lock:
+            suscriptores = list(self._suscriptores.get(clase_id, ()))
+        for suscripcion in suscriptores:
+            if seq is not None and seq <= suscripcion.desde:
+                continue
+            try:
+                suscripcion.cola.put_nowait(evento)
+            except queue.Full:
+                suscripcion.desbordada = True
+
+    def detener(self):
+        self._detener.set()
+
+    def _repartir_registro(self, posicion):
+        while not self._detener.wait(self.intervalo):
+            try:
+                eventos = self.compartido.eventos_desde(posicion)
+            except sqlite3.Error as e:
+                print(f"Error al leer eventos en vivo: {str(e)}")
+                continue
+            for seq, clase_id, evento in eventos:
+                posicion = seq
+                self._entregar(clase_id, evento, seq)
+
+def totales_del_dia(clase_id, fecha=None):
+    """Inscritos (desde el índice en memoria) y presentes/ausentes del resumen diario."""
+    fecha = fecha or date.today()
+    fila = execute_query('''
+        SELECT presentes, ausentes
+        FROM resumen_asistencia_diaria
+        WHERE clase_id = :clase_id AND fecha = :fecha
+    ''', {'clase_id': clase_id, 'fecha': fecha}, one=True)
+    return {
+        'fecha': fecha.strftime('%Y-%m-%d'),
+        'total_alumnos': len(indice_acceso.alumnos_de(clase_id)),
+        'presentes': fila[0] if fila else 0,
+        'ausentes': fila[1] if fila else 0
+    }
+
+def despues_de_escribir_asistencias(clase_id, filas, diferencias, fecha=None):
+    """Se llama tras confirmar asistencias de una clase con las filas
+    (alumno_id, estado) escritas y las diferencias que devolvió
+    `escribir_asistencias`: invalida lo que dependa de ellas y publica el
+    evento del flujo en vivo."""
+    etiquetas = ['asistencias', f'clase:{clase_id}'] + [f'alumno:{a}' for a, _ in filas]
+    profesor_id = indice_acceso.profesor_de(clase_id)
+    if profesor_id is not None:
+        etiquetas.append(f'profesor:{profesor_id}')
+    cache_lectura.invalidar(*etiquetas)
+    escrituras_recientes.marcar(etiquetas)
+
+    try:
+        canales_asistencia.publicar(clase_id, {
+            'fecha': (fecha or date.today()).strftime('%Y-%m-%d'),
+            **diferencias,
+            'asistencias': [{'alumno_id': a, 'estado': e} for a, e in filas]
+        })
+    except Exception as e:
+        print(f"Error al publicar evento de asistencia: {str(e)}")
+
+class EscaneosRecientes:
+    """Recuerda (nonce, alumno) mientras el token está vigente para descartar
+    reenvíos del mismo escaneo sin consultar la base de datos."""
+
+    def __init__(self):
+        self._vistos = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nonce, alumno_id, expira):
+        """Devuelve False si el escaneo ya se había recibido."""
+        ahora = time.time()
+        with self._lock:
+            if len(self._vistos) > 10000:
+                self._vistos = {k: v for k, v in self._vistos.items() if v > ahora}
+            clave = (nonce, alumno_id)
+            if self._vistos.get(clave, 0) > ahora:
+                return False
+            self._vistos[clave] = expira
+            return True
+
+    def olvidar(self, nonce, alumno_id):
+        with self._lock:
+            self._vistos.pop((nonce, alumno_id), None)
+
+escaneos_recientes = EscaneosRecientes()
+
+class ColaAsistencias:
+    """Cola acotada en memoria para los escaneos QR con escritura diferida.
+
+    Un hilo en segundo plano drena la cola cuando se juntan `lote_max` filas o
+    pasan `intervalo` segundos, y escribe cada lote con INSERT multi-fila
+    idempotente por (alumno, clase, fecha) en una sola transacción. Si el
+    volcado falla, el hilo reintenta el mismo lote: el cliente ya recibió 202.
+    """
+
+    def __init__(self, app, maxsize, lote_max, intervalo):
+        self.app = app
+        self.cola = queue.Queue(maxsize=maxsize)
+        self.lote_max = lote_max
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._fallido = []
+        self.volcados = 0
+        self.filas_volcadas = 0
+        self.errores = 0
+        self.ultima_latencia = 0.0
+        self.latencia_total = 0.0
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name='cola-asistencias', daemon=True)
+                self._hilo.start()
+                atexit.register(self.detener)
+
+    def encolar(self, alumno_id, clase_id, fecha):
+        """Devuelve False si la cola está llena y el llamador debe escribir en línea."""
+        self.iniciar()
+        try:
+            self.cola.put_nowait((alumno_id, clase_id, fecha))
+            return True
+        except queue.Full:
+            return False
+
+    def detener(self):
+        """Detiene el hilo y vuelca lo que quede pendiente (apagado ordenado)."""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=10)
+        pendientes, self._fallido = self._fallido + self._drenar(None), []
+        while pendientes:
+            if not self._volcar(pendientes):
+                print(f"Se pierden {len(pendientes) + self.cola.qsize()} escaneos pendientes al apagar")
+                break
+            pendientes = self._drenar(None)
+
+    def estadisticas(self):
+        return {
+            'profundidad': self.cola.qsize(),
+            'capacidad': self.cola.maxsize,
+            'volcados': self.volcados,
+            'filas_volcadas': self.filas_volcadas,
+            'errores': self.errores,
+            'ultima_latencia_ms': round(self.ultima_latencia * 1000, 2),
+            'latencia_media_ms': round(self.latencia_total / self.volcados * 1000, 2) if self.volcados else 0
+        }
+
+    def _drenar(self, limite_tiempo):
+        lote = []
+        while len(lote) < self.lote_max:
+            try:
+                if limite_tiempo is None:
+                    lote.append(self.cola.get_nowait())
+                else:
+                    restante = limite_tiempo - time.monotonic()
+                    if restante <= 0:
+                        break
+                    lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            if not self._fallido:
+                try:
+                    primero = self.cola.get(timeout=self.intervalo)
+                except queue.Empty:
+                    continue
+                self._fallido = [primero] + self._drenar(time.monotonic() + self.intervalo)
+            # El lote queda en _fallido hasta escribirse: se reintenta aquí
+            # (el volcado es idempotente) y no se reencola, porque con la
+            # cola llena se perderían escaneos ya confirmados
+            if self._volcar(self._fallido):
+                self._fallido = []
+            else:
+                self._detener.wait(self.intervalo)
+
+    def _volcar(self, lote):
+        # Deduplicar dentro del lote: un alumno cuenta una vez por clase y día
+        grupos = {}
+        for alumno_id, clase_id, fecha in lote:
+            grupos.setdefault((clase_id, fecha), set()).add(alumno_id)
+
+        inicio = time.monotonic()
+        with self.app.app_context():
+            try:
+                diferencias = {}
+                for (clase_id, fecha), alumnos in sorted(grupos.items()):
+                    diferencias[(clase_id, fecha)] = escribir_asistencias(
+                        clase_id, [(a, 'Presente') for a in sorted(alumnos)], fecha=fecha)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.errores += 1
+                print(f"Error al volcar cola de asistencias ({len(lote)} filas): {str(e)}")
+                return False
+            for (clase_id, fecha), alumnos in grupos.items():
+                despues_de_escribir_asistencias(clase_id, [(a, 'Presente') for a in sorted(alumnos)],
+                                                diferencias[(clase_id, fecha)], fecha)
+        latencia = time.monotonic() - inicio
+        self.volcados += 1
+        self.filas_volcadas += len(lote)
+        self.ultima_latencia = latencia
+        self.latencia_total += latencia
+        return True
+
+class LimitadorTasa:
+    """Cubetas de tokens en memoria, una por clave (usuario, clase, IP...).
+
+    Cada cubeta admite ráfagas de hasta `capacidad` peticiones y se rellena a
+    `por_segundo` tokens por segundo. Una cubeta llena equivale a una
+    inexistente, así que al superar `max_claves` se descartan las llenas.
+    """
+
+    def __init__(self, nombre, capacidad, por_segundo, max_claves=100000):
+        self.nombre = nombre
+        self.capacidad = capacidad
+        self.por_segundo = por_segundo
+        self.max_claves = max_claves
+        self._cubetas = {}
+        self._lock = threading.Lock()
+        self.rechazos = 0
+
+    def consumir(self, clave=''):
+        """Devuelve 0 si hay token disponible, o los segundos hasta el próximo."""
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, instante = self._cubetas.get(clave, (self.capacidad, ahora))
+            tokens = min(self.capacidad, tokens + (ahora - instante) * self.por_segundo)
+            if tokens >= 1:
+                if len(self._cubetas) >= self.max_claves:
+                    self._podar(ahora)
+                self._cubetas[clave] = (tokens - 1, ahora)
+                return 0
+            self._cubetas[clave] = (tokens, ahora)
+            self.rechazos += 1
+            return (1 - tokens) / self.por_segundo
+
+    def _podar(self, ahora):
+        self._cubetas = {
+            clave: (tokens, instante) for clave, (tokens, instante) in self._cubetas.items()
+            if tokens + (ahora - instante) * self.por_segundo < self.capacidad
+        }
+
+    def claves(self):
+        return len(self._cubetas)
+
+class CompuertaConcurrencia:
+    """Limita cuántas peticiones ejecutan a la vez una sección (la escritura en
+    la base); las demás esperan como mucho `espera_max` segundos."""
+
+    def __init__(self, maximo, espera_max):
+        self.maximo = maximo
+        self.espera_max = espera_max
+        self._semaforo = threading.BoundedSemaphore(maximo)
+        self.en_uso = 0
+        self.rechazos = 0
+
+    def entrar(self):
+        if not self._semaforo.acquire(timeout=self.espera_max):
+            self.rechazos += 1
+            return False
+        self.en_uso += 1
+        return True
+
+    def salir(self):
+        self.en_uso -= 1
+        self._semaforo.release()
+
+class ServidorOcupado(Exception):
+    pass
+
+def es_hash_clave(guardada):
+    """True si la contraseña guardada es un hash de werkzeug y no texto plano."""
+    return guardada.startswith(('pbkdf2:', 'scrypt:')) and guardada.count('$') == 2
+
+class VerificadorClaves:
+    """Calcula y verifica hashes de contraseñas en un pool acotado de hilos.
+
+    PBKDF2 y scrypt de hashlib liberan el GIL, así que los hilos del pool usan
+    otros núcleos mientras los hilos de peticiones siguen atendiendo. La
+    compuerta limita las verificaciones en curso o en espera: las demás
+    reciben ServidorOcupado al instante en vez de formar una cola sin fin.
+    """
+
+    def __init__(self, hilos, pendientes_max, espera_max):
+        self.hilos = hilos
+        self.espera_max = espera_max
+        self.compuerta = CompuertaConcurrencia(hilos + pendientes_max, 0)
+        self._pool = futures.ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='claves')
+
+    def _ejecutar(self, funcion, *args):
+        if not self.compuerta.entrar():
+            raise ServidorOcupado()
+        futuro = self._pool.submit(funcion, *args)
+        futuro.add_done_callback(lambda _: self.compuerta.salir())
+        try:
+            return futuro.result(timeout=self.espera_max)
+        except futures.TimeoutError:
+            raise ServidorOcupado()
+
+    def generar(self, clave):
+        return self._ejecutar(generate_password_hash, clave, app.config['PASSWORD_METODO'])
+
+    def verificar(self, guardada, clave):
+        if not es_hash_clave(guardada):
+            # Contraseña heredada en texto plano: se rehashea al ingresar
+            return hmac.compare_digest(guardada.encode(), clave.encode())
+        return self._ejecutar(check_password_hash, guardada, clave)
+
+    def detener(self):
+        self._pool.shutdown(wait=False)
+
+    @staticmethod
+    def necesita_rehash(guardada):
+        return not guardada.startswith(app.config['PASSWORD_METODO'] + '$')
+
+def _crear_limitador(nombre):
+    capacidad, por_segundo = app.config[f'LIMITE_{nombre.upper()}']
+    return LimitadorTasa(nombre, capacidad, por_segundo)
+
+# Componentes del proceso: los crea create_app() con la configuración final,
+# no la importación del módulo (que no debe abrir archivos ni lanzar hilos)
+indice_acceso = indice_horarios = cache_lectura = escrituras_recientes = None
+canales_asistencia = cola_asistencias = limitadores = compuerta_escritura = None
+indice_periodos = verificador_claves = None
+
+def _crear_componentes():
+    """Crea los índices, cachés y colas del proceso con la configuración vigente."""
+    global indice_acceso, indice_horarios, cache_lectura, escrituras_recientes, canales_asistencia, cola_asistencias
+    global limitadores, compuerta_escritura, indice_periodos, verificador_claves
+    indice_acceso = IndiceAcceso(
+        ttl=app.config['INDICE_ACCESO_TTL'],
+        refresco_min=app.config['INDICE_ACCESO_REFRESCO_MIN']
+    )
+    indice_horarios = IndiceHorarios(
+        ttl=app.config['HORARIOS_TTL'],
+        refresco_min=app.config['INDICE_ACCESO_REFRESCO_MIN']
+    )
+    cache_lectura = CacheLectura(
+        max_entradas=app.config['CACHE_MAX_ENTRADAS'],
+        ttl=app.config['CACHE_TTL'],
+        ruta_compartida=app.config['CACHE_SQLITE_RUTA']
+    )
+    escrituras_recientes = EscriturasRecientes(
+        ventana=app.config['LECTURA_PRIMARIA_SEGUNDOS'],
+        compartido=cache_lectura.compartido
+    )
+    indice_periodos = IndicePeriodos(
+        ttl=app.config['ARCHIVO_TTL'],
+        refresco_min=app.config['INDICE_ACCESO_REFRESCO_MIN']
+    )
+    canales_asistencia = CanalesAsistencia(maxsize=app.config['SSE_COLA_MAX'],
+                                           maximo=app.config['SSE_SUSCRIPTORES_MAX'],
+                                           compartido=cache_lectura.compartido,
+                                           intervalo=app.config['SSE_INTERVALO_REPARTO'])
+    cola_asistencias = ColaAsistencias(
+        app,
+        maxsize=app.config['QR_COLA_MAX'],
+        lote_max=app.config['QR_LOTE_MAX'],
+        intervalo=app.config['QR_INTERVALO_VOLCADO']
+    )
+    limitadores = {nombre: _crear_limitador(nombre) for nombre in (
+        'login_usuario', 'login_ip', 'login_global', 'qr_alumno', 'qr_clase', 'qr_global', 'qr_invalido')}
+    compuerta_escritura = CompuertaConcurrencia(
+        maximo=app.config['ESCRITURA_CONCURRENCIA_MAX'],
+        espera_max=app.config['ESCRITURA_ESPERA_MAX']
+    )
+    verificador_claves = VerificadorClaves(
+        hilos=app.config['PASSWORD_HILOS'],
+        pendientes_max=app.config['PASSWORD_PENDIENTES_MAX'],
+        espera_max=app.config['PASSWORD_ESPERA_MAX']
+    )
+
+def limitar(*verificaciones):
+    """Consume un token de cada (limitador, clave); si alguno está vacío
+    devuelve la respuesta 429 con Retry-After, si no None."""
+    if not app.config['LIMITES_ACTIVOS']:
+        return None
+    for nombre, clave in verificaciones:
+        espera = limitadores[nombre].consumir(clave)
+        if espera:
+            respuesta = jsonify({
+                'error': 'Demasiadas solicitudes',
+                'message': 'Intenta nuevamente en unos segundos'
+            })
+            respuesta.status_code = 429
+            respuesta.headers['Retry-After'] = str(math.ceil(espera))
+            return respuesta
+    return None
+
+def respuesta_sobrecarga(mensaje='Demasiados registros simultáneos, intenta nuevamente', reintento=1):
+    respuesta = jsonify({
+        'error': 'Servidor ocupado',
+        'message': mensaje
+    })
+    respuesta.status_code = 503
+    respuesta.headers['Retry-After'] = str(reintento)
+    return respuesta
+
+def _metricas_cola():
+    e = cola_asistencias.estadisticas()
+    return [
+        '# TYPE asistencia_cola_qr_profundidad gauge',
+        f"asistencia_cola_qr_profundidad {e['profundidad']}",
+        '# TYPE asistencia_cola_qr_volcados_total counter',
+        f"asistencia_cola_qr_volcados_total {e['volcados']}",
+        '# TYPE asistencia_cola_qr_filas_total counter',
+        f"asistencia_cola_qr_filas_total {e['filas_volcadas']}",
+        '# TYPE asistencia_cola_qr_errores_total counter',
+        f"asistencia_cola_qr_errores_total {e['errores']}",
+        '# TYPE asistencia_cola_qr_volcado_segundos_total counter',
+        f"asistencia_cola_qr_volcado_segundos_total {cola_asistencias.latencia_total}",
+    ]
+
+metricas.colectores.append(_metricas_cola)
+
+def _metricas_cache():
+    lineas = [
+        '# TYPE asistencia_cache_entradas gauge',
+        f'asistencia_cache_entradas {cache_lectura.tamano()}',
+        '# TYPE asistencia_cache_hits_total counter',
+    ]
+    lineas += [f'asistencia_cache_hits_total{{endpoint="{e}"}} {n}' for e, n in sorted(cache_lectura.aciertos.items())]
+    lineas.append('# TYPE asistencia_cache_misses_total counter')
+    lineas += [f'asistencia_cache_misses_total{{endpoint="{e}"}} {n}' for e, n in sorted(cache_lectura.fallos.items())]
+    lineas.append('# TYPE asistencia_cache_hit_ratio gauge')
+    for e in sorted(set(cache_lectura.aciertos) | set(cache_lectura.fallos)):
+        aciertos, fallos = cache_lectura.aciertos.get(e, 0), cache_lectura.fallos.get(e, 0)
+        lineas.append(f'asistencia_cache_hit_ratio{{endpoint="{e}"}} {aciertos / (aciertos + fallos):.4f}')
+    return lineas
+
+metricas.colectores.append(_metricas_cache)
+
+def _metricas_en_vivo():
+    return [
+        '# TYPE asistencia_sse_suscriptores gauge',
+        f'asistencia_sse_suscriptores {canales_asistencia.total_suscriptores()}',
+        '# TYPE asistencia_sse_eventos_total counter',
+        f'asistencia_sse_eventos_total {canales_asistencia.publicados}',
+        '# TYPE asistencia_sse_rechazados_total counter',
+        f'asistencia_sse_rechazados_total {canales_asistencia.rechazados}',
+    ]
+
+metricas.colectores.append(_metricas_en_vivo)
+
+def _metricas_limites():
+    lineas = ['# TYPE asistencia_rate_limit_rejections_total counter']
+    lineas += [f'asistencia_rate_limit_rejections_total{{limite="{n}"}} {l.rechazos}' for n, l in sorted(limitadores.items())]
+    lineas.append('# TYPE asistencia_rate_limit_buckets gauge')
+    lineas += [f'asistencia_rate_limit_buckets{{limite="{n}"}} {l.claves()}' for n, l in sorted(limitadores.items())]
+    return lineas + [
+        '# TYPE asistencia_write_gate_in_use gauge',
+        f'asistencia_write_gate_in_use {compuerta_escritura.en_uso}',
+        '# TYPE asistencia_write_gate_capacity gauge',
+        f'asistencia_write_gate_capacity {compuerta_escritura.maximo}',
+        '# TYPE asistencia_write_gate_rejections_total counter',
+        f'asistencia_write_gate_rejections_total {compuerta_escritura.rechazos}',
+    ]
+
+metricas.colectores.append(_metricas_limites)
+
+def _metricas_claves():
+    compuerta = verificador_claves.compuerta
+    return [
+        '# TYPE asistencia_password_pool_threads gauge',
+        f'asistencia_password_pool_threads {verificador_claves.hilos}',
+        '# TYPE asistencia_password_pool_in_use gauge',
+        f'asistencia_password_pool_in_use {compuerta.en_uso}',
+        '# TYPE asistencia_password_pool_rejections_total counter',
+        f'asistencia_password_pool_rejections_total {compuerta.rechazos}',
+    ]
+
+metricas.colectores.append(_metricas_claves)
+
+def _metricas_pool():
+    pools = [(bind or 'principal', engine.pool)
+             for bind, engine in sorted(db.engines.items(), key=lambda e: e[0] or '')
+             if isinstance(engine.pool, PoolMedido)]
+    lineas = []
+    for nombre, tipo, valor in (
+            ('asistencia_db_pool_size', 'gauge', lambda p: p.size()),
+            ('asistencia_db_pool_checked_out', 'gauge', lambda p: p.checkedout()),
+            ('asistencia_db_pool_overflow', 'gauge', lambda p: max(p.overflow(), 0)),
+            ('asistencia_db_pool_saturation', 'gauge',
+             lambda p: round(p.checkedout() / (p.size() + max(p._max_overflow, 0)), 4)),
+            ('asistencia_db_pool_timeouts_total', 'counter', lambda p: p.agotados)):
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        lineas += [f'{nombre}{{bind="{bind}"}} {valor(pool)}' for bind, pool in pools]
+    lineas.append('# HELP asistencia_db_pool_wait_seconds Espera para obtener una conexión del pool.')
+    lineas.append('# TYPE asistencia_db_pool_wait_seconds histogram')
+    for bind, pool in pools:
+        lineas += pool.espera.lineas('asistencia_db_pool_wait_seconds', f'bind="{bind}"')
+    return lineas
+
+metricas.colectores.append(_metricas_pool)
+
 # Autenticación
+# Rutas que no exigen token aunque SESION_OBLIGATORIA esté activo
+RUTAS_PUBLICAS = {'login', 'change_password', 'get_metricas', 'static'}
+
+# Rutas con datos de todo el colegio: exigen siempre un token de estos tipos
+ROLES_POR_RUTA = {'get_reporte_riesgo': {'profesor', 'admin'}}
+
+# Rutas de lectura que exigen siempre token: exponen la lista de alumnos de
+# una clase. Las escrituras (métodos distintos de GET) lo exigen todas.
+RUTAS_CON_SESION = {'get_alumnos_clase'}
+
+def _exige_sesion():
+    if request.endpoint in RUTAS_PUBLICAS:
+        return False
+    return app.config['SESION_OBLIGATORIA'] or request.method not in ('GET', 'HEAD') or \
+        request.endpoint in RUTAS_CON_SESION or request.endpoint in ROLES_POR_RUTA
+
+def _sesion_autorizada(sesion, args):
+    """Compara el usuario del token con los ids de la URL usando el índice
+    en memoria: cada profesor ve lo suyo y los alumnos de sus clases, cada
+    alumno solo lo propio. En las rutas que solo traen clase_id, el profesor
+    debe dictar la clase y el alumno estar inscrito en ella."""
+    usuario_id, tipo, _ = sesion
+    if 'profesor_id' in args and (tipo != 'profesor' or args['profesor_id'] != usuario_id):
+        return False
+    if 'clase_id' in args and 'profesor_id' not in args and 'alumno_id' not in args:
+        if tipo == 'profesor':
+            return indice_acceso.profesor_dicta(usuario_id, args['clase_id'])
+        return indice_acceso.alumno_inscrito(usuario_id, args['clase_id'])
+    if 'alumno_id' in args and args['alumno_id'] != usuario_id:
+        if tipo != 'profesor':
+            return False
+        clases = indice_acceso.clases_de_profesor(usuario_id)
+        if 'clase_id' in args:
+            return args['clase_id'] in clases and indice_acceso.alumno_inscrito(args['alumno_id'], args['clase_id'])
+        return not clases.isdisjoint(indice_acceso.clases_de_alumno(args['alumno_id']))
+    return True
+
+@app.before_request
+def _verificar_sesion():
+    g.sesion = None
+    if request.method == 'OPTIONS':
+        return None
+    autorizacion = request.headers.get('Authorization', '')
+    if autorizacion.startswith('Bearer '):
+        try:
+            g.sesion = verificar_token_sesion(autorizacion[7:].strip())
+        except ValueError as e:
+            return jsonify({'error': 'Sesión inválida', 'message': str(e)}), 401
+    elif _exige_sesion():
+        return jsonify({
+            'error': 'No autenticado',
+            'message': 'Se requiere el encabezado Authorization: Bearer <token>'
+        }), 401
+    roles = ROLES_POR_RUTA.get(request.endpoint)
+    if g.sesion and ((roles and g.sesion[1] not in roles) or
+                     not _sesion_autorizada(g.sesion, request.view_args or {})):
+        return jsonify({
+            'error': 'No autorizado',
+            'message': 'La sesión no tiene acceso a este recurso'
+        }), 403
+    return None
+
 @app.route('/login', methods=['POST'])
 def login():
     try:
@@ -35,6 +2083,11 @@ def login():
                 'message': 'Email y contraseña son requeridos'
             }), 400
 
+        rechazo = limitar(('login_global', ''), ('login_ip', request.remote_addr),
+                          ('login_usuario', str(data['email']).strip().lower()))
+        if rechazo:
+            return rechazo
+
         query = '''
             SELECT id, nombre, email, password, tipo 
             FROM usuarios 
@@ -48,17 +2101,43 @@ def login():
                 'message': 'El email proporcionado no está registrado'
             }), 401
 
-        if user[3] != data['password']:
+        try:
+            valida = verificador_claves.verificar(user[3], str(data['password']))
+        except ServidorOcupado:
+            return respuesta_sobrecarga('Demasiados inicios de sesión simultáneos, intenta nuevamente')
+        if not valida:
             return jsonify({
                 'error': 'Contraseña incorrecta',
                 'message': 'La contraseña proporcionada es incorrecta'
             }), 401
 
+        # Contraseña en texto plano o con un costo anterior: se guarda con el
+        # método actual. Solo si nadie la cambió entremedio
+        if verificador_claves.necesita_rehash(user[3]):
+            try:
+                db.session.execute(text('''
+                    UPDATE usuarios SET password = :nueva
+                    WHERE id = :user_id AND password = :anterior
+                '''), {
+                    'nueva': verificador_claves.generar(str(data['password'])),
+                    'user_id': user[0],
+                    'anterior': user[3]
+                })
+                db.session.commit()
+            except ServidorOcupado:
+                pass
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error al rehashear contraseña: {str(e)}")
+
+        token = firmar_token_sesion(user[0], user[4])
         return jsonify({
             'id': user[0],
             'nombre': user[1],
             'email': user[2],
-            'tipo': user[4]
+            'tipo': user[4],
+            'token': token,
+            'expira': int(token.split('.')[3])
         })
 
     except Exception as e:
@@ -95,16 +2174,19 @@ def change_password():
 
         # Verificar que el usuario existe y la contraseña actual es correcta
         query = '''
-            SELECT id, email 
+            SELECT id, password 
             FROM usuarios 
-            WHERE email = :email AND password = :old_password
+            WHERE email = :email
         '''
-        user = execute_query(query, {
-            'email': data['email'],
-            'old_password': data['oldPassword']
-        }, one=True)
+        user = execute_query(query, {'email': data['email']}, one=True)
 
-        if not user:
+        try:
+            valida = user is not None and verificador_claves.verificar(user[1], str(data['oldPassword']))
+            nueva = verificador_claves.generar(str(data['newPassword'])) if valida else None
+        except ServidorOcupado:
+            return respuesta_sobrecarga('Demasiadas verificaciones de contraseña simultáneas, intenta nuevamente')
+
+        if not valida:
             return jsonify({
                 'error': 'Credenciales inválidas',
                 'message': 'El email o la contraseña actual son incorrectos'
@@ -119,7 +2201,7 @@ def change_password():
         
         try:
             db.session.execute(text(update_query), {
-                'new_password': data['newPassword'],
+                'new_password': nueva,
                 'user_id': user[0]
             })
             db.session.commit()
@@ -143,44 +2225,68 @@ def change_password():
             'message': 'Ocurrió un error al procesar la solicitud'
         }), 500
 
+@app.route('/login/renovar', methods=['POST'])
+def renovar_sesion():
+    """Entrega un token nuevo a partir de uno vigente, sin consultar la base."""
+    if not g.sesion:
+        return jsonify({
+            'error': 'No autenticado',
+            'message': 'Se requiere el encabezado Authorization: Bearer <token>'
+        }), 401
+    usuario_id, tipo, inicio = g.sesion
+    if time.time() - inicio > app.config['SESION_DURACION_MAX']:
+        return jsonify({
+            'error': 'Sesión expirada',
+            'message': 'Vuelve a iniciar sesión'
+        }), 401
+    token = firmar_token_sesion(usuario_id, tipo, inicio=inicio)
+    return jsonify({'token': token, 'expira': int(token.split('.')[3])})
+
 # Rutas para profesor
 
 @app.route('/profesor/<int:profesor_id>/clases', methods=['GET'])
+@solo_lectura(lambda profesor_id: [f'profesor:{profesor_id}'])
+@cacheado(lambda profesor_id: [f'profesor:{profesor_id}'])
 def get_clases_profesor(profesor_id):
     try:
+        # Una sola consulta: los agregados se calculan por conjunto para todas
+        # las clases del profesor, sin subconsultas correlacionadas por fila
         clases = execute_query('''
             SELECT 
                 c.id, 
                 c.nombre,
-                (SELECT COUNT(DISTINCT i.alumno_id) 
-                 FROM inscripciones i 
-                 WHERE i.clase_id = c.id) as total_alumnos,
-                (SELECT COUNT(DISTINCT a.alumno_id) 
-                 FROM asistencias a 
-                 WHERE a.clase_id = c.id 
-                 AND a.fecha = CURRENT_DATE
-                 AND a.estado = 'Presente') as presentes_hoy
+                ins.total_alumnos,
+                res.presentes_hoy,
+                res.ultima_asistencia
             FROM clases c
+            LEFT JOIN (
+                SELECT i.clase_id, COUNT(DISTINCT i.alumno_id) as total_alumnos
+                FROM inscripciones i
+                JOIN clases ci ON ci.id = i.clase_id
+                WHERE ci.profesor_id = :profesor_id
+                GROUP BY i.clase_id
+            ) ins ON ins.clase_id = c.id
+            LEFT JOIN (
+                SELECT 
+                    r.clase_id,
+                    MAX(CASE WHEN r.fecha = CURRENT_DATE THEN r.presentes END) as presentes_hoy,
+                    MAX(r.fecha) as ultima_asistencia
+                FROM resumen_asistencia_diaria r
+                JOIN clases cr ON cr.id = r.clase_id
+                WHERE cr.profesor_id = :profesor_id
+                GROUP BY r.clase_id
+            ) res ON res.clase_id = c.id
             WHERE c.profesor_id = :profesor_id
             ORDER BY c.nombre
         ''', {'profesor_id': profesor_id})
         
-        result = []
-        for clase in clases:
-            # Obtener última fecha de asistencia registrada
-            ultima_asistencia = execute_query('''
-                SELECT MAX(fecha) 
-                FROM asistencias 
-                WHERE clase_id = :clase_id
-            ''', {'clase_id': clase[0]}, one=True)
-
-            result.append({
-                'id': clase[0],
-                'nombre': clase[1],
-                'total_alumnos': clase[2] or 0,
-                'presentes_hoy': clase[3] or 0,
-                'ultima_asistencia': ultima_asistencia[0].strftime('%Y-%m-%d') if ultima_asistencia[0] else None
-            })
+        result = [{
+            'id': clase[0],
+            'nombre': clase[1],
+            'total_alumnos': clase[2] or 0,
+            'presentes_hoy': clase[3] or 0,
+            'ultima_asistencia': clase[4].strftime('%Y-%m-%d') if clase[4] else None
+        } for clase in clases]
         
         return jsonify(result)
     except Exception as e:
@@ -188,28 +2294,23 @@ def get_clases_profesor(profesor_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/profesor/<int:profesor_id>/clase/<int:clase_id>/resumen', methods=['GET'])
+@solo_lectura(lambda profesor_id, clase_id: [f'clase:{clase_id}'])
 def get_resumen_clase(profesor_id, clase_id):
     try:
         # Verificar que la clase pertenece al profesor
-        verificacion = execute_query('''
-            SELECT 1 FROM clases 
-            WHERE id = :clase_id AND profesor_id = :profesor_id
-        ''', {'clase_id': clase_id, 'profesor_id': profesor_id}, one=True)
-        
-        if not verificacion:
+        if not indice_acceso.profesor_dicta(profesor_id, clase_id):
             return jsonify({'error': 'Clase no encontrada'}), 404
 
-        # Obtener resumen de asistencias
+        # Obtener resumen de asistencias (pre-agregado por día)
         resumen = execute_query('''
             SELECT 
-                COUNT(DISTINCT a.alumno_id) as total_alumnos,
-                COUNT(DISTINCT CASE WHEN a.estado = 'Presente' THEN a.alumno_id END) as presentes,
-                COUNT(DISTINCT CASE WHEN a.estado = 'Ausente' THEN a.alumno_id END) as ausentes,
-                DATE(a.fecha) as fecha
-            FROM asistencias a
-            WHERE a.clase_id = :clase_id
-            GROUP BY DATE(a.fecha)
-            ORDER BY fecha DESC
+                r.total as total_alumnos,
+                r.presentes,
+                r.ausentes,
+                r.fecha
+            FROM resumen_asistencia_diaria r
+            WHERE r.clase_id = :clase_id
+            ORDER BY r.fecha DESC
             LIMIT 7
         ''', {'clase_id': clase_id})
 
@@ -224,32 +2325,26 @@ def get_resumen_clase(profesor_id, clase_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/clases/<int:clase_id>/alumnos', methods=['GET'])
+@solo_lectura(lambda clase_id: [f'clase:{clase_id}'])
+@con_etag(lambda clase_id: [f'clase:{clase_id}'])
+@cacheado(lambda clase_id: [f'clase:{clase_id}'])
 def get_alumnos_clase(clase_id):
     try:
+        # Totales y último registro por alumno desde los contadores
+        # mantenidos en cada escritura: una búsqueda por clave por alumno
         alumnos = execute_query('''
             SELECT DISTINCT 
                 u.id, 
                 u.nombre,
                 u.email,
-                (SELECT COUNT(*) 
-                 FROM asistencias a 
-                 WHERE a.alumno_id = u.id 
-                 AND a.clase_id = :clase_id) as total_asistencias,
-                (SELECT estado 
-                 FROM asistencias a 
-                 WHERE a.alumno_id = u.id 
-                 AND a.clase_id = :clase_id 
-                 ORDER BY a.fecha DESC 
-                 LIMIT 1) as ultimo_estado,
-                (SELECT fecha 
-                 FROM asistencias a 
-                 WHERE a.alumno_id = u.id 
-                 AND a.clase_id = :clase_id 
-                 ORDER BY a.fecha DESC 
-                 LIMIT 1) as ultima_fecha
+                k.total as total_asistencias,
+                k.ultimo_estado,
+                k.ultima_fecha
             FROM usuarios u
             JOIN alumnos a ON u.id = a.id
             JOIN inscripciones i ON a.id = i.alumno_id
+            LEFT JOIN contadores_asistencia k ON k.alumno_id = u.id 
+                AND k.clase_id = :clase_id
             WHERE i.clase_id = :clase_id
             ORDER BY u.nombre
         ''', {'clase_id': clase_id})
@@ -267,20 +2362,20 @@ def get_alumnos_clase(clase_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/profesor/<int:profesor_id>/clase/<int:clase_id>/resumen', methods=['GET'])
+@solo_lectura(lambda profesor_id, clase_id: [f'clase:{clase_id}'])
 def get_resumen_asistencia_clase(profesor_id, clase_id):
     try:
         resumen = execute_query('''
             SELECT 
-                a.fecha,
-                COUNT(DISTINCT CASE WHEN a.estado = 'Presente' THEN a.alumno_id END) as presentes,
-                COUNT(DISTINCT CASE WHEN a.estado = 'Ausente' THEN a.alumno_id END) as ausentes,
+                r.fecha,
+                r.presentes,
+                r.ausentes,
                 (SELECT COUNT(DISTINCT alumno_id) 
                  FROM inscripciones 
                  WHERE clase_id = :clase_id) as total_alumnos
-            FROM asistencias a
-            WHERE a.clase_id = :clase_id
-            GROUP BY a.fecha
-            ORDER BY a.fecha DESC
+            FROM resumen_asistencia_diaria r
+            WHERE r.clase_id = :clase_id
+            ORDER BY r.fecha DESC
             LIMIT 7
         ''', {'clase_id': clase_id})
 
@@ -295,208 +2390,475 @@ def get_resumen_asistencia_clase(profesor_id, clase_id):
         return jsonify({'error': str(e)}), 500
 
 # Rutas para alumnos
+def lista_sql(nombre, valores):
+    """Marcadores y parámetros para `IN (...)`: ('(:x_0, :x_1)', {'x_0': .., 'x_1': ..})."""
+    params = {f'{nombre}_{n}': v for n, v in enumerate(valores)}
+    return '(' + ', '.join(':' + k for k in params) + ')', params
+
+def clases_de_alumno(alumno_id, clase_ids=None):
+    """Clases en que está inscrito el alumno (opcionalmente solo `clase_ids`),
+    con el profesor y la última asistencia desde los contadores."""
+    filtro, params = '', {'alumno_id': alumno_id}
+    if clase_ids is not None:
+        if not clase_ids:
+            return []
+        marcadores, ids = lista_sql('clase_id', sorted(clase_ids))
+        filtro = f'AND c.id IN {marcadores}'
+        params.update(ids)
+    clases = execute_query(f'''
+        SELECT DISTINCT 
+            c.id, 
+            c.nombre, 
+            u.nombre as profesor,
+            k.ultima_fecha as ultima_asistencia
+        FROM clases c
+        JOIN inscripciones i ON c.id = i.clase_id
+        JOIN profesores p ON c.profesor_id = p.id
+        JOIN usuarios u ON p.id = u.id
+        LEFT JOIN contadores_asistencia k ON k.alumno_id = i.alumno_id
+            AND k.clase_id = c.id
+        WHERE i.alumno_id = :alumno_id
+        {filtro}
+        ORDER BY c.nombre
+    ''', params)
+    return [{
+        'id': c[0],
+        'nombre': c[1],
+        'profesor': c[2],
+        'ultimaAsistencia': c[3].strftime('%Y-%m-%d') if c[3] else None
+    } for c in clases]
+
+def estadisticas_de_alumno(alumno_id, clase_ids=None):
+    """Totales por clase del alumno desde contadores_asistencia."""
+    filtro, params = '', {'alumno_id': alumno_id}
+    if clase_ids is not None:
+        if not clase_ids:
+            return []
+        marcadores, ids = lista_sql('clase_id', sorted(clase_ids))
+        filtro = f'AND k.clase_id IN {marcadores}'
+        params.update(ids)
+    stats = execute_query(f'''
+        SELECT 
+            c.id,
+            c.nombre,
+            k.total as total_clases,
+            k.presentes,
+            k.ausentes
+        FROM contadores_asistencia k
+        JOIN clases c ON k.clase_id = c.id
+        WHERE k.alumno_id = :alumno_id
+        {filtro}
+    ''', params)
+    return [{
+        'clase_id': s[0],
+        'clase_nombre': s[1],
+        'total_clases': s[2],
+        'presentes': s[3],
+        'ausentes': s[4],
+        'porcentaje_asistencia': round((s[3] / s[2]) * 100, 2) if s[2] > 0 else 0
+    } for s in stats]
+
 @app.route('/alumno/<int:alumno_id>/clases', methods=['GET'])
+@solo_lectura(lambda alumno_id: [f'alumno:{alumno_id}'])
+@cacheado(lambda alumno_id: [f'alumno:{alumno_id}'])
 def get_clases_alumno(alumno_id):
     try:
-        clases = execute_query('''
-            SELECT DISTINCT 
-                c.id, 
-                c.nombre, 
-                u.nombre as profesor,
-                (SELECT fecha 
-                 FROM asistencias 
-                 WHERE alumno_id = :alumno_id 
-                 AND clase_id = c.id 
-                 ORDER BY fecha DESC 
-                 LIMIT 1) as ultima_asistencia
-            FROM clases c
-            JOIN inscripciones i ON c.id = i.clase_id
-            JOIN profesores p ON c.profesor_id = p.id
-            JOIN usuarios u ON p.id = u.id
-            WHERE i.alumno_id = :alumno_id
-            ORDER BY c.nombre
-        ''', {'alumno_id': alumno_id})
-        
-        return jsonify([{
-            'id': c[0],
-            'nombre': c[1],
-            'profesor': c[2],
-            'ultimaAsistencia': c[3].strftime('%Y-%m-%d') if c[3] else None
-        } for c in clases])
+        return jsonify(clases_de_alumno(alumno_id))
     except Exception as e:
         print(f"Error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+CAMPOS_DASHBOARD = ('profesor', 'ultima_asistencia', 'estadisticas', 'horarios', 'resumen')
+
+def _porcentaje(presentes, total):
+    return round((presentes / total) * 100, 2) if total else 0
+
+@app.route('/alumno/<int:alumno_id>/dashboard', methods=['GET'])
+@solo_lectura(lambda alumno_id: [f'alumno:{alumno_id}'])
+@cacheado(lambda alumno_id: [f'alumno:{alumno_id}'], parametros=('fields',))
+def get_dashboard_alumno(alumno_id):
+    """Pantalla de inicio del alumno en una petición.
+
+    `fields` elige las partes (por defecto todas). Profesor, última asistencia,
+    estadísticas y resumen salen de una sola consulta sobre las inscripciones
+    con los contadores; los horarios, del índice en memoria. Con solo
+    `fields=horarios` la ruta no consulta la base.
+    """
+    try:
+        campos = request.args.get('fields')
+        campos = set(CAMPOS_DASHBOARD) if campos is None else \
+            {c.strip() for c in campos.split(',') if c.strip()}
+        if campos - set(CAMPOS_DASHBOARD):
+            return jsonify({
+                'error': 'Parámetros inválidos',
+                'message': f"fields admite: {', '.join(CAMPOS_DASHBOARD)}"
+            }), 400
+
+        con_profesor = 'profesor' in campos
+        con_contadores = bool(campos & {'ultima_asistencia', 'estadisticas', 'resumen'})
+        if con_profesor or con_contadores:
+            columnas = ['c.id', 'c.nombre']
+            joins = []
+            if con_profesor:
+                columnas.append('u.nombre as profesor')
+                joins.append('JOIN profesores p ON c.profesor_id = p.id')
+                joins.append('JOIN usuarios u ON p.id = u.id')
+            if con_contadores:
+                columnas += ['k.total', 'k.presentes', 'k.ausentes', 'k.ultima_fecha', 'k.ultimo_estado']
+                joins.append('LEFT JOIN contadores_asistencia k ON k.alumno_id = i.alumno_id AND k.clase_id = c.id')
+            filas = [dict(zip(('id', 'nombre', *(['profesor'] if con_profesor else []),
+                               'total', 'presentes', 'ausentes', 'ultima_fecha', 'ultimo_estado'), fila))
+                     for fila in execute_query(f'''
+                SELECT {', '.join(columnas)}
+                FROM inscripciones i
+                JOIN clases c ON c.id = i.clase_id
+                {' '.join(joins)}
+                WHERE i.alumno_id = :alumno_id
+                ORDER BY c.nombre, c.id
+            ''', {'alumno_id': alumno_id})]
+        else:
+            filas = sorted(({'id': clase_id, 'nombre': indice_horarios.nombre_de(clase_id)}
+                            for clase_id in indice_acceso.clases_de_alumno(alumno_id)),
+                           key=lambda f: (f['nombre'] or '', f['id']))
+
+        clases = []
+        for f in filas:
+            clase = {'id': f['id'], 'nombre': f['nombre']}
+            if con_profesor:
+                clase['profesor'] = f['profesor']
+            if 'ultima_asistencia' in campos:
+                clase['ultimaAsistencia'] = f['ultima_fecha'].strftime('%Y-%m-%d') if f['ultima_fecha'] else None
+                clase['ultimoEstado'] = f['ultimo_estado'].lower() if f['ultimo_estado'] else None
+            if 'estadisticas' in campos:
+                clase['estadisticas'] = {
+                    'total_clases': f['total'] or 0,
+                    'presentes': f['presentes'] or 0,
+                    'ausentes': f['ausentes'] or 0,
+                    'porcentaje_asistencia': _porcentaje(f['presentes'] or 0, f['total'] or 0)
+                }
+            if 'horarios' in campos:
+                clase['horarios'] = formato_bloques(indice_horarios.bloques_de(f['id']))
+            clases.append(clase)
+
+        resultado = {'alumno_id': alumno_id, 'clases': clases}
+        if 'resumen' in campos:
+            total = sum(f['total'] or 0 for f in filas)
+            presentes = sum(f['presentes'] or 0 for f in filas)
+            resultado['resumen'] = {
+                'total_clases': total,
+                'presentes': presentes,
+                'ausentes': sum(f['ausentes'] or 0 for f in filas),
+                'porcentaje_asistencia': _porcentaje(presentes, total)
+            }
+        return jsonify(resultado)
+    except Exception as e:
+        print(f"Error en dashboard: {str(e)}")  # Para debugging
+        return jsonify({
+            'error': 'Error del servidor',
+            'message': str(e)
+        }), 500
+
 @app.route('/asistencia/<int:alumno_id>/<int:clase_id>', methods=['GET'])
+@solo_lectura(lambda alumno_id, clase_id: [f'alumno:{alumno_id}'])
+@con_etag(lambda alumno_id, clase_id: [f'alumno:{alumno_id}'],
+          parametros=('limit', 'before', 'desde', 'hasta'))
 def get_asistencia_alumno(alumno_id, clase_id):
     try:
-        asistencias = execute_query('''
+        try:
+            limite, before, desde, hasta = parametros_paginacion(100, 500)
+        except ValueError as e:
+            return jsonify({'error': 'Parámetros inválidos', 'message': str(e)}), 400
+
+        condiciones, params = filtro_fechas('fecha', before, desde, hasta)
+        asistencias = execute_query(f'''
             SELECT fecha, estado 
             FROM asistencias 
             WHERE alumno_id = :alumno_id 
             AND clase_id = :clase_id
+            {condiciones}
             ORDER BY fecha DESC
+            LIMIT :limite
         ''', {
             'alumno_id': alumno_id,
-            'clase_id': clase_id
+            'clase_id': clase_id,
+            'limite': limite + 1,
+            **params
         })
-        
-        return jsonify([{
+
+        # Las filas vivas son todas posteriores al corte: si no llenan la
+        # página, el historial sigue en los períodos archivados
+        corte = indice_periodos.corte()
+        if len(asistencias) <= limite and corte and not (desde and desde > corte):
+            tope = min(corte, hasta or corte, before - timedelta(days=1) if before else corte)
+            archivadas = sorted(((fecha, estado) for _, _, fecha, estado in asistencias_archivadas(
+                clase_id=clase_id, alumno_id=alumno_id, desde=desde, hasta=tope)), reverse=True)
+            asistencias = list(asistencias) + archivadas[:limite + 1 - len(asistencias)]
+
+        pagina = asistencias[:limite]
+        return respuesta_paginada([{
             'fecha': a[0].strftime('%Y-%m-%d'),
             'estado': a[1]
-        } for a in asistencias])
+        } for a in pagina], pagina[-1][0] if len(asistencias) > limite else None)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/alumno/<int:alumno_id>/estadisticas', methods=['GET'])
+@solo_lectura(lambda alumno_id: [f'alumno:{alumno_id}'])
 def get_estadisticas_alumno(alumno_id):
     try:
-        # Estadísticas generales
-        stats = execute_query('''
-            SELECT 
-                c.id,
-                c.nombre,
-                COUNT(*) as total_clases,
-                SUM(CASE WHEN a.estado = 'Presente' THEN 1 ELSE 0 END) as presentes,
-                SUM(CASE WHEN a.estado = 'Ausente' THEN 1 ELSE 0 END) as ausentes
-            FROM asistencias a
-            JOIN clases c ON a.clase_id = c.id
-            WHERE a.alumno_id = :alumno_id
-            GROUP BY c.id, c.nombre
-        ''', {'alumno_id': alumno_id})
-        
-        return jsonify([{
-            'clase_id': s[0],
-            'clase_nombre': s[1],
-            'total_clases': s[2],
-            'presentes': s[3],
-            'ausentes': s[4],
-            'porcentaje_asistencia': round((s[3] / s[2]) * 100, 2) if s[2] > 0 else 0
-        } for s in stats])
+        # Estadísticas generales desde los contadores por (alumno, clase)
+        return jsonify(estadisticas_de_alumno(alumno_id))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Rutas para registro de asistencia y QR
 @app.route('/registrar-asistencia-qr', methods=['POST'])
 def registrar_asistencia_qr():
-    print("Received request data:", request.json)  # Debug log
-    
     try:
         data = request.json
         if not data or 'qrData' not in data or 'alumnoId' not in data:
             return jsonify({'error': 'Datos incompletos'}), 400
 
-        # Asegurarnos de que qrData es un string
-        qr_data_str = data['qrData']
-        if not isinstance(qr_data_str, str):
-            qr_data_str = json.dumps(qr_data_str)
-
+        # qrData es el token firmado, o un JSON con el token en 'token'
+        token = data['qrData']
+        if isinstance(token, str) and token.lstrip().startswith('{'):
+            try:
+                token = json.loads(token)
+            except json.JSONDecodeError as e:
+                print("Error decoding JSON:", str(e))
+                return jsonify({'error': 'Formato de QR inválido'}), 400
+        if isinstance(token, dict):
+            token = token.get('token')
+
+        alumno_id = data['alumnoId']
+        if not isinstance(alumno_id, int) or isinstance(alumno_id, bool):
+            return jsonify({'error': 'alumnoId inválido'}), 400
+        if g.sesion[1] != 'alumno' or g.sesion[0] != alumno_id:
+            return jsonify({'error': 'La sesión no corresponde al alumno'}), 403
+
+        # Validación de firma y vigencia (5 minutos) en memoria, antes de las
+        # cubetas: un token falsificado no puede agotar la cuota de un alumno
+        # ni la global. Los rechazos se limitan por IP.
         try:
-            qr_data = json.loads(qr_data_str)
-            print("Decoded QR data:", qr_data)  # Debug log
-        except json.JSONDecodeError as e:
-            print("Error decoding JSON:", str(e))
-            print("Received qrData:", qr_data_str)
-            return jsonify({'error': 'Formato de QR inválido'}), 400
-
-        # Resto del código...
-
-        # Registrar asistencia
-        query = '''
-            INSERT INTO asistencias (alumno_id, clase_id, fecha, estado)
-            VALUES (:alumno_id, :clase_id, CURRENT_DATE(), 'Presente')
-        '''
-        
+            clase_id, nonce, emitido = verificar_token_qr(token)
+        except ValueError as e:
+            return limitar(('qr_invalido', request.remote_addr)) or (jsonify({'error': str(e)}), 401)
+
+        rechazo = limitar(('qr_global', ''), ('qr_alumno', alumno_id), ('qr_clase', clase_id))
+        if rechazo:
+            return rechazo
+
+        if not indice_acceso.alumno_inscrito(alumno_id, clase_id):
+            return jsonify({'error': 'El alumno no está inscrito en la clase'}), 403
+
+        if app.config['QR_VALIDAR_HORARIO'] and not indice_horarios.en_horario(
+                clase_id, datetime.now(), app.config['QR_MARGEN_HORARIO_MIN']):
+            return jsonify({'error': 'Fuera del horario de la clase'}), 403
+
+        if not escaneos_recientes.registrar(nonce, alumno_id, emitido + app.config['QR_VALIDEZ_SEGUNDOS']):
+            return jsonify({'message': 'Asistencia ya registrada con este código'})
+
+        # La fecha sale del reloj del proceso en ambos caminos, como la
+        # validación de horario: el diferido no puede usar CURRENT_DATE al
+        # volcar, y así un escaneo cerca de medianoche no cambia de día
+        hoy = date.today()
+
+        # Modo diferido: confirmar al instante y dejar la escritura al volcador
+        if app.config['QR_ESCRITURA_DIFERIDA'] and \
+                cola_asistencias.encolar(alumno_id, clase_id, hoy):
+            return jsonify({'message': 'Asistencia recibida', 'pendiente': True}), 202
+
+        # Registrar asistencia; si la base ya tiene demasiadas escrituras en
+        # curso se responde 503 al instante en vez de encolar en el pool
+        if not compuerta_escritura.entrar():
+            escaneos_recientes.olvidar(nonce, alumno_id)
+            return respuesta_sobrecarga()
         try:
-            db.session.execute(text(query), {
-                'alumno_id': data['alumnoId'],
-                'clase_id': qr_data['clase_id']
-            })
+            diferencias = escribir_asistencias(clase_id, [(alumno_id, 'Presente')], fecha=hoy)
             db.session.commit()
+            despues_de_escribir_asistencias(clase_id, [(alumno_id, 'Presente')], diferencias, hoy)
             
             return jsonify({'message': 'Asistencia registrada correctamente'})
             
         except Exception as e:
             db.session.rollback()
+            escaneos_recientes.olvidar(nonce, alumno_id)
             print("Database error:", str(e))
             return jsonify({'error': f'Error al registrar asistencia: {str(e)}'}), 500
+        finally:
+            compuerta_escritura.salir()
 
     except Exception as e:
         print("General error:", str(e))
         return jsonify({'error': str(e)}), 500
 
+@app.route('/profesor/<int:profesor_id>/clase/<int:clase_id>/qr', methods=['GET'])
+def generar_qr_clase(profesor_id, clase_id):
+    try:
+        # Un QR vale como asistencia: solo lo emite el profesor autenticado
+        # (el token de sesión ya se comparó con profesor_id antes de la vista)
+        if not g.sesion:
+            return jsonify({
+                'error': 'No autenticado',
+                'message': 'Se requiere el encabezado Authorization: Bearer <token>'
+            }), 401
+
+        # Verificar que la clase pertenece al profesor
+        if not indice_acceso.profesor_dicta(profesor_id, clase_id):
+            return jsonify({
+                'error': 'No autorizado',
+                'message': 'Esta clase no pertenece al profesor'
+            }), 403
+
+        emitido = int(time.time())
+        return jsonify({
+            'clase_id': clase_id,
+            'token': firmar_token_qr(clase_id, emitido),
+            'expira': datetime.fromtimestamp(emitido + app.config['QR_VALIDEZ_SEGUNDOS']).isoformat()
+        })
+
+    except Exception as e:
+        print(f"Error al generar QR: {str(e)}")  # Para debugging
+        return jsonify({
+            'error': 'Error del servidor',
+            'message': str(e)
+        }), 500
+
+def con_archivo(filas, clase_id, fecha_min, fecha_max):
+    """Completa las filas (alumno_id, nombre, total, fecha, estado) de la
+    grilla con las asistencias archivadas de la clase entre las fechas.
+
+    Conserva el orden por alumno y fecha descendente: las archivadas son
+    anteriores a todas las vivas y van al final de cada alumno.
+    """
+    archivadas = {}
+    for alumno_id, _, fecha, estado in asistencias_archivadas(clase_id=clase_id, desde=fecha_min, hasta=fecha_max):
+        archivadas.setdefault(alumno_id, []).append((fecha, estado))
+    if not archivadas:
+        return filas
+    resultado = []
+    for n, fila in enumerate(filas):
+        propias = archivadas.get(fila[0])
+        if fila[3] is not None or not propias:
+            resultado.append(fila)
+        if propias and (n + 1 == len(filas) or filas[n + 1][0] != fila[0]):
+            resultado.extend((fila[0], fila[1], fila[2], fecha, estado)
+                             for fecha, estado in sorted(propias, reverse=True))
+    return resultado
+
+def matriz_asistencia(fechas, filas):
+    """Arma el formato columnar alumno x fecha en una sola pasada.
+
+    `filas` viene ordenada por alumno: (alumno_id, nombre, total, fecha, estado).
+    Cada alumno tiene una cadena de estados con un carácter por fecha, en el
+    mismo orden que `fechas`.
+    """
+    columna = {f: n for n, f in enumerate(fechas)}
+    alumnos = []
+    estados = []
+    celdas = None
+    for row in filas:
+        if not alumnos or alumnos[-1]['id'] != row[0]:
+            if celdas is not None:
+                estados.append(''.join(celdas))
+            alumnos.append({'id': row[0], 'nombre': row[1], 'total_asistencias': row[2] or 0})
+            celdas = [SIN_REGISTRO] * len(fechas)
+        if row[3] in columna:
+            celdas[columna[row[3]]] = CODIGOS_ESTADO.get(row[4], SIN_REGISTRO)
+    if celdas is not None:
+        estados.append(''.join(celdas))
+
+    return {
+        'fechas': [f.strftime('%Y-%m-%d') for f in fechas],
+        'alumnos': alumnos,
+        'estados': estados,
+        'codigos': {codigo: estado.lower() for estado, codigo in CODIGOS_ESTADO.items()}
+    }
+
 @app.route('/profesor/<int:profesor_id>/asistencia/<int:clase_id>', methods=['GET'])
+@solo_lectura(lambda profesor_id, clase_id: [f'clase:{clase_id}'])
 def get_asistencia_clase(profesor_id, clase_id):
     try:
         # Verificar que la clase pertenezca al profesor
-        verificacion = execute_query('''
-            SELECT 1 FROM clases 
-            WHERE id = :clase_id AND profesor_id = :profesor_id
-        ''', {
-            'clase_id': clase_id,
-            'profesor_id': profesor_id
-        }, one=True)
-
-        if not verificacion:
+        if not indice_acceso.profesor_dicta(profesor_id, clase_id):
             return jsonify({
                 'error': 'No autorizado',
                 'message': 'Esta clase no pertenece al profesor'
             }), 403
 
-        # Obtener lista de alumnos inscritos y sus asistencias
-        asistencias = execute_query('''
+        formato = request.args.get('formato', 'lista')
+        if formato not in ('lista', 'matriz'):
+            return jsonify({
+                'error': 'Formato inválido',
+                'message': 'Los formatos disponibles son lista y matriz'
+            }), 400
+
+        try:
+            limite, before, desde, hasta = parametros_paginacion(30, 200)
+        except ValueError as e:
+            return jsonify({'error': 'Parámetros inválidos', 'message': str(e)}), 400
+
+        # Página de fechas (keyset sobre fecha) leída del resumen diario
+        condiciones, params = filtro_fechas('r.fecha', before, desde, hasta)
+        fechas = [r[0] for r in execute_query(f'''
+            SELECT r.fecha
+            FROM resumen_asistencia_diaria r
+            WHERE r.clase_id = :clase_id
+            {condiciones}
+            ORDER BY r.fecha DESC
+            LIMIT :limite
+        ''', {'clase_id': clase_id, 'limite': limite + 1, **params})]
+        siguiente = fechas[limite - 1] if len(fechas) > limite else None
+        fechas = fechas[:limite]
+
+        # Alumnos inscritos y sus asistencias dentro de la página, en una sola
+        # consulta plana ordenada por alumno y fecha
+        filas = execute_query('''
             SELECT 
                 u.id as alumno_id,
                 u.nombre as alumno_nombre,
-                (SELECT COUNT(*) 
-                 FROM asistencias a 
-                 WHERE a.alumno_id = u.id 
-                 AND a.clase_id = :clase_id) as total_asistencias,
-                (SELECT GROUP_CONCAT(
-                    JSON_OBJECT(
-                        'fecha', DATE_FORMAT(a2.fecha, '%Y-%m-%d'),
-                        'estado', LOWER(a2.estado)
-                    )
-                    ORDER BY a2.fecha DESC
-                ) 
-                 FROM asistencias a2 
-                 WHERE a2.alumno_id = u.id 
-                 AND a2.clase_id = :clase_id) as asistencias_json
-            FROM usuarios u
-            JOIN alumnos al ON u.id = al.id
-            JOIN inscripciones i ON al.id = i.alumno_id
+                k.total as total_asistencias,
+                a.fecha,
+                a.estado
+            FROM inscripciones i
+            JOIN alumnos al ON al.id = i.alumno_id
+            JOIN usuarios u ON u.id = al.id
+            LEFT JOIN contadores_asistencia k ON k.alumno_id = i.alumno_id
+                AND k.clase_id = i.clase_id
+            LEFT JOIN asistencias a ON a.alumno_id = i.alumno_id 
+                AND a.clase_id = i.clase_id
+                AND a.fecha BETWEEN :fecha_min AND :fecha_max
             WHERE i.clase_id = :clase_id
-            GROUP BY u.id, u.nombre
-            ORDER BY u.nombre
-        ''', {'clase_id': clase_id})
-
-        # Procesar los resultados
-        result = []
-        for row in asistencias:
-            alumno_data = {
-                'alumno_id': row[0],
-                'alumno_nombre': row[1],
-                'total_asistencias': row[2] or 0,
-                'asistencias': []
-            }
-
-            # Procesar el JSON de asistencias si existe
-            if row[3]:  # asistencias_json
-                try:
-                    import json
-                    asistencias_list = json.loads('[' + row[3] + ']')
-                    alumno_data['asistencias'] = asistencias_list
-                except Exception as e:
-                    print(f"Error procesando JSON de asistencias: {str(e)}")
-                    alumno_data['asistencias'] = []
-
-            result.append(alumno_data)
+            ORDER BY u.nombre, u.id, a.fecha DESC
+        ''', {
+            'clase_id': clase_id,
+            'fecha_min': fechas[-1] if fechas else None,
+            'fecha_max': fechas[0] if fechas else None
+        })
+        corte = indice_periodos.corte()
+        if fechas and corte and fechas[-1] <= corte:
+            filas = con_archivo(filas, clase_id, fechas[-1], min(fechas[0], corte))
 
-        if not result:
-            # Si no hay alumnos, devolver lista vacía pero con status 200
-            return jsonify([])
+        if formato == 'matriz':
+            return respuesta_paginada(matriz_asistencia(fechas, filas), siguiente)
 
-        return jsonify(result)
+        # Agrupar en una sola pasada
+        result = []
+        for row in filas:
+            if not result or result[-1]['alumno_id'] != row[0]:
+                result.append({
+                    'alumno_id': row[0],
+                    'alumno_nombre': row[1],
+                    'total_asistencias': row[2] or 0,
+                    'asistencias': []
+                })
+            if row[3]:
+                result[-1]['asistencias'].append({
+                    'fecha': row[3].strftime('%Y-%m-%d'),
+                    'estado': row[4].lower()
+                })
+
+        return respuesta_paginada(result, siguiente)
 
     except Exception as e:
         print(f"Error en asistencias: {str(e)}")  # Para debugging
@@ -508,18 +2870,13 @@ def get_asistencia_clase(profesor_id, clase_id):
         }), 500
 
 @app.route('/profesor/<int:profesor_id>/clase/<int:clase_id>/resumen-dia', methods=['GET'])
+@solo_lectura(lambda profesor_id, clase_id: [f'clase:{clase_id}'])
+@con_etag(lambda profesor_id, clase_id: [f'clase:{clase_id}'],
+          autorizar=lambda profesor_id, clase_id: indice_acceso.profesor_dicta(profesor_id, clase_id))
 def get_resumen_dia(profesor_id, clase_id):
     try:
         # Verificar que la clase pertenece al profesor
-        verificacion = execute_query('''
-            SELECT 1 FROM clases 
-            WHERE id = :clase_id AND profesor_id = :profesor_id
-        ''', {
-            'clase_id': clase_id,
-            'profesor_id': profesor_id
-        }, one=True)
-
-        if not verificacion:
+        if not indice_acceso.profesor_dicta(profesor_id, clase_id):
             return jsonify({
                 'error': 'No autorizado',
                 'message': 'Esta clase no pertenece al profesor'
@@ -528,14 +2885,17 @@ def get_resumen_dia(profesor_id, clase_id):
         # Obtener el resumen del día
         resumen = execute_query('''
             SELECT 
-                COUNT(DISTINCT i.alumno_id) as total_alumnos,
-                COUNT(DISTINCT CASE WHEN a.estado = 'Presente' THEN a.alumno_id END) as presentes,
-                COUNT(DISTINCT CASE WHEN a.estado = 'Ausente' THEN a.alumno_id END) as ausentes
-            FROM inscripciones i
-            LEFT JOIN asistencias a ON i.alumno_id = a.alumno_id 
-                AND i.clase_id = a.clase_id
-                AND DATE(a.fecha) = CURRENT_DATE
-            WHERE i.clase_id = :clase_id
+                (SELECT COUNT(DISTINCT i.alumno_id) 
+                 FROM inscripciones i 
+                 WHERE i.clase_id = :clase_id) as total_alumnos,
+                (SELECT r.presentes 
+                 FROM resumen_asistencia_diaria r 
+                 WHERE r.clase_id = :clase_id 
+                 AND r.fecha = CURRENT_DATE) as presentes,
+                (SELECT r.ausentes 
+                 FROM resumen_asistencia_diaria r 
+                 WHERE r.clase_id = :clase_id 
+                 AND r.fecha = CURRENT_DATE) as ausentes
         ''', {'clase_id': clase_id}, one=True)
 
         return jsonify({
@@ -552,6 +2912,68 @@ def get_resumen_dia(profesor_id, clase_id):
             'message': str(e)
         }), 500
 
+def _evento_sse(tipo, datos):
+    return f"event: {tipo}\ndata: {json.dumps(datos)}\n\n"
+
+@app.route('/profesor/<int:profesor_id>/clase/<int:clase_id>/en-vivo', methods=['GET'])
+def get_asistencia_en_vivo(profesor_id, clase_id):
+    """Flujo Server-Sent Events con cada asistencia confirmada de la clase.
+
+    Envía primero un evento `resumen` con los totales del día, la única
+    lectura de la base, y después un evento `asistencia` por escritura con
+    los totales ajustados por las diferencias publicadas. El flujo se cierra
+    al cambiar el día o si el suscriptor pierde eventos; el cliente se
+    reconecta y recibe un `resumen` nuevo.
+    """
+    if not indice_acceso.profesor_dicta(profesor_id, clase_id):
+        return jsonify({
+            'error': 'No autorizado',
+            'message': 'Esta clase no pertenece al profesor'
+        }), 403
+
+    latido = app.config['SSE_LATIDO_SEGUNDOS']
+    duracion = app.config['SSE_DURACION_MAX']
+    if app.config['TESTING'] and 'duracion' in request.args:
+        # Para el benchmark: solo la foto inicial, sin tocar la configuración
+        duracion = float(request.args['duracion'])
+
+    # Suscribir antes de leer los totales para no perder escrituras intermedias
+    suscripcion = canales_asistencia.suscribir(clase_id)
+    if suscripcion is None:
+        return respuesta_sobrecarga('Demasiados flujos en vivo abiertos, intenta nuevamente', max(math.ceil(latido), 1))
+
+    def eventos():
+        try:
+            yield f"retry: {int(latido * 1000)}\n"
+            totales = totales_del_dia(clase_id)
+            # No retener una conexión del pool durante toda la suscripción
+            db.session.remove()
+            yield _evento_sse('resumen', totales)
+            fin = time.monotonic() + duracion
+            while time.monotonic() < fin and not suscripcion.desbordada and \
+                    date.today().strftime('%Y-%m-%d') == totales['fecha']:
+                try:
+                    evento = suscripcion.cola.get(timeout=max(min(latido, fin - time.monotonic()), 0.01))
+                except queue.Empty:
+                    yield ': latido\n\n'
+                    continue
+                if evento['fecha'] != totales['fecha']:
+                    continue  # escaneos sin conexión de otros días
+                totales = {**totales,
+                           'presentes': totales['presentes'] + evento['presentes'],
+                           'ausentes': totales['ausentes'] + evento['ausentes']}
+                yield _evento_sse('asistencia', {**totales, 'asistencias': evento['asistencias']})
+        finally:
+            canales_asistencia.cancelar(clase_id, suscripcion)
+
+    respuesta = Response(stream_with_context(eventos()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Si el cliente se va antes de empezar el flujo, el generador no corre su finally
+    respuesta.call_on_close(lambda: canales_asistencia.cancelar(clase_id, suscripcion))
+    return respuesta
+
 @app.route('/profesor/<int:profesor_id>/clase/<int:clase_id>/asistencia', methods=['POST'])
 def registrar_asistencia_profesor(profesor_id, clase_id):
     try:
@@ -562,32 +2984,35 @@ def registrar_asistencia_profesor(profesor_id, clase_id):
                 'message': 'Se requiere alumno_id y estado'
             }), 400
 
-        # Verificar que la clase pertenece al profesor
-        verificacion = execute_query('''
-            SELECT 1 FROM clases 
-            WHERE id = :clase_id AND profesor_id = :profesor_id
-        ''', {
-            'clase_id': clase_id,
-            'profesor_id': profesor_id
-        }, one=True)
+        alumno_id, estado = data['alumno_id'], data['estado']
+        if not isinstance(alumno_id, int) or isinstance(alumno_id, bool):
+            return jsonify({
+                'error': 'Datos inválidos',
+                'message': 'alumno_id inválido'
+            }), 400
+        if estado not in ESTADOS_ASISTENCIA:
+            return jsonify({
+                'error': 'Datos inválidos',
+                'message': f"Estado inválido, se espera uno de: {', '.join(ESTADOS_ASISTENCIA)}"
+            }), 400
 
-        if not verificacion:
+        # Verificar que la clase pertenece al profesor
+        if not indice_acceso.profesor_dicta(profesor_id, clase_id):
             return jsonify({
                 'error': 'No autorizado',
                 'message': 'Esta clase no pertenece al profesor'
             }), 403
 
+        if not indice_acceso.alumno_inscrito(alumno_id, clase_id):
+            return jsonify({
+                'error': 'No autorizado',
+                'message': 'El alumno no está inscrito en la clase'
+            }), 403
+
         # Registrar asistencia
-        db.session.execute(text('''
-            INSERT INTO asistencias (alumno_id, clase_id, fecha, estado)
-            VALUES (:alumno_id, :clase_id, CURRENT_DATE, :estado)
-            ON DUPLICATE KEY UPDATE estado = :estado
-        '''), {
-            'alumno_id': data['alumno_id'],
-            'clase_id': clase_id,
-            'estado': data['estado']
-        })
+        diferencias = escribir_asistencias(clase_id, [(alumno_id, estado)])
         db.session.commit()
+        despues_de_escribir_asistencias(clase_id, [(alumno_id, estado)], diferencias)
 
         return jsonify({
             'message': 'Asistencia registrada correctamente'
@@ -601,52 +3026,382 @@ def registrar_asistencia_profesor(profesor_id, clase_id):
             'message': str(e)
         }), 500
 
+@app.route('/profesor/<int:profesor_id>/clase/<int:clase_id>/asistencia/lote', methods=['POST'])
+def registrar_asistencia_lote(profesor_id, clase_id):
+    try:
+        data = request.json
+        if not data or not isinstance(data.get('asistencias'), list) or not data['asistencias']:
+            return jsonify({
+                'error': 'Datos incompletos',
+                'message': 'Se requiere una lista no vacía de asistencias (alumno_id, estado)'
+            }), 400
+
+        # Verificar que la clase pertenece al profesor
+        if not indice_acceso.profesor_dicta(profesor_id, clase_id):
+            return jsonify({
+                'error': 'No autorizado',
+                'message': 'Esta clase no pertenece al profesor'
+            }), 403
+
+        inscritos = indice_acceso.alumnos_de(clase_id)
+
+        resultados = []
+        filas = []
+        vistos = set()
+        for item in data['asistencias']:
+            alumno_id = item.get('alumno_id') if isinstance(item, dict) else None
+            estado = item.get('estado') if isinstance(item, dict) else None
+            motivo = None
+            if not isinstance(alumno_id, int) or isinstance(alumno_id, bool):
+                motivo = 'alumno_id inválido'
+            elif estado not in ESTADOS_ASISTENCIA:
+                motivo = f"Estado inválido, se espera uno de: {', '.join(ESTADOS_ASISTENCIA)}"
+            elif alumno_id not in inscritos:
+                motivo = 'El alumno no está inscrito en la clase'
+            elif alumno_id in vistos:
+                motivo = 'Alumno repetido en el lote'
+
+            if motivo:
+                resultados.append({
+                    'alumno_id': alumno_id,
+                    'estado': estado,
+                    'registrado': False,
+                    'motivo': motivo
+                })
+                continue
+
+            vistos.add(alumno_id)
+            filas.append((alumno_id, estado))
+            resultados.append({
+                'alumno_id': alumno_id,
+                'estado': estado,
+                'registrado': True
+            })
+
+        # Registrar todas las asistencias válidas en una sola transacción
+        if filas:
+            diferencias = escribir_asistencias(clase_id, filas)
+        db.session.commit()
+        if filas:
+            despues_de_escribir_asistencias(clase_id, filas, diferencias)
+
+        return jsonify({
+            'message': 'Asistencia del lote procesada',
+            'registrados': len(filas),
+            'rechazados': len(resultados) - len(filas),
+            'resultados': resultados
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error al registrar asistencia en lote: {str(e)}")  # Para debugging
+        return jsonify({
+            'error': 'Error del servidor',
+            'message': str(e)
+        }), 500
+
+COLUMNAS_EXPORTACION = ('fecha', 'clase_id', 'clase', 'alumno_id', 'alumno', 'estado')
+
+def _respuesta_exportacion(query, args, formato, nombre_archivo, clases=None):
+    """`clases` (consulta de (id, nombre) en el orden de la exportación) activa
+    la mezcla con los períodos archivados."""
+    def filas():
+        vivas = stream_query(query, args)
+        if clases and indice_periodos.corte():
+            vivas = con_archivo_exportacion(vivas, execute_query(*clases))
+        for r in vivas:
+            yield (r[0].strftime('%Y-%m-%d'), r[1], r[2], r[3], r[4], r[5])
+
+    if formato == 'ndjson':
+        def generar():
+            for fila in filas():
+                yield json.dumps(dict(zip(COLUMNAS_EXPORTACION, fila)), ensure_ascii=False) + '\n'
+        mimetype = 'application/x-ndjson'
+    else:
+        def generar():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(COLUMNAS_EXPORTACION)
+            for n, fila in enumerate(filas(), 1):
+                writer.writerow(fila)
+                if n % 500 == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        mimetype = 'text/csv'
+
+    return Response(stream_with_context(generar()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={nombre_archivo}.{formato}'
+    })
+
+def con_archivo_exportacion(vivas, clases):
+    """Antepone en cada clase sus filas archivadas a las vivas (siempre más
+    antiguas), ordenadas como la exportación: por fecha y nombre del alumno."""
+    siguiente = next(vivas, None)
+    for clase_id, clase_nombre in clases:
+        archivadas = [(fecha, a, estado) for a, _, fecha, estado in asistencias_archivadas(clase_id=clase_id)]
+        nombres = _nombres('usuarios', sorted({a for _, a, _ in archivadas}))
+        archivadas.sort(key=lambda r: (r[0], nombres.get(r[1]) or ''))
+        for fecha, alumno_id, estado in archivadas:
+            yield fecha, clase_id, clase_nombre, alumno_id, nombres.get(alumno_id), estado
+        while siguiente is not None and siguiente[1] == clase_id:
+            yield siguiente
+            siguiente = next(vivas, None)
+
+def _formato_exportacion():
+    formato = request.args.get('formato', 'csv').lower()
+    return formato if formato in ('csv', 'ndjson') else None
+
+@app.route('/profesor/<int:profesor_id>/clase/<int:clase_id>/exportar', methods=['GET'])
+@solo_lectura(lambda profesor_id, clase_id: [f'clase:{clase_id}'])
+def exportar_asistencia_clase(profesor_id, clase_id):
+    try:
+        formato = _formato_exportacion()
+        if not formato:
+            return jsonify({
+                'error': 'Formato inválido',
+                'message': 'Los formatos disponibles son csv y ndjson'
+            }), 400
+
+        # Verificar que la clase pertenece al profesor
+        if not indice_acceso.profesor_dicta(profesor_id, clase_id):
+            return jsonify({
+                'error': 'No autorizado',
+                'message': 'Esta clase no pertenece al profesor'
+            }), 403
+
+        return _respuesta_exportacion('''
+            SELECT a.fecha, c.id, c.nombre, u.id, u.nombre, a.estado
+            FROM asistencias a
+            JOIN clases c ON c.id = a.clase_id
+            JOIN usuarios u ON u.id = a.alumno_id
+            WHERE a.clase_id = :clase_id
+            ORDER BY a.fecha, u.nombre
+        ''', {'clase_id': clase_id}, formato, f'asistencia_clase_{clase_id}',
+            clases=('SELECT id, nombre FROM clases WHERE id = :clase_id', {'clase_id': clase_id}))
+
+    except Exception as e:
+        print(f"Error al exportar asistencia: {str(e)}")  # Para debugging
+        return jsonify({
+            'error': 'Error del servidor',
+            'message': str(e)
+        }), 500
+
+@app.route('/profesor/<int:profesor_id>/exportar', methods=['GET'])
+@solo_lectura(lambda profesor_id: [f'profesor:{profesor_id}'])
+def exportar_asistencia_profesor(profesor_id):
+    try:
+        formato = _formato_exportacion()
+        if not formato:
+            return jsonify({
+                'error': 'Formato inválido',
+                'message': 'Los formatos disponibles son csv y ndjson'
+            }), 400
+
+        return _respuesta_exportacion('''
+            SELECT a.fecha, c.id, c.nombre, u.id, u.nombre, a.estado
+            FROM clases c
+            JOIN asistencias a ON a.clase_id = c.id
+            JOIN usuarios u ON u.id = a.alumno_id
+            WHERE c.profesor_id = :profesor_id
+            ORDER BY c.nombre, c.id, a.fecha, u.nombre
+        ''', {'profesor_id': profesor_id}, formato, f'asistencia_profesor_{profesor_id}',
+            clases=('SELECT id, nombre FROM clases WHERE profesor_id = :profesor_id ORDER BY nombre, id',
+                    {'profesor_id': profesor_id}))
+
+    except Exception as e:
+        print(f"Error al exportar asistencia: {str(e)}")  # Para debugging
+        return jsonify({
+            'error': 'Error del servidor',
+            'message': str(e)
+        }), 500
+
+def _nombres(tabla, ids):
+    if not ids:
+        return {}
+    params = {f'id_{n}': i for n, i in enumerate(ids)}
+    filas = execute_query(f"SELECT id, nombre FROM {tabla} WHERE id IN ({', '.join(':' + k for k in params)})", params)
+    return dict(filas)
+
+def calcular_riesgo(desde, umbral, racha_minima):
+    """Alumnos bajo el umbral de asistencia o con una racha vigente de ausencias.
+
+    Extrae en una sola pasada (alumno, clase, día, presente) desde `desde` y
+    calcula con numpy, sin recorrer fila a fila, el porcentaje por alumno y
+    clase, la racha actual y máxima de ausencias y el porcentaje global del
+    alumno. Solo cuentan las inscripciones vigentes. Si la ventana alcanza
+    períodos archivados, sus días se agregan desde el archivo.
+    """
+    if np is None:
+        raise RuntimeError('El reporte de riesgo requiere numpy (pip install numpy)')
+
+    # Unir desde clases permite leer asistencias por el índice (clase_id,
+    # fecha), sin recorrido completo; `migraciones.py explicar` lo verifica
+    filas = stream_query('''
+        SELECT a.alumno_id, a.clase_id, TO_DAYS(a.fecha), a.estado = 'Presente'
+        FROM clases c
+        JOIN asistencias a ON a.clase_id = c.id AND a.fecha >= :desde
+    ''', {'desde': desde})
+    corte = indice_periodos.corte()
+    if corte and desde <= corte:
+        # TO_DAYS cuenta desde el año 0; toordinal, desde el 1 (366 días menos)
+        archivadas = ((a, c, fecha.toordinal() + 365, int(estado == 'Presente'))
+                      for a, c, fecha, estado in asistencias_archivadas(desde=desde))
+        filas = itertools.chain(archivadas, filas)
+    datos = np.fromiter((v for fila in filas for v in fila), dtype=np.int64).reshape(-1, 4)
+    alumno, clase, dia, presente = datos.T
+
+    # Clave (alumno, clase) en un entero: agrupa por alumno y luego por clase
+    clave = (alumno << 32) | clase
+    inscritas = np.fromiter(
+        ((a << 32) | c for c, alumnos in indice_acceso.inscripciones().items() for a in alumnos),
+        dtype=np.int64)
+    vigentes = np.isin(clave, inscritas)
+    clave, dia, presente = clave[vigentes], dia[vigentes], presente[vigentes]
+    if not len(clave):
+        return []
+
+    orden = np.lexsort((dia, clave))
+    clave, presente = clave[orden], presente[orden]
+    nuevo_grupo = np.r_[True, clave[1:] != clave[:-1]]
+    inicios = np.flatnonzero(nuevo_grupo)
+    fines = np.r_[inicios[1:], len(clave)]
+    totales = fines - inicios
+    presentes = np.add.reduceat(presente, inicios)
+
+    # Racha de ausencias que termina en cada registro: ausencias acumuladas
+    # menos las acumuladas hasta el último reinicio (presente o clase nueva)
+    ausente = 1 - presente
+    acumulado = np.cumsum(ausente)
+    reinicio = (ausente == 0) | nuevo_grupo
+    racha = acumulado - np.maximum.accumulate(np.where(reinicio, acumulado - ausente, 0))
+    racha_maxima = np.maximum.reduceat(racha, inicios)
+    racha_actual = racha[fines - 1]
+    porcentaje = presentes * 100.0 / totales
+
+    claves = clave[inicios]
+    alumnos = claves >> 32
+    clases = claves & 0xFFFFFFFF
+    inicios_alumno = np.flatnonzero(np.r_[True, alumnos[1:] != alumnos[:-1]])
+    totales_alumno = np.add.reduceat(totales, inicios_alumno)
+    presentes_alumno = np.add.reduceat(presentes, inicios_alumno)
+    porcentaje_alumno = presentes_alumno * 100.0 / totales_alumno
+
+    bajo_umbral = porcentaje < umbral
+    con_racha = racha_actual >= racha_minima
+    en_riesgo = np.logical_or.reduceat(bajo_umbral | con_racha, inicios_alumno) | (porcentaje_alumno < umbral)
+
+    seleccion = np.flatnonzero(en_riesgo)
+    if not len(seleccion):
+        return []
+    fines_alumno = np.r_[inicios_alumno[1:], len(claves)]
+    ids_alumnos = [int(alumnos[inicios_alumno[i]]) for i in seleccion]
+    grupos = [range(inicios_alumno[i], fines_alumno[i]) for i in seleccion]
+    nombres_alumnos = _nombres('usuarios', ids_alumnos)
+    nombres_clases = _nombres('clases', sorted({int(clases[k]) for g in grupos for k in g}))
+
+    reporte = []
+    for i, alumno_id, grupo in zip(seleccion, ids_alumnos, grupos):
+        detalle = []
+        for k in grupo:
+            motivos = [m for m, activo in (('porcentaje', bajo_umbral[k]), ('racha', con_racha[k])) if activo]
+            detalle.append({
+                'clase_id': int(clases[k]),
+                'clase_nombre': nombres_clases.get(int(clases[k])),
+                'total': int(totales[k]),
+                'presentes': int(presentes[k]),
+                'ausentes': int(totales[k] - presentes[k]),
+                'porcentaje_asistencia': round(float(porcentaje[k]), 2),
+                'racha_actual': int(racha_actual[k]),
+                'racha_maxima': int(racha_maxima[k]),
+                'motivos': motivos
+            })
+        reporte.append({
+            'alumno_id': alumno_id,
+            'nombre': nombres_alumnos.get(alumno_id),
+            'total': int(totales_alumno[i]),
+            'presentes': int(presentes_alumno[i]),
+            'porcentaje_asistencia': round(float(porcentaje_alumno[i]), 2),
+            'clases': detalle
+        })
+    reporte.sort(key=lambda r: (r['porcentaje_asistencia'], r['alumno_id']))
+    return reporte
+
+@app.route('/reportes/riesgo', methods=['GET'])
+@solo_lectura()
+@cacheado(lambda: ['asistencias'], ttl='RIESGO_CACHE_TTL', parametros=('umbral', 'racha', 'desde'))
+def get_reporte_riesgo():
+    try:
+        try:
+            umbral = float(request.args.get('umbral', app.config['RIESGO_UMBRAL']))
+            racha = int(request.args.get('racha', app.config['RIESGO_RACHA']))
+            valor = request.args.get('desde')
+            desde = date.fromisoformat(valor) if valor else \
+                date.today() - timedelta(days=app.config['RIESGO_VENTANA_DIAS'])
+        except ValueError:
+            return jsonify({
+                'error': 'Parámetros inválidos',
+                'message': 'umbral debe ser un número, racha un entero y desde una fecha YYYY-MM-DD'
+            }), 400
+        if not 0 <= umbral <= 100 or racha < 1:
+            return jsonify({
+                'error': 'Parámetros inválidos',
+                'message': 'umbral debe estar entre 0 y 100 y racha ser mayor que cero'
+            }), 400
+
+        alumnos = calcular_riesgo(desde, umbral, racha)
+        return jsonify({
+            'desde': desde.strftime('%Y-%m-%d'),
+            'umbral': umbral,
+            'racha': racha,
+            'generado': datetime.now().isoformat(timespec='seconds'),
+            'total': len(alumnos),
+            'alumnos': alumnos
+        })
+
+    except Exception as e:
+        print(f"Error en reporte de riesgo: {str(e)}")  # Para debugging
+        return jsonify({
+            'error': 'Error del servidor',
+            'message': str(e)
+        }), 500
+
+@app.cli.command('reporte-riesgo')
+@click.option('--umbral', type=float, default=None, help='porcentaje de asistencia mínimo')
+@click.option('--racha', type=int, default=None, help='ausencias consecutivas que alertan')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), default=None)
+@click.option('--formato', type=click.Choice(['csv', 'json']), default='csv')
+def reporte_riesgo(umbral, racha, desde, formato):
+    """Imprime el reporte de alumnos en riesgo (CSV por alumno y clase, o JSON)."""
+    umbral = app.config['RIESGO_UMBRAL'] if umbral is None else umbral
+    racha = app.config['RIESGO_RACHA'] if racha is None else racha
+    desde = desde.date() if desde else date.today() - timedelta(days=app.config['RIESGO_VENTANA_DIAS'])
+    alumnos = calcular_riesgo(desde, umbral, racha)
+    if formato == 'json':
+        click.echo(json.dumps(alumnos, ensure_ascii=False, indent=2))
+        return
+    escritor = csv.writer(click.get_text_stream('stdout'))
+    escritor.writerow(('alumno_id', 'alumno', 'porcentaje_alumno', 'clase_id', 'clase', 'total',
+                       'presentes', 'porcentaje_clase', 'racha_actual', 'racha_maxima', 'motivos'))
+    for a in alumnos:
+        for c in a['clases']:
+            escritor.writerow((a['alumno_id'], a['nombre'], a['porcentaje_asistencia'], c['clase_id'],
+                               c['clase_nombre'], c['total'], c['presentes'], c['porcentaje_asistencia'],
+                               c['racha_actual'], c['racha_maxima'], '|'.join(c['motivos'])))
 
 @app.route('/clases/<int:clase_id>/horarios', methods=['GET'])
 def get_horarios_clase(clase_id):
     try:
         # Primero verificamos que la clase exista
-        clase = execute_query('''
-            SELECT nombre FROM clases WHERE id = :clase_id
-        ''', {'clase_id': clase_id}, one=True)
-
-        if not clase:
+        if not indice_horarios.existe(clase_id):
             return jsonify({
                 'error': 'Clase no encontrada',
                 'message': 'La clase especificada no existe'
             }), 404
 
-        # Obtenemos los horarios
-        horarios = execute_query('''
-            SELECT 
-                h.dia_semana,
-                TIME_FORMAT(h.hora_inicio, '%H:%i') as hora_inicio,
-                TIME_FORMAT(h.hora_fin, '%H:%i') as hora_fin
-            FROM horarios h
-            WHERE h.clase_id = :clase_id
-            ORDER BY 
-                CASE h.dia_semana
-                    WHEN 'Lunes' THEN 1
-                    WHEN 'Martes' THEN 2
-                    WHEN 'Miércoles' THEN 3
-                    WHEN 'Jueves' THEN 4
-                    WHEN 'Viernes' THEN 5
-                    WHEN 'Sábado' THEN 6
-                    WHEN 'Domingo' THEN 7
-                END,
-                h.hora_inicio
-        ''', {'clase_id': clase_id})
-
-        # Procesamos los resultados
-        result = []
-        for horario in horarios:
-            result.append({
-                'dia_semana': horario[0],
-                'hora_inicio': horario[1],
-                'hora_fin': horario[2]
-            })
-
-        return jsonify(result)
+        # Los bloques ya están ordenados por día y hora de inicio
+        return jsonify(formato_bloques(indice_horarios.bloques_de(clase_id)))
 
     except Exception as e:
         print(f"Error al obtener horarios: {str(e)}")  # Para debugging
@@ -657,8 +3412,324 @@ def get_horarios_clase(clase_id):
             'message': str(e)
         }), 500
 
+def _respuesta_sesiones(clase_ids):
+    ahora = datetime.now().replace(second=0, microsecond=0)
+    actual, siguiente = indice_horarios.sesiones(clase_ids, ahora)
+
+    def sesion(bloque):
+        if bloque is None:
+            return None
+        clase_id, inicio, fin, faltan = bloque
+        comienza = ahora + timedelta(minutes=faltan) if faltan else \
+            ahora - timedelta(minutes=(indice_horarios.minuto_semana(ahora) - inicio) % MINUTOS_SEMANA)
+        return {
+            'clase_id': clase_id,
+            'clase_nombre': indice_horarios.nombre_de(clase_id),
+            'dia_semana': DIAS_SEMANA[inicio // 1440],
+            'hora_inicio': _hora(inicio),
+            'hora_fin': _hora(fin),
+            'comienza': comienza.isoformat(),
+            'termina': (comienza + timedelta(minutes=fin - inicio)).isoformat()
+        }
+
+    return jsonify({
+        'ahora': ahora.isoformat(),
+        'actual': sesion(actual),
+        'siguiente': sesion(siguiente)
+    })
+
+@app.route('/profesor/<int:profesor_id>/sesion', methods=['GET'])
+def get_sesion_profesor(profesor_id):
+    try:
+        return _respuesta_sesiones(indice_acceso.clases_de_profesor(profesor_id))
+    except Exception as e:
+        print(f"Error al obtener sesión: {str(e)}")  # Para debugging
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/alumno/<int:alumno_id>/sesion', methods=['GET'])
+def get_sesion_alumno(alumno_id):
+    try:
+        return _respuesta_sesiones(indice_acceso.clases_de_alumno(alumno_id))
+    except Exception as e:
+        print(f"Error al obtener sesión: {str(e)}")  # Para debugging
+        return jsonify({'error': str(e)}), 500
+
+# Sincronización incremental: los triggers de la migración 0008 anotan en
+# `cambios` (seq creciente) cada asistencia, inscripción, horario o clase
+# modificados; el cliente guarda el último seq recibido como cursor
+
+def _cursor_vigente(cursor):
+    """El log se poda: un cursor anterior a la primera fila conservada ya no
+    garantiza ver todos los cambios y el cliente debe recargar todo."""
+    if cursor <= 0:
+        return False
+    minimo = execute_query('SELECT MIN(seq) FROM cambios', one=True)[0]
+    return minimo is None or cursor >= minimo - 1
+
+def horarios_de_clases(clase_ids):
+    """Bloques de horario de varias clases leídos de la base (no del índice,
+    que puede ir atrasado respecto del log), en el formato de /clases/<id>/horarios."""
+    if not clase_ids:
+        return []
+    marcadores, params = lista_sql('clase_id', sorted(clase_ids))
+    bloques = {clase_id: [] for clase_id in sorted(clase_ids)}
+    for clase_id, dia_semana, hora_inicio, hora_fin in execute_query(f'''
+        SELECT clase_id, dia_semana, hora_inicio, hora_fin
+        FROM horarios
+        WHERE clase_id IN {marcadores}
+    ''', params):
+        dia = _NUMERO_DIA.get(dia_semana.strip().lower())
+        if dia is not None:
+            bloques[clase_id].append((dia * 1440 + int(hora_inicio.total_seconds()) // 60,
+                                      dia * 1440 + int(hora_fin.total_seconds()) // 60))
+    return [{'clase_id': clase_id, 'bloques': formato_bloques(sorted(lista))}
+            for clase_id, lista in bloques.items()]
+
+def aplicar_escaneos_offline(alumno_id, escaneos):
+    """Registra en una sola transacción los escaneos QR hechos sin conexión.
+
+    Cada escaneo trae el token leído y `escaneado` (segundos epoch del
+    dispositivo): el token debe ser válido en ese instante y el instante no
+    puede tener más de SYNC_OFFLINE_MAX_HORAS. Como `escaneado` lo informa el
+    cliente, además el día de la clase debe seguir abierto: hasta
+    SYNC_CIERRE_HORAS después del fin de la clase ese día y sin archivar. Así
+    un token viejo no se puede reenviar días después. La fecha registrada es
+    la de emisión del QR. Reenviar la misma subida no cambia nada (upsert por
+    alumno, clase y fecha).
+    """
+    ahora = time.time()
+    max_edad = app.config['SYNC_OFFLINE_MAX_HORAS'] * 3600
+    cierre = timedelta(hours=app.config['SYNC_CIERRE_HORAS'])
+    corte = indice_periodos.corte()
+    resultados, por_dia = [], {}
+    for item in escaneos:
+        item = item if isinstance(item, dict) else {}
+        escaneado = item.get('escaneado')
+        motivo = clase_id = fecha = None
+        if not isinstance(escaneado, (int, float)) or isinstance(escaneado, bool):
+            motivo = 'escaneado debe ser un instante en segundos'
+        elif escaneado > ahora + 30 or ahora - escaneado > max_edad:
+            motivo = 'Escaneo fuera del plazo de sincronización'
+        else:
+            try:
+                # `escaneado` debe caer entre la emisión del token y su vencimiento
+                clase_id, _, emitido = verificar_token_qr(item.get('token'), ahora=escaneado)
+                fecha = date.fromtimestamp(emitido)
+            except ValueError as e:
+                motivo = str(e)
+        if motivo is None:
+            if not indice_acceso.alumno_inscrito(alumno_id, clase_id):
+                motivo = 'El alumno no está inscrito en la clase'
+            elif corte and fecha <= corte:
+                motivo = 'El período ya está archivado'
+            elif ahora > (indice_horarios.fin_del_dia(clase_id, fecha) + cierre).timestamp():
+                motivo = 'La clase de ese día ya está cerrada'
+            elif app.config['QR_VALIDAR_HORARIO'] and not indice_horarios.en_horario(
+                    clase_id, datetime.fromtimestamp(escaneado), app.config['QR_MARGEN_HORARIO_MIN']):
+                motivo = 'Fuera del horario de la clase'
+        resultado = {'id': item.get('id'), 'registrado': motivo is None}
+        if motivo:
+            resultado['motivo'] = motivo
+        else:
+            resultado.update({'clase_id': clase_id, 'fecha': fecha.strftime('%Y-%m-%d')})
+            por_dia[(clase_id, fecha)] = True
+        resultados.append(resultado)
+
+    if por_dia:
+        for clase_id, fecha in sorted(por_dia):
+            por_dia[(clase_id, fecha)] = escribir_asistencias(clase_id, [(alumno_id, 'Presente')], fecha)
+        db.session.commit()
+        for (clase_id, fecha), diferencias in por_dia.items():
+            despues_de_escribir_asistencias(clase_id, [(alumno_id, 'Presente')], diferencias, fecha)
+    return resultados
+
+def cambios_de_alumno(alumno_id, cursor):
+    """Lo que cambió para el alumno desde `cursor`, o todo si el cursor no
+    sirve. Devuelve el cuerpo de la respuesta de sincronización."""
+    # Tope: último cambio con más de SYNC_MARGEN_SEGUNDOS. Un seq más nuevo
+    # puede pertenecer a una transacción sin confirmar que deja huecos
+    # menores todavía invisibles; esos se entregan y se repiten después
+    fila = execute_query('''
+        SELECT seq
+        FROM cambios
+        WHERE creado < NOW(3) - INTERVAL :margen SECOND
+        ORDER BY creado DESC, seq DESC
+        LIMIT 1
+    ''', {'margen': app.config['SYNC_MARGEN_SEGUNDOS']}, one=True)
+    tope = fila[0] if fila else 0
+
+    if not _cursor_vigente(cursor):
+        desde = date.today() - timedelta(days=app.config['SYNC_HISTORIAL_DIAS'])
+        clases = clases_de_alumno(alumno_id)
+        asistencias = execute_query('''
+            SELECT clase_id, fecha, estado
+            FROM asistencias
+            WHERE alumno_id = :alumno_id
+            AND fecha >= :desde
+            ORDER BY fecha DESC
+        ''', {'alumno_id': alumno_id, 'desde': desde})
+        corte = indice_periodos.corte()
+        if corte and desde <= corte:
+            asistencias = list(asistencias) + sorted(
+                ((c, fecha, estado) for _, c, fecha, estado in asistencias_archivadas(alumno_id=alumno_id, desde=desde)),
+                key=lambda a: a[1], reverse=True)
+        return {
+            'cursor': tope,
+            'completo': True,
+            'pendientes': False,
+            'clases': clases,
+            'clases_eliminadas': [],
+            'horarios': horarios_de_clases({c['id'] for c in clases}),
+            'asistencias': [{
+                'clase_id': a[0],
+                'fecha': a[1].strftime('%Y-%m-%d'),
+                'estado': a[2]
+            } for a in asistencias],
+            'estadisticas': estadisticas_de_alumno(alumno_id)
+        }
+
+    # Cambios propios del alumno (asistencias, inscripciones) y de sus clases
+    # (horarios, datos de la clase): ambos por el índice (alumno_id, seq)
+    maximo = app.config['SYNC_CAMBIOS_MAX']
+    cambios = execute_query('''
+        SELECT seq, entidad, clase_id, fecha
+        FROM cambios
+        WHERE alumno_id = :alumno_id
+        AND seq > :cursor AND seq <= :tope
+        UNION ALL
+        SELECT seq, entidad, clase_id, fecha
+        FROM cambios
+        WHERE alumno_id IS NULL
+        AND seq > :cursor AND seq <= :tope
+        AND clase_id IN (SELECT clase_id FROM inscripciones WHERE alumno_id = :alumno_id)
+        ORDER BY seq
+        LIMIT :limite
+    ''', {'alumno_id': alumno_id, 'cursor': cursor, 'tope': tope, 'limite': maximo + 1})
+    pendientes = len(cambios) > maximo
+    cambios = cambios[:maximo]
+    nuevo_cursor = cambios[-1][0] if pendientes else max(cursor, tope)
+
+    tocadas = {c[2] for c in cambios}
+    con_horario = {c[2] for c in cambios if c[1] in ('horario', 'inscripcion')}
+    con_asistencia = {c[2] for c in cambios if c[1] in ('asistencia', 'inscripcion')}
+    dias = {(c[2], c[3]) for c in cambios if c[1] == 'asistencia'}
+
+    asistencias = []
+    if dias:
+        marcadores, params = lista_sql('clase_id', sorted({c for c, _ in dias}))
+        asistencias = [a for a in execute_query(f'''
+            SELECT clase_id, fecha, estado
+            FROM asistencias
+            WHERE alumno_id = :alumno_id
+            AND clase_id IN {marcadores}
+            AND fecha BETWEEN :fecha_min AND :fecha_max
+        ''', {'alumno_id': alumno_id, 'fecha_min': min(f for _, f in dias),
+              'fecha_max': max(f for _, f in dias), **params}) if (a[0], a[1]) in dias]
+
+    clases = clases_de_alumno(alumno_id, tocadas)
+    vigentes = {c['id'] for c in clases}
+    return {
+        'cursor': nuevo_cursor,
+        'completo': False,
+        'pendientes': pendientes,
+        'clases': clases,
+        'clases_eliminadas': sorted(tocadas - vigentes),
+        'horarios': horarios_de_clases(con_horario & vigentes),
+        'asistencias': [{
+            'clase_id': a[0],
+            'fecha': a[1].strftime('%Y-%m-%d'),
+            'estado': a[2]
+        } for a in sorted(asistencias, key=lambda a: a[1], reverse=True)],
+        'estadisticas': estadisticas_de_alumno(alumno_id, con_asistencia & vigentes)
+    }
+
+@app.route('/alumno/<int:alumno_id>/sync', methods=['GET', 'POST'])
+def sync_alumno(alumno_id):
+    try:
+        data = request.get_json(silent=True) if request.method == 'POST' else None
+        if not isinstance(data, dict):
+            data = {}
+        cursor = data.get('cursor', request.args.get('cursor', 0))
+        try:
+            cursor = int(cursor)
+            if cursor < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return jsonify({
+                'error': 'Parámetros inválidos',
+                'message': 'cursor debe ser un entero mayor o igual a cero'
+            }), 400
+
+        escaneos = data.get('escaneos') or []
+        if not isinstance(escaneos, list) or len(escaneos) > app.config['SYNC_ESCANEOS_MAX']:
+            return jsonify({
+                'error': 'Datos inválidos',
+                'message': f"escaneos debe ser una lista de hasta {app.config['SYNC_ESCANEOS_MAX']} elementos"
+            }), 400
+
+        resultados = None
+        if escaneos:
+            rechazo = limitar(('qr_global', ''), ('qr_alumno', alumno_id))
+            if rechazo:
+                return rechazo
+            if not compuerta_escritura.entrar():
+                return respuesta_sobrecarga()
+            try:
+                resultados = aplicar_escaneos_offline(alumno_id, escaneos)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                compuerta_escritura.salir()
+
+        respuesta = cambios_de_alumno(alumno_id, cursor)
+        if resultados is not None:
+            respuesta['escaneos'] = resultados
+        return jsonify(respuesta)
+
+    except Exception as e:
+        print(f"Error en sincronización: {str(e)}")  # Para debugging
+        return jsonify({
+            'error': 'Error del servidor',
+            'message': str(e)
+        }), 500
+
+@app.cli.command('podar-cambios')
+def podar_cambios():
+    """Borra del log de sincronización los cambios de más de SYNC_RETENCION_DIAS."""
+    borrados = 0
+    while True:
+        resultado = db.session.execute(text('''
+            DELETE FROM cambios
+            WHERE creado < NOW() - INTERVAL :dias DAY
+            ORDER BY seq
+            LIMIT 5000
+        '''), {'dias': app.config['SYNC_RETENCION_DIAS']})
+        db.session.commit()
+        borrados += resultado.rowcount
+        if resultado.rowcount < 5000:
+            break
+    print(f"Cambios podados: {borrados}")
+
+@app.route('/metrics', methods=['GET'])
+def get_metricas():
+    directorio = app.config['METRICAS_DIRECTORIO']
+    if not directorio:
+        return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+    # Con varios workers: las de este proceso al día y las últimas de los demás
+    metricas.volcar(directorio)
+    return Response(exportar_procesos(directorio), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/cola-asistencia', methods=['GET'])
+def debug_cola_asistencia():
+    return jsonify({
+        'activa': app.config['QR_ESCRITURA_DIFERIDA'],
+        **cola_asistencias.estadisticas()
+    })
+
 # También vamos a verificar los horarios en la base de datos
 @app.route('/debug/horarios/<int:clase_id>', methods=['GET'])
+@solo_lectura()
 def debug_horarios(clase_id):
     try:
         horarios_raw = execute_query('''
@@ -692,5 +3763,106 @@ def debug_horarios(clase_id):
             'message': str(e)
         }), 500
 
+# Claves de firma sin las que la aplicación no arranca en producción
+CLAVES_SECRETAS = ('QR_SECRET_KEY', 'SESION_SECRET_KEY')
+
+def _verificar_claves_secretas():
+    """Falla al arrancar si falta una clave de firma. En DEBUG o TESTING se
+    usa en su lugar una clave aleatoria del proceso (los tokens no sirven en
+    otros procesos ni sobreviven a un reinicio)."""
+    for nombre in CLAVES_SECRETAS:
+        if app.config.get(nombre):
+            continue
+        if not (app.debug or app.testing):
+            raise RuntimeError(f'Falta la clave {nombre}: defínela en el entorno '
+                               f'({nombre} o ASISTENCIA_{nombre}), igual en todos los procesos')
+        app.config[nombre] = secrets.token_urlsafe(32)
+        print(f"{nombre} no definida: se usa una clave aleatoria de este proceso")
+
+# Estado de `app` al importar el módulo: cada create_app() parte de él y no
+# de la configuración que dejó una llamada anterior
+_CONFIG_INICIAL = dict(app.config)
+_WSGI_INICIAL = app.wsgi_app
+
+def _desmontar():
+    """Detiene los componentes y cierra los engines de la llamada anterior a
+    create_app(). La cola diferida vuelca antes lo que tenga pendiente."""
+    for componente in (cola_asistencias, canales_asistencia, verificador_claves):
+        if componente is not None:
+            componente.detener()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    app.config.clear()
+    app.config.update(_CONFIG_INICIAL)
+    app.wsgi_app = _WSGI_INICIAL
+
+def _crear_engines():
+    """Reemplaza los engines de `db` según la configuración vigente.
+
+    db.init_app() registra funciones en la aplicación, algo que Flask no
+    admite después de la primera petición: en las llamadas siguientes a
+    create_app() solo se crean de nuevo los engines, con las mismas opciones.
+    """
+    binds = {None: {**app.config['SQLALCHEMY_ENGINE_OPTIONS'], 'url': app.config['SQLALCHEMY_DATABASE_URI']},
+             **app.config['SQLALCHEMY_BINDS']}
+    with app.app_context():
+        engines = db.engines
+        engines.clear()
+        for clave, opciones in binds.items():
+            engines[clave] = engine_from_config(opciones, prefix='')
+
+def create_app(config=None):
+    """Configura la aplicación y la base de datos y devuelve `app`.
+
+    Aplica, en orden, los valores por defecto de este módulo, las variables de
+    entorno con prefijo `ASISTENCIA_` (interpretadas como JSON cuando se
+    puede) y `config`. El engine se crea aquí, pero sus conexiones se abren
+    recién al primer uso, de modo que un servidor pre-fork que cargue la
+    aplicación antes de bifurcar no comparte sockets entre workers (ver
+    gunicorn.conf.py).
+
+    Cada llamada vuelve a configurar la aplicación desde cero: descarta la
+    configuración, los engines y los componentes de la anterior. Las rutas
+    siguen registradas en el `app` del módulo, así que todas las llamadas
+    devuelven el mismo objeto.
+    """
+    inicializada = 'sqlalchemy' in app.extensions
+    if inicializada:
+        _desmontar()
+
+    app.config.from_prefixed_env('ASISTENCIA')
+    app.config.update(config or {})
+    _verificar_claves_secretas()
+    opciones = {
+        'poolclass': PoolMedido,
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING']
+    }
+    opciones.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones
+    # Flask-SQLAlchemy no aplica SQLALCHEMY_ENGINE_OPTIONS a los binds dados como URI
+    app.config['SQLALCHEMY_BINDS'] = {
+        clave: {**opciones, 'url': valor} if isinstance(valor, str) else {**opciones, **valor}
+        for clave, valor in (app.config.get('SQLALCHEMY_BINDS') or {}).items()
+    }
+    if inicializada:
+        _crear_engines()
+    else:
+        db.init_app(app)
+    if app.config['PROXY_SALTOS']:
+        # request.remote_addr pasa a ser la IP del cliente según el proxy de
+        # confianza más cercano; la cubeta login_ip usa esa dirección
+        saltos = int(app.config['PROXY_SALTOS'])
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=saltos, x_proto=saltos)
+    _crear_componentes()
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Servidor de desarrollo (DEBUG salvo ASISTENCIA_DEBUG=false); en
+    # producción usar gunicorn con wsgi.py
+    app.config['DEBUG'] = True
+    create_app().run(debug=app.debug)
@@ -0,0 +1,267 @@
+"""Migraciones del esquema y verificación de planes de consulta.
+
+Cada migración se aplica una sola vez y queda registrada en `schema_migrations`.
+`explicar` recorre todas las rutas (con los escenarios de benchmark.py), captura
+cada sentencia que ejecutan y corre EXPLAIN sobre ella. Si alguna recorre
+completa la tabla `asistencias`, termina con código 1.
+
+Uso:
+    python migraciones.py estado
+    python migraciones.py aplicar
+    python migraciones.py explicar
+"""
+import argparse
+import re
+import sys
+
+from sqlalchemy import event, text
+
+import main
+
+MIGRACIONES = [
+    ('0001_asistencias_unica', 'Clave única (alumno_id, clase_id, fecha) que usa ON DUPLICATE KEY UPDATE', [
+        # Los upserts sin clave única pudieron insertar duplicados: se conserva el último
+        '''DELETE a1 FROM asistencias a1
+           JOIN asistencias a2 ON a2.alumno_id = a1.alumno_id
+               AND a2.clase_id = a1.clase_id
+               AND a2.fecha = a1.fecha
+               AND a2.id > a1.id''',
+        '''ALTER TABLE asistencias
+           ADD UNIQUE KEY uq_asistencias_alumno_clase_fecha (alumno_id, clase_id, fecha)''',
+    ]),
+    ('0002_asistencias_clase_fecha', 'Índice (clase_id, fecha) para historiales, resúmenes y exportaciones', [
+        'ALTER TABLE asistencias ADD KEY idx_asistencias_clase_fecha (clase_id, fecha)',
+    ]),
+    ('0003_inscripciones_unica', 'Inscripción única por clase y alumno, e índice por alumno', [
+        '''DELETE i1 FROM inscripciones i1
+           JOIN inscripciones i2 ON i2.alumno_id = i1.alumno_id
+               AND i2.clase_id = i1.clase_id
+               AND i2.id > i1.id''',
+        '''ALTER TABLE inscripciones
+           ADD UNIQUE KEY uq_inscripciones_clase_alumno (clase_id, alumno_id),
+           ADD KEY idx_inscripciones_alumno_clase (alumno_id, clase_id)''',
+    ]),
+    ('0004_clases_profesor_nombre', 'Índice (profesor_id, nombre) para la lista de clases del profesor', [
+        'ALTER TABLE clases ADD KEY idx_clases_profesor_nombre (profesor_id, nombre)',
+    ]),
+    ('0005_resumen_asistencia_diaria', 'Tabla de resumen diario por clase', [
+        '''CREATE TABLE IF NOT EXISTS resumen_asistencia_diaria (
+               clase_id INT NOT NULL,
+               fecha DATE NOT NULL,
+               presentes INT NOT NULL DEFAULT 0,
+               ausentes INT NOT NULL DEFAULT 0,
+               total INT NOT NULL DEFAULT 0,
+               PRIMARY KEY (clase_id, fecha)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        # Carga inicial desde el historial existente, igual que `reconstruir-resumen`
+        '''INSERT INTO resumen_asistencia_diaria (clase_id, fecha, presentes, ausentes, total)
+           SELECT clase_id, fecha,
+               COUNT(DISTINCT CASE WHEN estado = 'Presente' THEN alumno_id END),
+               COUNT(DISTINCT CASE WHEN estado = 'Ausente' THEN alumno_id END),
+               COUNT(DISTINCT alumno_id)
+           FROM asistencias
+           GROUP BY clase_id, fecha
+           ON DUPLICATE KEY UPDATE presentes = VALUES(presentes), ausentes = VALUES(ausentes),
+               total = VALUES(total)''',
+    ]),
+    ('0006_contadores_asistencia', 'Contadores por (alumno, clase) para estadísticas y lista de alumnos', [
+        '''CREATE TABLE IF NOT EXISTS contadores_asistencia (
+               alumno_id INT NOT NULL,
+               clase_id INT NOT NULL,
+               total INT NOT NULL DEFAULT 0,
+               presentes INT NOT NULL DEFAULT 0,
+               ausentes INT NOT NULL DEFAULT 0,
+               ultima_fecha DATE NULL,
+               ultimo_estado VARCHAR(20) NULL,
+               PRIMARY KEY (alumno_id, clase_id),
+               KEY idx_contadores_clase_alumno (clase_id, alumno_id)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        # Carga inicial desde el historial existente
+        '''INSERT INTO contadores_asistencia
+               (alumno_id, clase_id, total, presentes, ausentes, ultima_fecha, ultimo_estado)
+           SELECT alumno_id, clase_id, COUNT(*),
+               SUM(CASE WHEN estado = 'Presente' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN estado = 'Ausente' THEN 1 ELSE 0 END),
+               MAX(fecha),
+               SUBSTRING_INDEX(GROUP_CONCAT(estado ORDER BY fecha DESC), ',', 1)
+           FROM asistencias
+           GROUP BY alumno_id, clase_id
+           ON DUPLICATE KEY UPDATE total = VALUES(total), presentes = VALUES(presentes),
+               ausentes = VALUES(ausentes), ultima_fecha = VALUES(ultima_fecha),
+               ultimo_estado = VALUES(ultimo_estado)''',
+    ]),
+    ('0007_archivo_asistencias', 'Archivo comprimido por período de las asistencias antiguas', [
+        '''CREATE TABLE IF NOT EXISTS archivo_periodos (
+               periodo VARCHAR(40) NOT NULL,
+               desde DATE NOT NULL,
+               hasta DATE NOT NULL,
+               filas INT NOT NULL,
+               bytes INT NOT NULL,
+               archivado DATETIME NOT NULL,
+               PRIMARY KEY (periodo),
+               KEY idx_archivo_periodos_hasta (hasta)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS archivo_asistencias (
+               alumno_id INT NOT NULL,
+               clase_id INT NOT NULL,
+               periodo VARCHAR(40) NOT NULL,
+               desde DATE NOT NULL,
+               total INT NOT NULL,
+               presentes INT NOT NULL,
+               ausentes INT NOT NULL,
+               ultima_fecha DATE NOT NULL,
+               ultimo_estado VARCHAR(20) NOT NULL,
+               datos BLOB NOT NULL,
+               PRIMARY KEY (alumno_id, clase_id, periodo),
+               KEY idx_archivo_clase_desde (clase_id, desde)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+    ]),
+    ('0008_log_cambios', 'Log de cambios (seq) alimentado por triggers para la sincronización incremental', [
+        '''CREATE TABLE IF NOT EXISTS cambios (
+               seq BIGINT NOT NULL AUTO_INCREMENT,
+               entidad VARCHAR(20) NOT NULL,
+               clase_id INT NOT NULL,
+               alumno_id INT NULL,
+               fecha DATE NULL,
+               creado TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+               PRIMARY KEY (seq),
+               KEY idx_cambios_alumno_seq (alumno_id, seq),
+               KEY idx_cambios_creado (creado)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        # Los borrados de asistencias solo ocurren al archivar: no son cambios
+        '''CREATE TRIGGER trg_cambios_asistencias_ins AFTER INSERT ON asistencias FOR EACH ROW
+           INSERT INTO cambios (entidad, clase_id, alumno_id, fecha)
+           VALUES ('asistencia', NEW.clase_id, NEW.alumno_id, NEW.fecha)''',
+        # ON DUPLICATE KEY UPDATE con el mismo estado también dispara el trigger
+        '''CREATE TRIGGER trg_cambios_asistencias_upd AFTER UPDATE ON asistencias FOR EACH ROW
+           INSERT INTO cambios (entidad, clase_id, alumno_id, fecha)
+           SELECT 'asistencia', NEW.clase_id, NEW.alumno_id, NEW.fecha
+           FROM DUAL WHERE NOT (NEW.estado <=> OLD.estado)''',
+        '''CREATE TRIGGER trg_cambios_inscripciones_ins AFTER INSERT ON inscripciones FOR EACH ROW
+           INSERT INTO cambios (entidad, clase_id, alumno_id) VALUES ('inscripcion', NEW.clase_id, NEW.alumno_id)''',
+        '''CREATE TRIGGER trg_cambios_inscripciones_del AFTER DELETE ON inscripciones FOR EACH ROW
+           INSERT INTO cambios (entidad, clase_id, alumno_id) VALUES ('inscripcion', OLD.clase_id, OLD.alumno_id)''',
+        '''CREATE TRIGGER trg_cambios_horarios_ins AFTER INSERT ON horarios FOR EACH ROW
+           INSERT INTO cambios (entidad, clase_id) VALUES ('horario', NEW.clase_id)''',
+        '''CREATE TRIGGER trg_cambios_horarios_upd AFTER UPDATE ON horarios FOR EACH ROW
+           INSERT INTO cambios (entidad, clase_id) VALUES ('horario', NEW.clase_id), ('horario', OLD.clase_id)''',
+        '''CREATE TRIGGER trg_cambios_horarios_del AFTER DELETE ON horarios FOR EACH ROW
+           INSERT INTO cambios (entidad, clase_id) VALUES ('horario', OLD.clase_id)''',
+        '''CREATE TRIGGER trg_cambios_clases_upd AFTER UPDATE ON clases FOR EACH ROW
+           INSERT INTO cambios (entidad, clase_id) VALUES ('clase', NEW.id)''',
+    ]),
+]
+
+
+def aplicadas(conn):
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            id VARCHAR(100) NOT NULL,
+            aplicada DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    '''))
+    return {r[0] for r in conn.execute(text('SELECT id FROM schema_migrations'))}
+
+
+def aplicar(engine):
+    with engine.connect() as conn:
+        hechas = aplicadas(conn)
+        conn.commit()
+        for migracion_id, descripcion, sentencias in MIGRACIONES:
+            if migracion_id in hechas:
+                continue
+            print(f'Aplicando {migracion_id}: {descripcion}')
+            # MySQL confirma implícitamente cada ALTER TABLE: se registra al final
+            for sentencia in sentencias:
+                conn.execute(text(sentencia))
+            conn.execute(text('INSERT INTO schema_migrations (id, aplicada) VALUES (:id, NOW())'),
+                         {'id': migracion_id})
+            conn.commit()
+    print('Esquema al día')
+
+
+def estado(engine):
+    with engine.connect() as conn:
+        hechas = aplicadas(conn)
+        conn.commit()
+    for migracion_id, descripcion, _ in MIGRACIONES:
+        print(f"[{'x' if migracion_id in hechas else ' '}] {migracion_id}: {descripcion}")
+
+
+def alias_de_asistencias(sql):
+    """Nombres con los que aparece la tabla asistencias en la sentencia."""
+    alias = {'asistencias'}
+    for m in re.finditer(r'\basistencias\s+(?:AS\s+)?(\w+)', sql, re.IGNORECASE):
+        if m.group(1).upper() not in ('WHERE', 'ON', 'JOIN', 'LEFT', 'GROUP', 'ORDER', 'SET', 'VALUES', 'LIMIT'):
+            alias.add(m.group(1))
+    return alias
+
+
+def explicar(engine):
+    import benchmark
+
+    capturadas = []
+
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and re.match(r'\s*(SELECT|INSERT|UPDATE|DELETE)\b', statement, re.IGNORECASE):
+            capturadas.append((main._endpoint_actual(), statement, parameters))
+
+    ids = benchmark.muestra_ids()
+    lista = benchmark.escenarios(ids)
+    benchmark.verificar_cobertura(lista)
+
+    event.listen(engine, 'before_cursor_execute', capturar)
+    try:
+        cliente = main.app.test_client()
+        for escenario in lista:
+            benchmark.ejecutar(cliente, escenario)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capturar)
+
+    problemas = []
+    vistas = set()
+    with engine.connect() as conn:
+        for endpoint, statement, parameters in capturadas:
+            clave = (endpoint, statement)
+            if clave in vistas:
+                continue
+            vistas.add(clave)
+            alias = alias_de_asistencias(statement)
+            resultado = conn.exec_driver_sql('EXPLAIN ' + statement, parameters)
+            columnas = list(resultado.keys())
+            for fila in resultado:
+                plan = dict(zip(columnas, fila))
+                if plan.get('table') in alias and plan.get('type') in ('ALL', 'index'):
+                    problemas.append((endpoint, plan, main.normalizar_sql(statement)))
+        conn.rollback()
+
+    print(f'{len(vistas)} sentencias analizadas en {len(lista)} escenarios')
+    if problemas:
+        print('\nRecorridos completos de asistencias:')
+        for endpoint, plan, sql in problemas:
+            print(f"  - [{endpoint}] type={plan['type']} table={plan['table']} key={plan.get('key')}: {sql[:200]}")
+        return 1
+    print('Ninguna ruta recorre completa la tabla asistencias')
+    return 0
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('accion', choices=('estado', 'aplicar', 'explicar'))
+    args = parser.parse_args(argv)
+
+    app = main.create_app()
+    with app.app_context():
+        engine = main.db.engine
+        if args.accion == 'aplicar':
+            aplicar(engine)
+        elif args.accion == 'estado':
+            estado(engine)
+        else:
+            return explicar(engine)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,127 @@
+-- Esquema de la base de datos 'appbdd' tal como lo usan las consultas de main.py.
+-- Los índices que necesitan las consultas se agregan con las migraciones.
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    id INT NOT NULL AUTO_INCREMENT,
+    nombre VARCHAR(120) NOT NULL,
+    email VARCHAR(190) NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    tipo VARCHAR(20) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_usuarios_email (email)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS alumnos (
+    id INT NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_alumnos_usuario FOREIGN KEY (id) REFERENCES usuarios (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS profesores (
+    id INT NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_profesores_usuario FOREIGN KEY (id) REFERENCES usuarios (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS clases (
+    id INT NOT NULL AUTO_INCREMENT,
+    nombre VARCHAR(120) NOT NULL,
+    profesor_id INT NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_clases_profesor FOREIGN KEY (profesor_id) REFERENCES profesores (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS inscripciones (
+    id INT NOT NULL AUTO_INCREMENT,
+    alumno_id INT NOT NULL,
+    clase_id INT NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_inscripciones_alumno FOREIGN KEY (alumno_id) REFERENCES alumnos (id),
+    CONSTRAINT fk_inscripciones_clase FOREIGN KEY (clase_id) REFERENCES clases (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS asistencias (
+    id INT NOT NULL AUTO_INCREMENT,
+    alumno_id INT NOT NULL,
+    clase_id INT NOT NULL,
+    fecha DATE NOT NULL,
+    estado VARCHAR(20) NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_asistencias_alumno FOREIGN KEY (alumno_id) REFERENCES alumnos (id),
+    CONSTRAINT fk_asistencias_clase FOREIGN KEY (clase_id) REFERENCES clases (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS horarios (
+    id INT NOT NULL AUTO_INCREMENT,
+    clase_id INT NOT NULL,
+    dia_semana VARCHAR(10) NOT NULL,
+    hora_inicio TIME NOT NULL,
+    hora_fin TIME NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_horarios_clase FOREIGN KEY (clase_id) REFERENCES clases (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Resumen diario pre-agregado (se reconstruye con `flask --app wsgi reconstruir-resumen`)
+CREATE TABLE IF NOT EXISTS resumen_asistencia_diaria (
+    clase_id INT NOT NULL,
+    fecha DATE NOT NULL,
+    presentes INT NOT NULL DEFAULT 0,
+    ausentes INT NOT NULL DEFAULT 0,
+    total INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (clase_id, fecha)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Contadores por alumno y clase (se reconstruyen con `flask --app wsgi reconstruir-contadores`)
+CREATE TABLE IF NOT EXISTS contadores_asistencia (
+    alumno_id INT NOT NULL,
+    clase_id INT NOT NULL,
+    total INT NOT NULL DEFAULT 0,
+    presentes INT NOT NULL DEFAULT 0,
+    ausentes INT NOT NULL DEFAULT 0,
+    ultima_fecha DATE NULL,
+    ultimo_estado VARCHAR(20) NULL,
+    PRIMARY KEY (alumno_id, clase_id),
+    KEY idx_contadores_clase_alumno (clase_id, alumno_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Períodos archivados (`flask --app wsgi archivar-periodo`): una fila por
+-- alumno, clase y período con los agregados y el historial comprimido
+CREATE TABLE IF NOT EXISTS archivo_periodos (
+    periodo VARCHAR(40) NOT NULL,
+    desde DATE NOT NULL,
+    hasta DATE NOT NULL,
+    filas INT NOT NULL,
+    bytes INT NOT NULL,
+    archivado DATETIME NOT NULL,
+    PRIMARY KEY (periodo),
+    KEY idx_archivo_periodos_hasta (hasta)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS archivo_asistencias (
+    alumno_id INT NOT NULL,
+    clase_id INT NOT NULL,
+    periodo VARCHAR(40) NOT NULL,
+    desde DATE NOT NULL,
+    total INT NOT NULL,
+    presentes INT NOT NULL,
+    ausentes INT NOT NULL,
+    ultima_fecha DATE NOT NULL,
+    ultimo_estado VARCHAR(20) NOT NULL,
+    datos BLOB NOT NULL,
+    PRIMARY KEY (alumno_id, clase_id, periodo),
+    KEY idx_archivo_clase_desde (clase_id, desde)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Log de cambios para la sincronización incremental de la app. Lo llenan los
+-- triggers de la migración 0008 (`python migraciones.py aplicar`)
+CREATE TABLE IF NOT EXISTS cambios (
+    seq BIGINT NOT NULL AUTO_INCREMENT,
+    entidad VARCHAR(20) NOT NULL,
+    clase_id INT NOT NULL,
+    alumno_id INT NULL,
+    fecha DATE NULL,
+    creado TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+    PRIMARY KEY (seq),
+    KEY idx_cambios_alumno_seq (alumno_id, seq),
+    KEY idx_cambios_creado (creado)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,333 @@
+"""Comportamiento de las piezas que registran y validan asistencias: tokens
+firmados, historial archivado, limitador de tasa, contadores, registro en lote
+y reporte de riesgo.
+
+Usa una base SQLite temporal; las pocas construcciones propias de MySQL de
+las escrituras (ON DUPLICATE KEY UPDATE, FOR UPDATE, IF, GREATEST, TO_DAYS)
+se traducen al vuelo. Ejecutar con `python -m pytest` desde la raíz del
+proyecto.
+"""
+from datetime import date, timedelta
+import re
+import sqlite3
+
+import pytest
+from sqlalchemy import event
+
+import main
+
+TABLAS = [
+    'CREATE TABLE usuarios (id INTEGER PRIMARY KEY, nombre TEXT, email TEXT, password TEXT, tipo TEXT)',
+    'CREATE TABLE alumnos (id INTEGER PRIMARY KEY)',
+    'CREATE TABLE profesores (id INTEGER PRIMARY KEY)',
+    'CREATE TABLE clases (id INTEGER PRIMARY KEY, nombre TEXT, profesor_id INT)',
+    'CREATE TABLE inscripciones (id INTEGER PRIMARY KEY, alumno_id INT, clase_id INT, UNIQUE (clase_id, alumno_id))',
+    'CREATE TABLE asistencias (id INTEGER PRIMARY KEY, alumno_id INT, clase_id INT, fecha DATE, estado TEXT,'
+    ' UNIQUE (alumno_id, clase_id, fecha))',
+    'CREATE TABLE resumen_asistencia_diaria (clase_id INT, fecha DATE, presentes INT, ausentes INT,'
+    ' total INT, PRIMARY KEY (clase_id, fecha))',
+    'CREATE TABLE contadores_asistencia (alumno_id INT, clase_id INT, total INT, presentes INT,'
+    ' ausentes INT, ultima_fecha DATE, ultimo_estado TEXT, PRIMARY KEY (alumno_id, clase_id))',
+    'CREATE TABLE archivo_periodos (periodo TEXT PRIMARY KEY, desde DATE, hasta DATE, filas INT,'
+    ' bytes INT, archivado DATETIME)',
+]
+
+# Profesor 1 dicta las clases 10 (alumnos 100, 101 y 102) y 30 (300, 301 y
+# 302, solo para el reporte de riesgo) y el profesor 2, la clase 20 (alumno
+# 200). El alumno 103 no está inscrito en ninguna.
+PROFESOR, CLASE, ALUMNOS = 1, 10, (100, 101, 102)
+CLASE_RIESGO, ALUMNOS_RIESGO = 30, (300, 301, 302)
+OTRO_PROFESOR, OTRA_CLASE, NO_INSCRITO = 2, 20, 103
+
+
+def _poblar(ruta):
+    conexion = sqlite3.connect(ruta)
+    for ddl in TABLAS:
+        conexion.execute(ddl)
+    for usuario_id, tipo in [(PROFESOR, 'profesor'), (OTRO_PROFESOR, 'profesor')]:
+        conexion.execute('INSERT INTO usuarios VALUES (?, ?, ?, ?, ?)',
+                         (usuario_id, f'Profesor {usuario_id}', f'p{usuario_id}@x', '-', tipo))
+        conexion.execute('INSERT INTO profesores VALUES (?)', (usuario_id,))
+    for clase_id, profesor_id, alumnos in [(CLASE, PROFESOR, ALUMNOS), (CLASE_RIESGO, PROFESOR, ALUMNOS_RIESGO),
+                                           (OTRA_CLASE, OTRO_PROFESOR, (200,))]:
+        conexion.execute('INSERT INTO clases VALUES (?, ?, ?)', (clase_id, f'Clase {clase_id}', profesor_id))
+        for alumno_id in alumnos:
+            conexion.execute('INSERT INTO inscripciones (alumno_id, clase_id) VALUES (?, ?)', (alumno_id, clase_id))
+    for alumno_id in ALUMNOS + ALUMNOS_RIESGO + (200, NO_INSCRITO):
+        conexion.execute('INSERT INTO usuarios VALUES (?, ?, ?, ?, ?)',
+                         (alumno_id, f'Alumno {alumno_id}', f'a{alumno_id}@x', '-', 'alumno'))
+        conexion.execute('INSERT INTO alumnos VALUES (?)', (alumno_id,))
+    conexion.commit()
+    conexion.close()
+
+
+def _sql_sqlite(sql):
+    sql = sql.replace('ON DUPLICATE KEY UPDATE', 'ON CONFLICT DO UPDATE SET')
+    sql = re.sub(r'VALUES\((\w+)\)', r'excluded.\1', sql)
+    sql = re.sub(r'\bFOR UPDATE\b', '', sql)
+    return re.sub(r'\bIF\(', 'IIF(', sql)
+
+
+def _greatest(a, b):
+    return a if b is None else b if a is None else max(a, b)
+
+
+def _to_days(fecha):
+    # TO_DAYS de MySQL cuenta desde el año 0, toordinal desde el 1
+    return date.fromisoformat(str(fecha)).toordinal() + 365
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    ruta = tmp_path_factory.mktemp('asistencia') / 'asistencia.db'
+    _poblar(ruta)
+    app = main.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{ruta}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'detect_types': sqlite3.PARSE_DECLTYPES}},
+        'LIMITES_ACTIVOS': False,
+    })
+    with app.app_context():
+        engine = main.db.engine
+
+    @event.listens_for(engine, 'connect')
+    def _funciones(conexion, registro):
+        conexion.create_function('GREATEST', 2, _greatest)
+        conexion.create_function('TO_DAYS', 1, _to_days)
+
+    @event.listens_for(engine, 'before_cursor_execute', retval=True)
+    def _traducir(conn, cursor, sql, parametros, contexto, executemany):
+        return _sql_sqlite(sql), parametros
+
+    return app
+
+
+@pytest.fixture
+def cliente(app):
+    return app.test_client()
+
+
+def _sesion(usuario_id, tipo='profesor'):
+    return {'Authorization': f'Bearer {main.firmar_token_sesion(usuario_id, tipo)}'}
+
+
+def _consultar(app, sql, **params):
+    with app.app_context():
+        return [tuple(fila) for fila in main.execute_query(sql, params)]
+
+
+def _alterar(token):
+    """Cambia el último carácter de la firma por otro válido en base64."""
+    return token[:-1] + ('A' if token[-1] != 'A' else 'B')
+
+
+def test_token_qr_valido(app):
+    token = main.firmar_token_qr(CLASE, emitido=1000)
+    clase_id, nonce, emitido = main.verificar_token_qr(token, ahora=1010)
+    assert (clase_id, emitido) == (CLASE, 1000)
+    assert token.split('.')[2] == nonce
+
+
+def test_token_qr_rechaza_firma_alterada_y_otra_clase(app):
+    token = main.firmar_token_qr(CLASE, emitido=1000)
+    with pytest.raises(ValueError, match='no válido'):
+        main.verificar_token_qr(_alterar(token), ahora=1010)
+    # La firma cubre la clase: no sirve para marcar otra
+    _, emitido, nonce, firma = token.split('.')
+    with pytest.raises(ValueError, match='no válido'):
+        main.verificar_token_qr(f'{OTRA_CLASE}.{emitido}.{nonce}.{firma}', ahora=1010)
+
+
+def test_token_qr_vencido_o_mal_formado(app):
+    validez = app.config['QR_VALIDEZ_SEGUNDOS']
+    token = main.firmar_token_qr(CLASE, emitido=1000)
+    assert main.verificar_token_qr(token, ahora=1000 + validez)
+    with pytest.raises(ValueError, match='expirado'):
+        main.verificar_token_qr(token, ahora=1000 + validez + 1)
+    with pytest.raises(ValueError, match='expirado'):
+        main.verificar_token_qr(token, ahora=1000 - 31)
+    for invalido in (None, '', 'a.b.c', f'{token}.extra'):
+        with pytest.raises(ValueError, match='Formato'):
+            main.verificar_token_qr(invalido, ahora=1010)
+
+
+def test_token_sesion(app):
+    validez = app.config['SESION_VALIDEZ_SEGUNDOS']
+    token = main.firmar_token_sesion(PROFESOR, 'profesor', inicio=900, ahora=1000)
+    assert main.verificar_token_sesion(token, ahora=1000 + validez) == (PROFESOR, 'profesor', 900)
+    with pytest.raises(ValueError, match='expirada'):
+        main.verificar_token_sesion(token, ahora=1000 + validez + 1)
+    with pytest.raises(ValueError, match='no válido'):
+        main.verificar_token_sesion(_alterar(token), ahora=1000)
+    # Cambiar el tipo invalida la firma
+    usuario_id, _, inicio, expira, firma = token.split('.')
+    with pytest.raises(ValueError, match='no válido'):
+        main.verificar_token_sesion(f'{usuario_id}.admin.{inicio}.{expira}.{firma}', ahora=1000)
+    # Un token QR no sirve como sesión
+    with pytest.raises(ValueError, match='Formato'):
+        main.verificar_token_sesion(main.firmar_token_qr(CLASE), ahora=1000)
+
+
+@pytest.mark.parametrize('registros', [
+    [],
+    [(0, 'Presente')],
+    [(0, 'Presente'), (1, 'Ausente'), (2, 'Ausente'), (9, 'Presente'), (400, 'Ausente')],
+])
+def test_historial_ida_y_vuelta(registros):
+    desde = date(2024, 3, 1)
+    registros = [(desde + timedelta(days=d), estado) for d, estado in registros]
+    datos = main.codificar_historial(desde, registros)
+    assert isinstance(datos, bytes)
+    assert list(main.decodificar_historial(desde, datos)) == registros
+
+
+def test_historial_comprime_periodos_largos():
+    desde = date(2024, 1, 1)
+    registros = [(desde + timedelta(days=d), 'Presente' if d % 7 else 'Ausente') for d in range(365)]
+    datos = main.codificar_historial(desde, registros)
+    assert len(datos) < 100
+    assert list(main.decodificar_historial(desde, datos)) == registros
+
+
+def test_limitador_rellena_a_su_tasa_sin_pasar_la_capacidad(monkeypatch):
+    reloj = [100.0]
+    monkeypatch.setattr(main.time, 'monotonic', lambda: reloj[0])
+    limitador = main.LimitadorTasa('prueba', capacidad=2, por_segundo=1)
+
+    assert [limitador.consumir('a'), limitador.consumir('a')] == [0, 0]
+    assert limitador.consumir('a') == 1.0
+    assert limitador.consumir('b') == 0  # cada clave tiene su cubeta
+    reloj[0] += 0.5
+    assert limitador.consumir('a') == 0.5
+    reloj[0] += 0.5
+    assert limitador.consumir('a') == 0
+    # Tras una espera larga la cubeta queda llena, no más
+    reloj[0] += 100
+    assert [limitador.consumir('a'), limitador.consumir('a')] == [0, 0]
+    assert limitador.consumir('a') > 0
+    assert limitador.rechazos == 3
+
+
+def _escribir(app, filas, fecha):
+    with app.app_context():
+        diferencias = main.escribir_asistencias(CLASE, filas, fecha=fecha)
+        main.db.session.commit()
+        return diferencias
+
+
+def _contador(app, alumno_id):
+    return _consultar(app, '''
+        SELECT total, presentes, ausentes, ultima_fecha, ultimo_estado
+        FROM contadores_asistencia WHERE alumno_id = :alumno_id AND clase_id = :clase_id
+    ''', alumno_id=alumno_id, clase_id=CLASE)[0]
+
+
+def test_contadores_al_remarcar_una_fecha_anterior(app):
+    alumno_id = ALUMNOS[0]
+    reciente, anterior = date(2024, 5, 10), date(2024, 5, 3)
+
+    _escribir(app, [(alumno_id, 'Presente')], reciente)
+    assert _contador(app, alumno_id) == (1, 1, 0, reciente, 'Presente')
+
+    # Un día anterior suma al total sin mover el último estado
+    assert _escribir(app, [(alumno_id, 'Ausente')], anterior) == {'presentes': 0, 'ausentes': 1}
+    assert _contador(app, alumno_id) == (2, 1, 1, reciente, 'Presente')
+
+    # Corregir ese día mueve el registro entre presentes y ausentes
+    assert _escribir(app, [(alumno_id, 'Presente')], anterior) == {'presentes': 1, 'ausentes': -1}
+    assert _contador(app, alumno_id) == (2, 2, 0, reciente, 'Presente')
+
+    # Remarcar con el mismo estado no cambia nada
+    assert _escribir(app, [(alumno_id, 'Presente')], anterior) == {'presentes': 0, 'ausentes': 0}
+    assert _contador(app, alumno_id) == (2, 2, 0, reciente, 'Presente')
+
+    # Corregir el día más reciente sí cambia el último estado
+    _escribir(app, [(alumno_id, 'Ausente')], reciente)
+    assert _contador(app, alumno_id) == (2, 1, 1, reciente, 'Ausente')
+
+    assert _consultar(app, '''
+        SELECT fecha, presentes, ausentes, total FROM resumen_asistencia_diaria
+        WHERE clase_id = :clase_id AND fecha IN (:anterior, :reciente) ORDER BY fecha
+    ''', clase_id=CLASE, anterior=anterior, reciente=reciente) == [(anterior, 1, 0, 1), (reciente, 0, 1, 1)]
+
+
+def _lote(cliente, asistencias, profesor_id=PROFESOR, clase_id=CLASE):
+    return cliente.post(f'/profesor/{profesor_id}/clase/{clase_id}/asistencia/lote',
+                        json={'asistencias': asistencias}, headers=_sesion(profesor_id))
+
+
+def test_lote_rechaza_filas_invalidas_y_registra_las_demas(app, cliente):
+    respuesta = _lote(cliente, [
+        {'alumno_id': ALUMNOS[1], 'estado': 'Presente'},
+        {'alumno_id': ALUMNOS[2], 'estado': 'Ausente'},
+        {'alumno_id': str(ALUMNOS[0]), 'estado': 'Presente'},
+        {'alumno_id': True, 'estado': 'Presente'},
+        {'alumno_id': ALUMNOS[0], 'estado': 'Tarde'},
+        {'alumno_id': NO_INSCRITO, 'estado': 'Presente'},
+        {'alumno_id': 200, 'estado': 'Presente'},
+        {'alumno_id': ALUMNOS[1], 'estado': 'Ausente'},
+        'no es un objeto',
+    ])
+    assert respuesta.status_code == 200, respuesta.get_data(as_text=True)
+    datos = respuesta.get_json()
+    assert (datos['registrados'], datos['rechazados']) == (2, 7)
+    motivos = [r.get('motivo') for r in datos['resultados']]
+    assert motivos[:2] == [None, None]
+    assert motivos[2:4] == ['alumno_id inválido'] * 2
+    assert motivos[4].startswith('Estado inválido')
+    assert motivos[5:7] == ['El alumno no está inscrito en la clase'] * 2
+    assert motivos[7] == 'Alumno repetido en el lote'
+    assert motivos[8] == 'alumno_id inválido'
+
+    # Solo las filas válidas llegan a la base, con el primer estado del alumno repetido
+    assert _consultar(app, '''
+        SELECT alumno_id, estado FROM asistencias
+        WHERE clase_id = :clase_id AND alumno_id IN (:a, :b, :c) ORDER BY alumno_id
+    ''', clase_id=CLASE, a=ALUMNOS[1], b=ALUMNOS[2], c=NO_INSCRITO) == [
+        (ALUMNOS[1], 'Presente'), (ALUMNOS[2], 'Ausente')]
+
+
+@pytest.mark.parametrize('asistencias', [[], None, 'x'])
+def test_lote_sin_asistencias(cliente, asistencias):
+    respuesta = _lote(cliente, asistencias)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error'] == 'Datos incompletos'
+
+
+def test_lote_de_clase_ajena(app, cliente):
+    antes = _consultar(app, 'SELECT COUNT(*) FROM asistencias')
+    respuesta = _lote(cliente, [{'alumno_id': 200, 'estado': 'Presente'}], clase_id=OTRA_CLASE)
+    assert respuesta.status_code == 403
+    assert _consultar(app, 'SELECT COUNT(*) FROM asistencias') == antes
+
+
+def test_riesgo_porcentaje_y_rachas(app):
+    pytest.importorskip('numpy')
+    desde = date(2024, 9, 2)
+    historiales = {
+        # Racha vigente de tres ausencias, máxima de tres
+        ALUMNOS_RIESGO[0]: 'PPAAA',
+        # Ausencias aisladas: 60 % y racha actual 0, máxima 2
+        ALUMNOS_RIESGO[1]: 'AAPPP',
+        # Sin riesgo: racha máxima 1, actual 1
+        ALUMNOS_RIESGO[2]: 'PPPPA',
+        # Ausente siempre, pero no está inscrito: no cuenta
+        NO_INSCRITO: 'AAAAA',
+    }
+    with app.app_context():
+        for dia in range(5):
+            filas = [(a, 'Presente' if h[dia] == 'P' else 'Ausente') for a, h in historiales.items()]
+            main.escribir_asistencias(CLASE_RIESGO, filas, fecha=desde + timedelta(days=dia))
+        main.db.session.commit()
+        reporte = main.calcular_riesgo(desde, umbral=75, racha_minima=3)
+
+    assert [r['alumno_id'] for r in reporte] == [ALUMNOS_RIESGO[0], ALUMNOS_RIESGO[1]]
+    primero, segundo = reporte
+    assert (primero['total'], primero['presentes'], primero['porcentaje_asistencia']) == (5, 2, 40.0)
+    assert primero['clases'][0]['racha_actual'] == 3
+    assert primero['clases'][0]['racha_maxima'] == 3
+    assert primero['clases'][0]['motivos'] == ['porcentaje', 'racha']
+    assert segundo['porcentaje_asistencia'] == 60.0
+    assert segundo['clases'][0]['racha_actual'] == 0
+    assert segundo['clases'][0]['racha_maxima'] == 2
+    assert segundo['clases'][0]['motivos'] == ['porcentaje']
@@ -0,0 +1,112 @@
+"""Las rutas del panel del profesor cuestan un número fijo de consultas SQL,
+sin importar cuántas clases o alumnos haya.
+
+Usa una base SQLite temporal: las consultas de estas rutas no usan sintaxis
+propia de MySQL. Ejecutar con `python -m pytest` desde la raíz del proyecto.
+"""
+from datetime import date, timedelta
+import sqlite3
+
+import pytest
+
+import main
+
+N = 5
+
+TABLAS = [
+    'CREATE TABLE usuarios (id INTEGER PRIMARY KEY, nombre TEXT, email TEXT, password TEXT, tipo TEXT)',
+    'CREATE TABLE alumnos (id INTEGER PRIMARY KEY)',
+    'CREATE TABLE profesores (id INTEGER PRIMARY KEY)',
+    'CREATE TABLE clases (id INTEGER PRIMARY KEY, nombre TEXT, profesor_id INT)',
+    'CREATE TABLE inscripciones (id INTEGER PRIMARY KEY, alumno_id INT, clase_id INT)',
+    'CREATE TABLE resumen_asistencia_diaria (clase_id INT, fecha DATE, presentes INT, ausentes INT,'
+    ' total INT, PRIMARY KEY (clase_id, fecha))',
+    'CREATE TABLE contadores_asistencia (alumno_id INT, clase_id INT, total INT, presentes INT,'
+    ' ausentes INT, ultima_fecha DATE, ultimo_estado TEXT, PRIMARY KEY (alumno_id, clase_id))',
+]
+
+# Profesor 1 dicta N clases y el profesor 2, 2N, con N y 2N alumnos en cada
+# una; las clases 100 y 200 (profesor 3) tienen N y 2N días de resumen
+PROFESORES = {1: N, 2: 2 * N}
+CLASE_CHICA, CLASE_GRANDE = 100, 200
+
+
+def _poblar(ruta):
+    conexion = sqlite3.connect(ruta)
+    for ddl in TABLAS:
+        conexion.execute(ddl)
+    hoy = date.today()
+    siguiente_alumno = 1000
+    clase_id = 1
+    clases = []
+    for profesor_id, cantidad in list(PROFESORES.items()) + [(3, None)]:
+        conexion.execute('INSERT INTO usuarios VALUES (?, ?, ?, ?, ?)',
+                         (profesor_id, f'Profesor {profesor_id}', f'p{profesor_id}@x', '-', 'profesor'))
+        conexion.execute('INSERT INTO profesores VALUES (?)', (profesor_id,))
+        for _ in range(cantidad or 0):
+            clases.append((clase_id, profesor_id, cantidad))
+            clase_id += 1
+    clases += [(CLASE_CHICA, 3, N), (CLASE_GRANDE, 3, 2 * N)]
+    for clase_id, profesor_id, alumnos in clases:
+        conexion.execute('INSERT INTO clases VALUES (?, ?, ?)', (clase_id, f'Clase {clase_id}', profesor_id))
+        for _ in range(alumnos):
+            alumno_id = siguiente_alumno
+            siguiente_alumno += 1
+            conexion.execute('INSERT INTO usuarios VALUES (?, ?, ?, ?, ?)',
+                             (alumno_id, f'Alumno {alumno_id}', f'a{alumno_id}@x', '-', 'alumno'))
+            conexion.execute('INSERT INTO alumnos VALUES (?)', (alumno_id,))
+            conexion.execute('INSERT INTO inscripciones (alumno_id, clase_id) VALUES (?, ?)', (alumno_id, clase_id))
+            conexion.execute('INSERT INTO contadores_asistencia VALUES (?, ?, 3, 2, 1, ?, ?)',
+                             (alumno_id, clase_id, hoy.isoformat(), 'Presente'))
+        if profesor_id == 3:
+            for dia in range(alumnos):
+                conexion.execute('INSERT INTO resumen_asistencia_diaria VALUES (?, ?, ?, 0, ?)',
+                                 (clase_id, (hoy - timedelta(days=dia)).isoformat(), alumnos, alumnos))
+    conexion.commit()
+    conexion.close()
+
+
+@pytest.fixture(scope='module')
+def cliente(tmp_path_factory):
+    ruta = tmp_path_factory.mktemp('consultas') / 'asistencia.db'
+    _poblar(ruta)
+    app = main.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{ruta}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'detect_types': sqlite3.PARSE_DECLTYPES}},
+        'METRICAS_CABECERAS': True,
+        'LIMITES_ACTIVOS': False,
+    })
+    cliente = app.test_client()
+    # Cargar el índice de acceso (dos consultas, una vez por proceso) antes de contar
+    assert cliente.get('/profesor/1/clase/1/resumen-dia').status_code == 200
+    return cliente
+
+
+def _sesion(profesor_id):
+    return {'Authorization': f"Bearer {main.firmar_token_sesion(profesor_id, 'profesor')}"}
+
+
+def _consultas(cliente, url, headers=None):
+    respuesta = cliente.get(url, headers=headers)
+    assert respuesta.status_code == 200, respuesta.get_data(as_text=True)
+    return int(respuesta.headers['X-SQL-Consultas']), respuesta.get_json()
+
+
+def test_clases_profesor_no_crece_con_las_clases(cliente):
+    chica, clases_chica = _consultas(cliente, '/profesor/1/clases')
+    grande, clases_grande = _consultas(cliente, '/profesor/2/clases')
+    assert (len(clases_chica), len(clases_grande)) == (N, 2 * N)
+    assert clases_grande[0]['total_alumnos'] == 2 * N
+    assert chica == grande == 1
+
+
+@pytest.mark.parametrize('url', [
+    '/clases/{clase_id}/alumnos',
+    '/profesor/3/clase/{clase_id}/resumen',
+    '/profesor/3/clase/{clase_id}/resumen-dia',
+])
+def test_rutas_de_clase_no_crecen_con_los_alumnos(cliente, url):
+    chica, _ = _consultas(cliente, url.format(clase_id=CLASE_CHICA), _sesion(3))
+    grande, _ = _consultas(cliente, url.format(clase_id=CLASE_GRANDE), _sesion(3))
+    assert chica == grande
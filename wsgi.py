@@ -0,0 +1,9 @@
+"""Punto de entrada WSGI de producción.
+
+Uso:
+    gunicorn -c gunicorn.conf.py wsgi:app
+    flask --app wsgi reconstruir-resumen
+"""
+from main import create_app
+
+app = create_app()